@@ -0,0 +1,101 @@
+import threading
+import time
+
+"""
+
+Cached account balances.
+
+AccountCache keeps the result of one get_accounts() call keyed by currency,
+so reading several balances in a decision cycle costs at most one REST call.
+The snapshot expires after `ttl` seconds, is dropped by invalidate() after
+placing an order, and can be kept current between refreshes from fills or
+user channel messages.
+
+"""
+
+
+class AccountCache(object):
+    """ Per-currency account snapshot with a TTL.
+    Attributes:
+        accounts (dict): Account dicts from get_accounts(), by currency.
+        updated (float): Monotonic time of the last refresh, or None.
+    """
+
+    def __init__(self, auth_client, ttl=5.):
+        """ Create an account cache.
+        Args:
+            auth_client (AuthenticatedClient): Client used for get_accounts().
+            ttl (Optional[float]): Seconds a snapshot stays valid.
+        """
+        self.auth_client = auth_client
+        self.ttl = ttl
+        self.accounts = {}
+        self.updated = None
+        self.lock = threading.Lock()
+
+    @property
+    def stale(self):
+        return self.updated is None or time.monotonic() - self.updated > self.ttl
+
+    def refresh(self):
+        """ Replace the snapshot with one get_accounts() call. """
+        accounts = self.auth_client.get_accounts()
+        if not isinstance(accounts, list):
+            raise ValueError('Could not get accounts: {}'.format(accounts))
+        with self.lock:
+            self.accounts = dict((x['currency'], x) for x in accounts)
+            self.updated = time.monotonic()
+        return self.accounts
+
+    def invalidate(self):
+        """ Force the next read to refresh, e.g. after placing an order. """
+        self.updated = None
+
+    def get(self, currency):
+        """ Account dict for `currency`, refreshing first if stale. """
+        if self.stale:
+            self.refresh()
+        return self.accounts[currency]
+
+    def available(self, currency):
+        """ Available balance of `currency` as a float, 0 without an account. """
+        if self.stale:
+            self.refresh()
+        account = self.accounts.get(currency)
+        return float(account['available']) if account is not None else 0.
+
+    def balance(self, currency):
+        """ Total balance of `currency`, including holds, as a float. """
+        return float(self.get(currency)['balance'])
+
+    def _adjust(self, currency, amount):
+        account = self.accounts.get(currency)
+        if account is None:
+            return
+        for key in ('balance', 'available'):
+            account[key] = str(float(account[key]) + amount)
+
+    def apply_fill(self, fill):
+        """ Update balances from a get_fills() entry without a REST call.
+        Args:
+            fill (dict): Fill with product_id, side, price, size and fee.
+        """
+        base, quote = fill['product_id'].split('-')
+        size = float(fill['size'])
+        value = size * float(fill['price'])
+        fee = float(fill.get('fee') or 0)
+        with self.lock:
+            if fill['side'] == 'buy':
+                self._adjust(base, size)
+                self._adjust(quote, -value - fee)
+            else:
+                self._adjust(base, -size)
+                self._adjust(quote, value - fee)
+
+    def on_message(self, msg):
+        """ Handle a user channel message from feed.WebsocketFeed.
+        Matches carry no fee, so any match or completed order expires the
+        snapshot instead of adjusting it.
+        """
+        if msg.get('type') in ('match', 'done'):
+            self.invalidate()
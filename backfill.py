@@ -0,0 +1,156 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+
+from cbpro import PublicClient
+from store import CANDLE_DTYPE, CandleStore, fetch_window, windows
+
+"""
+
+Paginated backfill for get_product_historic_rates().
+
+The candles endpoint rejects requests over 200 bars, so a long [start, end)
+range is split into 200-bar windows that are fetched concurrently under the
+shared public rate limiter from cbpro. Windows are merged back in time order, overlapping and
+duplicate bars are dropped, gaps are optionally filled, and the result is
+streamed into a CandleStore as soon as each leading window is complete.
+
+Gap filling:
+- 'none': Leave gaps; only bars published by the exchange are kept.
+- 'ffill': Insert flat bars (open = high = low = close = previous close,
+  volume = 0) for every missing interval between two published bars.
+
+"""
+
+FILL_MODES = ['none', 'ffill']
+
+
+def to_epoch(value):
+    """ Convert epoch seconds, a datetime or an ISO 8601 string to epoch seconds. """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, str):
+        return to_epoch(datetime.fromisoformat(value.replace('Z', '+00:00')))
+    return int(value)
+
+
+def fill_gaps(records, granularity, previous=None):
+    """ Forward-fill missing intervals between bars.
+    Args:
+        records (np.ndarray): Sorted CANDLE_DTYPE bars.
+        granularity (int): Bar size in seconds
+        previous (Optional[np.void]): Last bar before `records`, so gaps at
+            the start of a window are filled as well.
+    Returns:
+        np.ndarray: Bars on a continuous `granularity` grid.
+    """
+    if previous is not None:
+        records = np.concatenate([np.array([previous], dtype=CANDLE_DTYPE), records])
+    if len(records) < 2:
+        return records if previous is None else records[1:]
+
+    start = records['time'][0]
+    times = np.arange(start, records['time'][-1] + granularity, granularity)
+    filled = np.zeros(len(times), dtype=CANDLE_DTYPE)
+    filled['time'] = times
+    slots = (records['time'] - start) // granularity
+    # Index of the latest real bar at or before each slot.
+    present = np.zeros(len(times), dtype=bool)
+    present[slots] = True
+    source = np.maximum.accumulate(np.where(present, np.arange(len(times)), 0))
+    close = np.zeros(len(times))
+    close[slots] = records['close']
+    close = close[source]
+    for name in ['low', 'high', 'open', 'close']:
+        filled[name] = close
+    for name in CANDLE_DTYPE.names[1:]:
+        filled[name][slots] = records[name]
+    return filled if previous is None else filled[1:]
+
+
+def iter_backfill(product_id, start, end, granularity=60, client=None,
+                  workers=4, limiter=None, fill='none'):
+    """ Fetch [start, end) in concurrent 200-bar windows, yielding in order.
+    Args:
+        product_id (str): Product
+        start (int/datetime/str): Start of range, inclusive.
+        end (int/datetime/str): End of range, exclusive.
+        granularity (Optional[int]): Bar size in seconds. Default is 60.
+        client (Optional[PublicClient]): Client to use. By default each
+            worker thread gets its own PublicClient.
+        workers (Optional[int]): Concurrent requests. Default is 4.
+        limiter (Optional[RateLimiter]): Request budget for the per-thread
+            clients. Defaults to the process-wide public limiter.
+        fill (Optional[str]): Gap handling, one of FILL_MODES.
+    Yields:
+        np.ndarray: CANDLE_DTYPE bars for each window, in time order.
+    """
+    if fill not in FILL_MODES:
+        raise ValueError('Specified fill is {}, must be in approved values: {}'.format(
+            fill, FILL_MODES))
+    start = to_epoch(start)
+    end = to_epoch(end)
+    start = -(-start // granularity) * granularity
+
+    local = threading.local()
+
+    def fetch(window):
+        if client is not None:
+            pc = client
+        else:
+            if not hasattr(local, 'client'):
+                local.client = PublicClient()
+                if limiter is not None:
+                    local.client.limiter = limiter
+            pc = local.client
+        return fetch_window(pc, product_id, granularity, *window)
+
+    previous = None
+    last = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() returns results in submission order, so each window is
+        # yielded as soon as it and every window before it have arrived.
+        for records in executor.map(fetch, windows(start, end, granularity)):
+            if last is not None:
+                records = records[records['time'] > last]
+            if fill == 'ffill' and len(records):
+                records = fill_gaps(records, granularity, previous)
+            if len(records):
+                last = records['time'][-1]
+                previous = records[-1]
+                yield records
+
+
+def backfill(product_id, start, end, granularity=60, store=None, **kwargs):
+    """ Backfill a range of candles into the local store.
+    Bars older than the first stored bar are fetched and merged in front of
+    it, and bars newer than the last stored bar are appended; the stored
+    range in between is not fetched again.
+    Args:
+        product_id (str): Product
+        start (int/datetime/str): Start of range, inclusive.
+        end (int/datetime/str): End of range, exclusive.
+        granularity (Optional[int]): Bar size in seconds. Default is 60.
+        store (Optional[CandleStore]): Destination store.
+        **kwargs: Passed to iter_backfill().
+    Returns:
+        int: Number of bars written.
+    """
+    if store is None:
+        store = CandleStore()
+    start = to_epoch(start)
+    end = to_epoch(end)
+    written = 0
+    first = store.first_time(product_id, granularity)
+    if first is not None and start < first:
+        written += store.prepend(product_id, granularity, iter_backfill(
+            product_id, start, min(end, first), granularity, **kwargs))
+    last = store.last_time(product_id, granularity)
+    if last is not None:
+        start = max(start, last + granularity)
+    for records in iter_backfill(product_id, start, end, granularity, **kwargs):
+        written += len(store.append(product_id, granularity, records))
+    return written
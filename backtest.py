@@ -0,0 +1,208 @@
+import numpy as np
+
+from indicators import crossover_table
+
+"""
+
+Vectorized backtest of the History/Account crossover.
+
+Mirrors run(): after each bar closes, if SMA(avg1) > SMA(avg2) the account
+buys `size` BTC, otherwise it sells `size` BTC, until it is either fully long
+(`max_position`) or flat. Orders are market orders filled at the next bar's
+open and charged the taker `fee`. A buy the cash cannot cover ends the run of
+buys, as the exchange rejects it, so cash never goes negative.
+
+Within a run of bars with the same signal the position moves monotonically,
+so positions are computed per run and expanded back to bars with array
+operations. Fills, fees and equity are then plain vectorized arithmetic.
+
+"""
+
+HOURS_PER_YEAR = 24 * 365
+
+
+class BacktestResult(object):
+    """ Output of backtest().
+    Attributes:
+        time (np.ndarray): Bar open times, epoch seconds.
+        close (np.ndarray): Bar closes.
+        signal (np.ndarray): True where fast SMA > slow SMA at bar close.
+        position (np.ndarray): BTC held at the end of each bar.
+        fills (np.ndarray): Signed BTC traded at the open of each bar.
+        fees (np.ndarray): Fees paid at each bar, in USD.
+        cash (np.ndarray): USD held at the end of each bar.
+        equity (np.ndarray): Cash plus position marked at the close.
+        stats (dict): Summary statistics, see stats().
+    """
+
+    def __init__(self, time, close, signal, position, fills, fees, cash, equity, granularity):
+        self.time = time
+        self.close = close
+        self.signal = signal
+        self.position = position
+        self.fills = fills
+        self.fees = fees
+        self.cash = cash
+        self.equity = equity
+        self.granularity = granularity
+        self.stats = stats(equity, fills, fees, granularity)
+
+    def plot(self, path=None):
+        """ Plot equity against BTC-USD, as in bt.png.
+        Args:
+            path (Optional[str]): Save the figure here instead of showing it.
+        """
+        import matplotlib.pyplot as plt
+        from datetime import datetime, timezone
+        dates = [datetime.fromtimestamp(t, timezone.utc) for t in self.time]
+        plt.figure(figsize=(15, 8))
+        plt.plot(dates, self.equity, label='equity')
+        plt.plot(dates, self.close, label='btc-usd')
+        plt.legend(loc='upper left')
+        if path is None:
+            plt.show()
+        else:
+            plt.savefig(path)
+            plt.close()
+
+
+def stats(equity, fills, fees, granularity):
+    """ Summary statistics for an equity curve.
+    Returns:
+        dict: total_return, annual_return, max_drawdown, sharpe, trades and
+            fees. Returns are relative to the starting equity.
+    """
+    years = len(equity) * granularity / (HOURS_PER_YEAR * 60 * 60)
+    start, end = equity[0], equity[-1]
+    total_return = end / start - 1 if start else np.nan
+    peak = np.maximum.accumulate(equity)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drawdown = np.where(peak > 0, equity / peak - 1, 0.)
+        returns = np.diff(equity) / equity[:-1]
+        annual_return = (end / start) ** (1 / years) - 1 if years and start else np.nan
+    returns = returns[np.isfinite(returns)]
+    bars_per_year = HOURS_PER_YEAR * 60 * 60 / granularity
+    deviation = returns.std() if len(returns) else 0.
+    sharpe = returns.mean() / deviation * np.sqrt(bars_per_year) if deviation else np.nan
+    return {
+        'total_return': float(total_return),
+        'annual_return': float(annual_return),
+        'max_drawdown': float(drawdown.min()) if len(drawdown) else 0.,
+        'sharpe': float(sharpe),
+        'trades': int(np.count_nonzero(fills)),
+        'fees': float(fees.sum()),
+    }
+
+
+def step_positions(signal, max_steps, cost=None, proceeds=None, cash=None):
+    """ Position, in `size` steps, after each bar.
+    Each bar steps one unit up while `signal` is True and one unit down
+    while it is False, clipped to [0, max_steps]. Given `cash`, a run of
+    buys also stops at the first step it cannot pay for, as the exchange
+    rejects an order the balance cannot cover.
+    Args:
+        signal (np.ndarray): Boolean signal per bar.
+        max_steps (int): Steps needed to be fully long.
+        cost (Optional[np.ndarray]): Cash paid for a step bought after each
+            bar, fee included.
+        proceeds (Optional[np.ndarray]): Cash received for a step sold after
+            each bar, net of the fee.
+        cash (Optional[float]): Starting cash; unlimited if None.
+    Returns:
+        np.ndarray: Integer steps held after each bar.
+    """
+    n = len(signal)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Split into runs of identical signal.
+    starts = np.flatnonzero(np.concatenate([[True], signal[1:] != signal[:-1]]))
+    lengths = np.diff(np.append(starts, n))
+    up = signal[starts]
+
+    # Position entering and leaving each run; one scalar per crossover, not
+    # per bar.
+    entry = np.empty(len(starts), dtype=np.int64)
+    exit_ = np.empty(len(starts), dtype=np.int64)
+    position = 0
+    for i in range(len(starts)):
+        entry[i] = position
+        start = starts[i]
+        if up[i]:
+            steps = min(max_steps - position, lengths[i])
+            if cash is not None and steps > 0:
+                paid = np.cumsum(cost[start:start + steps])
+                steps = int(np.searchsorted(paid, cash, side='right'))
+                if steps:
+                    cash -= paid[steps - 1]
+            position += steps
+        else:
+            steps = min(position, lengths[i])
+            if cash is not None and steps > 0:
+                cash += proceeds[start:start + steps].sum()
+            position -= steps
+        exit_[i] = position
+
+    run = np.repeat(np.arange(len(starts)), lengths)
+    offset = np.arange(n) - starts[run] + 1
+    direction = np.where(up, 1, -1)[run]
+    low = np.minimum(entry, exit_)[run]
+    high = np.maximum(entry, exit_)[run]
+    return np.clip(entry[run] + direction * offset, low, high)
+
+
+def backtest(candles, avg1=50, avg2=100, size=0.001, cash=None,
+             max_position=None, fee=0.005, granularity=3600, signal=None):
+    """ Backtest the moving average crossover on an array of candles.
+    Args:
+        candles (np.ndarray): Bars in store.CANDLE_DTYPE, ascending by time.
+        avg1 (Optional[int]): Fast window. Default is 50.
+        avg2 (Optional[int]): Slow window. Default is 100.
+        size (Optional[float]): BTC per order, as Account.size.
+        cash (Optional[float]): Starting USD. Defaults to the first close,
+            i.e. enough for one BTC.
+        max_position (Optional[float]): BTC held when fully long. Defaults
+            to what `cash` buys at the first close.
+        fee (Optional[float]): Taker fee as a fraction of notional.
+        granularity (Optional[int]): Bar size in seconds, for annualizing.
+        signal (Optional[np.ndarray]): Precomputed crossover signal, e.g. a
+            row of crossover_table(); skips recomputing the averages.
+    Returns:
+        BacktestResult
+    """
+    close = np.asarray(candles['close'], dtype=np.float64)
+    open_ = np.asarray(candles['open'], dtype=np.float64)
+    if cash is None:
+        cash = close[0]
+    if max_position is None:
+        max_position = cash / close[0]
+    max_steps = int(round(max_position / size))
+
+    if signal is None:
+        signal = crossover_table(close, [(avg1, avg2)])[0]
+    # Fixed in BTC, max_position can cost more than `cash` once the price
+    # rises; buys the cash cannot cover are skipped, as live.
+    price = np.append(open_[1:], close[-1])
+    steps = step_positions(signal, max_steps, cost=size * price * (1 + fee),
+                           proceeds=size * price * (1 - fee), cash=cash)
+
+    # Orders decided at the close of bar t fill at the open of bar t + 1.
+    held = np.concatenate([[0], steps[:-1]]) * size
+    fills = np.diff(np.concatenate([[0.], held]))
+    notional = fills * open_
+    fees = np.abs(notional) * fee
+    cash = cash - np.cumsum(notional + fees)
+    equity = cash + held * close
+
+    return BacktestResult(candles['time'], close, signal, held, fills, fees, cash, equity, granularity)
+
+
+if __name__ == '__main__':
+    import time
+    from backfill import backfill
+    from store import CandleStore
+
+    store = CandleStore()
+    backfill('BTC-USD', '2015-07-20T00:00:00', time.time(), granularity=3600, store=store)
+    result = backtest(store.load('BTC-USD', 3600))
+    print(result.stats)
+    result.plot('bt.png')
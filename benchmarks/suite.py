@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import cbpro
+from backtest import backtest
+from decode import loads, to_fills
+from store import CandleStore, CANDLE_DTYPE, to_records
+from trades import to_trades
+
+"""
+
+Benchmark suite for the client, indicator and backtest hot paths.
+
+Each benchmark reports throughput in its own unit per second (candles,
+trades, pages, signs, bars) and the peak memory allocated by one call,
+measured with tracemalloc. Inputs are synthetic and seeded, and the HTTP
+benchmarks run against a local mock server, so runs are comparable across
+commits on the same machine.
+
+    python benchmarks/suite.py              # compare with baseline.json
+    python benchmarks/suite.py --save       # record a new baseline
+    python benchmarks/suite.py -k json      # only names containing 'json'
+
+Comparing exits with status 1 if any benchmark is slower than its baseline by
+more than --tolerance.
+
+"""
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BENCHMARKS = []
+
+
+def benchmark(name, unit):
+    """ Register a setup function returning (func, items per call, cleanup). """
+    def register(setup):
+        BENCHMARKS.append((name, unit, setup))
+        return setup
+    return register
+
+
+def random_candles(n, seed=0, granularity=3600, end=None):
+    rng = np.random.default_rng(seed)
+    if end is None:
+        end = 1500000000
+    candles = np.empty(n, dtype=CANDLE_DTYPE)
+    candles['time'] = end - granularity * np.arange(n, 0, -1)
+    close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    candles['open'] = np.concatenate([[close[0]], close[:-1]])
+    candles['close'] = close
+    candles['high'] = np.maximum(candles['open'], close) * 1.001
+    candles['low'] = np.minimum(candles['open'], close) * 0.999
+    candles['volume'] = rng.uniform(1, 100, n)
+    return candles
+
+
+def random_trades(n, seed=0, first_id=1):
+    rng = np.random.default_rng(seed)
+    price = 1000 * np.exp(np.cumsum(rng.normal(0, 0.0005, n)))
+    return [{
+        'time': '2019-01-01T00:{:02d}:{:02d}.{:06d}Z'.format(i // 60 % 60, i % 60, i % 1000000),
+        'trade_id': first_id + n - 1 - i,
+        'price': '{:.2f}'.format(price[i]),
+        'size': '{:.8f}'.format(rng.uniform(0.001, 1)),
+        'side': 'buy' if i % 2 else 'sell',
+    } for i in range(n)]
+
+
+@benchmark('json_candles', 'candles')
+def bench_json_candles():
+    candles = random_candles(300)
+    body = json.dumps([[int(x['time']), x['low'], x['high'], x['open'], x['close'], x['volume']]
+                       for x in candles[::-1]])
+    return lambda: to_records(loads(body)), len(candles), None
+
+
+@benchmark('json_trades', 'trades')
+def bench_json_trades():
+    body = json.dumps(random_trades(1000)).encode()
+    return lambda: to_trades(body), 1000, None
+
+
+@benchmark('json_fills', 'fills')
+def bench_json_fills():
+    body = json.dumps([dict(x, product_id='BTC-USD', order_id='d50ec984-77a8-460a-b958-66f114b0de9b',
+                            created_at=x['time'], fee='0.00025', liquidity='T', settled=True)
+                       for x in random_trades(100)]).encode()
+    return lambda: to_fills(loads(body)), 100, None
+
+
+class NoCandlesClient(object):
+    """ Candle source for a store that is already current. """
+
+    def get_product_historic_rates(self, product_id, start=None, end=None, granularity=None):
+        return []
+
+
+@benchmark('history_signal', 'signals')
+def bench_history_signal():
+    from btc_algo import History
+    root = tempfile.mkdtemp()
+    store = CandleStore(root)
+    # Stored bars run up to the last closed hour, so update() has nothing to fetch.
+    current = int(time.time()) // 3600 * 3600
+    store.append('BTC-USD', 3600, random_candles(1000, end=current))
+    history = History('BTC-USD', 3600, store, client=NoCandlesClient())
+
+    def cycle():
+        # A History decision cycle: top up the store, then the crossover.
+        history.update()
+        return history.signal()
+    return cycle, 1, lambda: shutil.rmtree(root)
+
+
+class PagesHandler(BaseHTTPRequestHandler):
+    """ Serves /products/BTC-USD/trades in pages of 100, `cb-after` paginated. """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    pages = 50
+    body = {}
+
+    def do_GET(self):
+        after = 0
+        if 'after=' in self.path:
+            after = int(self.path.split('after=')[1].split('&')[0])
+        page = after // 100 if after else self.pages
+        if page not in self.body:
+            self.body[page] = json.dumps(
+                random_trades(100, seed=page, first_id=(page - 1) * 100 + 1)).encode()
+        body = self.body[page]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if page > 1:
+            self.send_header('cb-after', str((page - 1) * 100))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_paginate(prefetch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PagesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = cbpro.PublicClient('http://127.0.0.1:{}'.format(server.server_address[1]))
+    client.limiter = cbpro.RateLimiter(1e9, 1e9)
+    client.prefetch = prefetch
+
+    def run():
+        for _ in client._send_paginated_message('/products/BTC-USD/trades'):
+            pass
+
+    def cleanup():
+        server.shutdown()
+        server.server_close()
+    return run, PagesHandler.pages, cleanup
+
+
+benchmark('paginate', 'pages')(lambda: bench_paginate(0))
+benchmark('paginate_prefetch', 'pages')(lambda: bench_paginate(4))
+
+
+@benchmark('sign_get_auth_headers', 'signs')
+def bench_sign():
+    secret = 'c2VjcmV0' * 11
+    message = '1500000000.0POST/orders' + '{"size": 0.001}'
+    return lambda: cbpro.get_auth_headers('1500000000.0', message, 'key', secret, 'pass'), 1, None
+
+
+@benchmark('sign_cbpro_auth', 'signs')
+def bench_sign_auth():
+    auth = cbpro.CBProAuth('key', 'c2VjcmV0' * 11, 'pass')
+    return lambda: auth.sign('1500000000.0', 'POST', '/orders', '{"size": 0.001}'), 1, None
+
+
+@benchmark('resample_cached', 'lookups')
+def bench_resample_cached():
+    from resample import TimeframeCache
+    root = tempfile.mkdtemp()
+    store = CandleStore(root)
+    store.append('BTC-USD', 60, random_candles(100000, granularity=60))
+    cache = TimeframeCache(store)
+
+    def run():
+        for granularity in (3600, 14400, 86400):
+            cache.get('BTC-USD', granularity, count=200)
+    return run, 3, lambda: shutil.rmtree(root)
+
+
+@benchmark('backtest', 'bars')
+def bench_backtest():
+    candles = random_candles(100000)
+    return lambda: backtest(candles), len(candles), None
+
+
+def measure(func, items, seconds):
+    """ Throughput in items per second, and peak KiB allocated by one call. """
+    func()
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            break
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'per_sec': calls * items / elapsed, 'peak_kib': peak / 1024.}
+
+
+def run(pattern=None, seconds=1.):
+    results = {}
+    for name, unit, setup in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        func, items, cleanup = setup()
+        try:
+            results[name] = dict(measure(func, items, seconds), unit=unit)
+        finally:
+            if cleanup is not None:
+                cleanup()
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """ Print results against the baseline and return the names of regressions. """
+    regressions = []
+    print('{:<24}{:>16}{:>10}{:>12}{:>10}'.format('benchmark', 'per sec', 'unit', 'peak KiB', 'vs base'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = ''
+        if base:
+            ratio = result['per_sec'] / base['per_sec']
+            change = '{:+.0%}'.format(ratio - 1)
+            if ratio < 1 - tolerance:
+                regressions.append(name)
+                change += ' !'
+        print('{:<24}{:>16,.0f}{:>10}{:>12,.0f}{:>10}'.format(
+            name, result['per_sec'], result['unit'], result['peak_kib'], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the benchmark suite.')
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks whose name contains this')
+    parser.add_argument('--seconds', type=float, default=1., help='time per benchmark')
+    parser.add_argument('--save', action='store_true', help='write the results as the baseline')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown versus the baseline reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.pattern, args.seconds)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline.get('environment') not in (None, environment()):
+        print('Baseline was recorded on {}'.format(baseline['environment']))
+    regressions = compare(results, baseline.get('results', {}), args.tolerance)
+
+    if args.save:
+        saved = baseline.get('results', {}) if args.pattern else {}
+        saved.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'results': saved}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+    if regressions:
+        print('Regressions: {}'.format(', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
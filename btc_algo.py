@@ -1,100 +1,143 @@
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import numpy as np
 
 from cbpro import *
+from store import CandleStore
+from indicators import Crossover
+from engine import CrossoverStrategy, RestSource, LiveBroker, Engine
+from accounts import AccountCache
+from metrics import metrics
 
 api_key = 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'
 passphrase = 'xxxxxxxxxxxxx'
 secret = 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'
 
 import logging
-logging.basicConfig(filename='./btc_algo.log', format='%(name)s - %(message)s')
-logging.warning('{} logging started'.format(datetime.now().strftime("%x %X")))
+
+def start_logging():
+    
+    """ Log to ./btc_algo.log; called when trading starts, not on import,
+    so tools importing History or Account leave no log file behind. """
+    
+    logging.basicConfig(filename='./btc_algo.log', format='%(name)s - %(message)s')
+    logging.warning('{} logging started'.format(datetime.now().strftime("%x %X")))
 
 class History():
 
     """ Gets data and returns signal. """
 
-    def __init__(self):
-        self.pc = PublicClient()
+    def __init__(self, product_id='BTC-USD', granularity=3600, store=None, client=None):
+        self.pc = client if client is not None else PublicClient()
+        self.store = store if store is not None else CandleStore()
+        self.product_id = product_id
+        self.granularity = granularity
         self.avg1 = 50
         self.avg2 = 100
+        self.lookback = 200
+        # Wall clock deciding which bars have closed; simexchange swaps in simulated time.
+        self.clock = time.time
+        # Bars already on disk are read once at startup; update() only tops up.
+        self.data = self.store.load(self.product_id, self.granularity, count=self.lookback)
+        self.crossover = Crossover(self.avg1, self.avg2, self.data['close'])
 
-    def signal(self):
-        self.startdate = (datetime.now() - timedelta(seconds=60*60*200)).strftime("%Y-%m-%dT%H:%M")
-        self.enddate = datetime.now().strftime("%Y-%m-%dT%H:%M")
+    def update(self):
+        """ Appends any closed bars missing from the local store. """
+        new = self.store.update(self.pc, self.product_id, self.granularity,
+                                lookback=self.lookback, now=self.clock())
+        if len(new):
+            self.data = np.concatenate([self.data, new])[-self.lookback:]
+            self.crossover.extend(new['close'])
+        return new
 
-        self.data = self.pc.get_product_historic_rates(
-            'BTC-USD', 
-            start=self.startdate, 
-            end=self.enddate, 
-            granularity=3600
-        )
-        
-        self.data.sort(key=lambda x: x[0])
-        
-        if np.mean([x[4] for x in self.data[-self.avg1:]]) > np.mean([x[4] for x in self.data[-self.avg2:]]):
-            return True
-        else:
-            return False
+    def on_bar(self, product_id, bar):
+        """ Adds a closed bar pushed by the websocket feed, see feed.bar_feed. """
+        if product_id != self.product_id:
+            return
+        new = self.store.append(self.product_id, self.granularity, [bar])
+        if len(new):
+            self.data = np.concatenate([self.data, new])[-self.lookback:]
+            self.crossover.extend(new['close'])
+
+    def signal(self):
+        """ Crossover of the bars held; no fetch, call update() first. """
+        if (self.crossover.fast, self.crossover.slow) != (self.avg1, self.avg2):
+            self.crossover = Crossover(self.avg1, self.avg2, self.data['close'])
+        return self.crossover.long
 
 class Account():
 
     """ Authenticates, checks balances, places orders. """
     
-    def __init__(self):
-        self.auth_client = AuthenticatedClient(api_key, secret, passphrase)
+    def __init__(self, product_id='BTC-USD', auth_client=None, account=None):
+        self.auth_client = auth_client if auth_client is not None else AuthenticatedClient(api_key, secret, passphrase)
+        self.product_id = product_id
+        self.base, self.quote = product_id.split('-')
         self.size = 0.001
+        # One get_accounts() call per decision cycle, dropped after each order.
+        self.account = account if account is not None else AccountCache(self.auth_client)
         
-    def is_balanceUSD(self):
-        self.account = self.auth_client.get_accounts()
-        if float([x for x in self.account if x['currency'] == 'USD'][0]['available']):
+    def is_balance(self, currency):
+        if self.account.available(currency):
             return True
         else:
             return False
         
+    def is_balanceUSD(self):
+        return self.is_balance(self.quote)
+        
     def is_balanceBTC(self):
-        self.account = self.auth_client.get_accounts()
-        if float([x for x in self.account if x['currency'] == 'BTC'][0]['available']):
-            return True
-        else:
-            return False
+        return self.is_balance(self.base)
         
     def buy(self):
-        return self.auth_client.place_market_order(
-            'BTC-USD', 
+        order = self.auth_client.place_market_order(
+            self.product_id, 
             'buy', 
             size=self.size
         )
+        self.account.invalidate()
+        return order
         
     def sell(self):
-        return self.auth_client.place_market_order(
-            'BTC-USD', 
+        order = self.auth_client.place_market_order(
+            self.product_id, 
             'sell', 
             size=self.size
         )
+        self.account.invalidate()
+        return order
         
-def run():
+def run(metrics_port=None, metrics_file=None):
+    
+    """ Trades every bar: engine.CrossoverStrategy on REST candles, with
+    orders placed through engine.LiveBroker.
+    Args:
+        metrics_port (Optional[int]): Serve Prometheus metrics on this port.
+        metrics_file (Optional[str]): Write metrics to this JSON file after
+            every bar.
+    """
     
     print('initiating run()')
+    start_logging()
     
-    auth_client = Account()
+    auth_client = AuthenticatedClient(api_key, secret, passphrase)
+    # Sign with the server clock; re-synced daily to follow local drift.
+    auth_client.sync_time()
+    source = RestSource('BTC-USD', 3600)
+    engine = Engine(CrossoverStrategy('BTC-USD', avg1=50, avg2=100, size=0.001),
+                    source, LiveBroker(auth_client), halt_on_error=False)
     
-    # Checks if top of the hour, if so returns signals.
-    while True:
-        if datetime.now().minute == 0:
-            if History().signal:
-                if auth_client.is_balanceUSD():
-                    buy = auth_client.buy()
-                    logging.warning('{} - {}'.format(datetime.now(), buy)) 
-            else:
-                if auth_client.is_balanceBTC():
-                    sell = auth_client.sell()
-                    logging.warning('{} - {}'.format(datetime.now(), sell))
-            time.sleep((60*60) - datetime.now().minute*60 - (datetime.now().microsecond/1000000))
-        else:
-            time.sleep((60*60) - datetime.now().minute*60 - (datetime.now().microsecond/1000000))
+    if metrics_port is not None or metrics_file is not None:
+        metrics.enabled = True
+        metrics.instrument(auth_client)
+        metrics.instrument(source.client)
+        if metrics_port is not None:
+            metrics.serve(metrics_port)
+    if metrics_file is not None:
+        engine.after_bar = lambda product_id, bar: metrics.write(metrics_file)
+    
+    source.scheduler.every(86400, lambda boundary: auth_client.sync_time(), catch_up=False)
+    engine.run()
         
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    run()
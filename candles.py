@@ -0,0 +1,129 @@
+import numpy as np
+
+from decode import loads
+from store import CANDLE_DTYPE, to_records
+
+"""
+
+Columnar candle container.
+
+Candles wraps one CANDLE_DTYPE structured array: int64 times and float64
+low/high/open/close/volume, 48 bytes a bar instead of a list of six boxed
+Python numbers. Columns are attributes, slicing by index or by time returns
+views, and arrays save to and load from .npy files, memory-mapped by default,
+so multi-year minute histories can be opened without reading them.
+PublicClient.get_candles() returns one straight from the candles endpoint.
+
+"""
+
+
+class Candles(object):
+    """ Bars in ascending time order.
+    Attributes:
+        data (np.ndarray): CANDLE_DTYPE records, possibly a memory map.
+    """
+
+    def __init__(self, data=None):
+        if data is None:
+            data = np.empty(0, dtype=CANDLE_DTYPE)
+        self.data = data
+
+    @classmethod
+    def from_json(cls, response):
+        """ Build from a get_product_historic_rates() response.
+        Args:
+            response (str/bytes/list): The raw JSON body or decoded list of
+                [ time, low, high, open, close, volume ] rows, in any order.
+        Returns:
+            Candles
+        """
+        if isinstance(response, (str, bytes)):
+            response = loads(response)
+        return cls(to_records(response))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Open a .npy file written by save(), memory-mapped by default. """
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    @classmethod
+    def from_store(cls, store, product_id, granularity):
+        """ Memory-map a CandleStore file without copying it. """
+        if not store.count(product_id, granularity):
+            return cls()
+        return cls(np.memmap(store.path(product_id, granularity),
+                             dtype=CANDLE_DTYPE, mode='r'))
+
+    def save(self, path):
+        np.save(path, np.ascontiguousarray(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.data[key]
+        if isinstance(key, slice):
+            return Candles(self.data[key])
+        return self.data[key]
+
+    def __repr__(self):
+        if not len(self):
+            return 'Candles([])'
+        return 'Candles({} bars, {} to {})'.format(len(self), self.time[0], self.time[-1])
+
+    @property
+    def time(self):
+        return self.data['time']
+
+    @property
+    def low(self):
+        return self.data['low']
+
+    @property
+    def high(self):
+        return self.data['high']
+
+    @property
+    def open(self):
+        return self.data['open']
+
+    @property
+    def close(self):
+        return self.data['close']
+
+    @property
+    def volume(self):
+        return self.data['volume']
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def between(self, start=None, end=None):
+        """ Zero-copy view of the bars opening in [start, end).
+        Args:
+            start (Optional[int]): Epoch seconds, inclusive.
+            end (Optional[int]): Epoch seconds, exclusive.
+        Returns:
+            Candles
+        """
+        time = self.time
+        i = 0 if start is None else np.searchsorted(time, start, side='left')
+        j = len(time) if end is None else np.searchsorted(time, end, side='left')
+        return Candles(self.data[i:j])
+
+    def tail(self, count):
+        """ View of the last `count` bars. """
+        return Candles(self.data[max(len(self.data) - count, 0):])
+
+    def append(self, candles):
+        """ New Candles with the bars of `candles` that are newer than ours. """
+        records = candles.data if isinstance(candles, Candles) else to_records(candles)
+        if len(self.data):
+            records = records[records['time'] > self.time[-1]]
+        return Candles(np.concatenate([self.data, records]))
+
+    def to_list(self):
+        """ Rows of [ time, low, high, open, close, volume ], as from the API. """
+        return [list(row) for row in self.data.tolist()]
@@ -1,9 +1,15 @@
 import requests, time, json
+import queue
+import random
+import threading
 import hmac
 import hashlib
 import base64
 from requests.auth import AuthBase
 
+from candles import Candles
+from decode import loads, to_fills
+
 """
 
 From https://github.com/danpaquin/coinbasepro-python/
@@ -11,25 +17,81 @@ From https://github.com/danpaquin/coinbasepro-python/
 Modifications:
 - outdated versions of buy() and sell() commented out (under AuthenticatedClient)
 - param 'stop_price' added to place_stop_order (under AuthenticatedClient)
+- 'timeout' passed to the constructors is honored by every request
+- requests go through shared token-bucket rate limiters (public and private),
+  429 and 5xx responses are retried with jittered backoff, and error payloads
+  raise CBProAPIError instead of being returned
+- paginated requests can prefetch pages in the background, and trades, fills
+  and account history can be dumped to disk page by page
+- get_product_trades passes `before` and `after` to the API
+- CBProAuth decodes the secret once, signs from a copied HMAC state and can
+  offset its timestamps to the server clock (AuthenticatedClient.sync_time)
+- request latencies can be recorded per endpoint (see metrics.py)
+- responses are decoded with orjson when it is installed, paginated results
+  can be converted page by page (decode=), and get_fill_records() returns
+  fills with numeric fields (see decode.py)
+- get_candles() returns historic rates as a candles.Candles container
 
 """
 
 
 class CBProAuth(AuthBase):
     # Provided by CBPro: https://docs.pro.coinbase.com/#signing-a-message
+    # The secret is decoded and keyed into an HMAC once; each request signs a
+    # copy of that state. Timestamps are shifted by `offset`, the server clock
+    # minus the local one, which sync() calibrates from get_time().
     def __init__(self, api_key, secret_key, passphrase):
         self.api_key = api_key
         self.secret_key = secret_key
         self.passphrase = passphrase
+        self.offset = 0.
+        self._hmac = hmac.new(base64.b64decode(secret_key), digestmod=hashlib.sha256)
+        self._headers = {
+            'Content-Type': 'Application/JSON',
+            'CB-ACCESS-KEY': api_key,
+            'CB-ACCESS-PASSPHRASE': passphrase
+        }
+
+    def sync(self, client):
+        """ Calibrate `offset` against the API server clock.
+        Only the HTTP exchange is timed: the rate limiter is passed first and
+        failures are not retried, so no waiting skews the estimate.
+        Args:
+            client (PublicClient): Client whose session, URL and limiter are
+                used to read /time.
+        Returns:
+            float: Seconds to add to the local clock.
+        """
+        client.limiter.acquire()
+        start = time.time()
+        r = client.session.get(client.url + '/time', timeout=client.timeout)
+        end = time.time()
+        if r.status_code >= 400:
+            raise api_error(r.status_code, r.text)
+        return self.calibrate(start, float(loads(r.content)['epoch']), end)
+
+    def calibrate(self, start, server, end):
+        """ Set `offset` from a server clock reading taken between the local
+        times `start` and `end`.
+        """
+        # Assume the server read its clock halfway through the round trip.
+        self.offset = server - (start + end) / 2
+        return self.offset
+
+    def sign(self, timestamp, method, path_url, body=None):
+        """ Base64 signature of one request. """
+        signature = self._hmac.copy()
+        signature.update((timestamp + method + path_url).encode('ascii'))
+        if body:
+            signature.update(body.encode('utf-8') if isinstance(body, str) else body)
+        return base64.b64encode(signature.digest()).decode('utf-8')
 
     def __call__(self, request):
-        timestamp = str(time.time())
-        message = ''.join([timestamp, request.method,
-                           request.path_url, (request.body or '')])
-        request.headers.update(get_auth_headers(timestamp, message,
-                                                self.api_key,
-                                                self.secret_key,
-                                                self.passphrase))
+        timestamp = str(time.time() + self.offset)
+        request.headers.update(self._headers)
+        request.headers['CB-ACCESS-SIGN'] = self.sign(timestamp, request.method,
+                                                      request.path_url, request.body)
+        request.headers['CB-ACCESS-TIMESTAMP'] = timestamp
         return request
 
 
@@ -45,7 +107,164 @@ def get_auth_headers(timestamp, message, api_key, secret_key, passphrase):
         'CB-ACCESS-KEY': api_key,
         'CB-ACCESS-PASSPHRASE': passphrase
     }
-    
+
+
+class CBProAPIError(Exception):
+    """ Error response from the cbpro API.
+    Attributes:
+        status_code (int): HTTP status code.
+        message (str): The `message` field of the error payload.
+        response (dict): Decoded error payload, if any.
+    """
+    def __init__(self, status_code, message, response=None):
+        super(CBProAPIError, self).__init__('{} {}'.format(status_code, message))
+        self.status_code = status_code
+        self.message = message
+        self.response = response
+
+
+class RateLimitError(CBProAPIError):
+    """ 429 Too Many Requests. """
+
+
+class ServerError(CBProAPIError):
+    """ 5xx response. """
+
+
+def api_error(status_code, payload):
+    """ Build the CBProAPIError subclass for an error response. """
+    message = payload.get('message') if isinstance(payload, dict) else payload
+    if status_code == 429:
+        return RateLimitError(status_code, message, payload)
+    if status_code >= 500:
+        return ServerError(status_code, message, payload)
+    return CBProAPIError(status_code, message, payload)
+
+
+def should_retry(method, error):
+    """ Whether a failed request is safe to send again.
+    Rate limited requests were never processed, so they are always retried.
+    Server and connection errors are only retried for GET and DELETE; a POST
+    may already have placed an order.
+    """
+    if isinstance(error, RateLimitError):
+        return True
+    if isinstance(error, (ServerError, requests.ConnectionError, requests.Timeout)):
+        return method.lower() in ('get', 'delete')
+    return False
+
+
+def backoff(attempt, retry_after=None, base=0.5, cap=30.):
+    """ Full-jitter exponential backoff, at least any Retry-After seconds. """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+class RateLimiter(object):
+    """ Thread-safe token bucket.
+    Share one instance between clients so together they stay under the
+    exchange limits.
+    """
+    def __init__(self, rate, burst):
+        """ Create a token bucket.
+        Args:
+            rate (float): Requests per second, sustained.
+            burst (int): Requests allowed back to back.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ Take a token and return how long to wait before using it. """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """ Block until a request may be sent. """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Process-wide budgets, per https://docs.pro.coinbase.com/#rate-limits
+public_limiter = RateLimiter(3, 6)
+private_limiter = RateLimiter(5, 10)
+
+
+def prefetch(iterable, depth):
+    """ Iterate over `iterable` on a background thread, `depth` items ahead.
+    Exceptions raised by the iterable are re-raised to the consumer. If the
+    consumer stops early the background thread stops too.
+    Args:
+        iterable: Any iterable, e.g. a generator of pages.
+        depth (int): Maximum items buffered ahead of the consumer.
+    Yields:
+        The items of `iterable`, in order.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+def read_dump(path):
+    """ Iterate over the objects in a file written by a dump_* method.
+    Args:
+        path (str): File with one JSON page (a list) per line.
+    Yields:
+        dict: API response objects, in the order they were fetched.
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                for result in loads(line):
+                    yield result
+
+
 class PublicClient(object):
     """cbpro public client API.
     All requests default to the `product_id` specified at object
@@ -58,10 +277,18 @@ class PublicClient(object):
         """Create cbpro API public client.
         Args:
             api_url (Optional[str]): API URL. Defaults to cbpro API.
+            timeout (Optional[float]): Seconds to wait for each request.
         """
         self.url = api_url.rstrip('/')
+        self.timeout = timeout
         self.auth = None
         self.session = requests.Session()
+        self.limiter = public_limiter
+        self.max_retries = 3
+        # Pages fetched ahead by paginated requests; 0 fetches on demand.
+        self.prefetch = 0
+        # Optional metrics.Metrics recording each request's latency.
+        self.metrics = None
 
     def get_products(self):
         """Get a list of available currency pairs for trading.
@@ -163,8 +390,28 @@ class PublicClient(object):
                      "side": "sell"
          }]
         """
+        params = {}
+        if before:
+            params['before'] = before
+        if after:
+            params['after'] = after
         return self._send_paginated_message('/products/{}/trades'
-                                            .format(product_id))
+                                            .format(product_id), params=params)
+
+    def dump_product_trades(self, product_id, path, **kwargs):
+        """ Write the trade history of a product to disk, newest first.
+        Pages are written as they arrive, see _dump_paginated_message.
+        Args:
+            product_id (str): Product
+            path (str): Output file, appended to.
+            kwargs (dict): Additional HTTP request parameters, e.g. `after`
+                to resume below a trade_id.
+        Returns:
+            dict: Pages written and the `after` cursor to resume from.
+        """
+        return self._dump_paginated_message('/products/{}/trades'
+                                            .format(product_id), path,
+                                            params=kwargs)
 
     def get_product_historic_rates(self, product_id, start=None, end=None,
                                    granularity=None):
@@ -212,6 +459,15 @@ class PublicClient(object):
                                   '/products/{}/candles'.format(product_id),
                                   params=params)
 
+    def get_candles(self, product_id, start=None, end=None, granularity=None):
+        """ get_product_historic_rates() as a Candles container.
+        Args: See get_product_historic_rates.
+        Returns:
+            candles.Candles: Bars in ascending time order, one per timestamp.
+        """
+        return Candles.from_json(self.get_product_historic_rates(
+            product_id, start=start, end=end, granularity=granularity))
+
     def get_product_24hr_stats(self, product_id):
         """Get 24 hr stats for the product.
         Args:
@@ -266,13 +522,51 @@ class PublicClient(object):
             data (Optional[str]): JSON-encoded string payload for POST
         Returns:
             dict/list: JSON response
+        Raises:
+            CBProAPIError: The API returned an error payload.
         """
-        url = self.url + endpoint
-        r = self.session.request(method, url, params=params, data=data,
-                                 auth=self.auth, timeout=30)
-        return r.json()
+        r = self._request(method, self.url + endpoint, params=params, data=data)
+        return loads(r.content)
+
+    def _request(self, method, url, params=None, data=None):
+        """ Send one request under the rate limiter, retrying where safe.
+        Returns:
+            requests.Response: A successful response.
+        Raises:
+            CBProAPIError: The API returned an error payload.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                r = self.session.request(method, url, params=params, data=data,
+                                         auth=self.auth, timeout=self.timeout)
+                if self.metrics is not None:
+                    self._observe(method, url, r.status_code, start)
+                if r.status_code < 400:
+                    return r
+                try:
+                    payload = r.json()
+                except ValueError:
+                    payload = r.text
+                error = api_error(r.status_code, payload)
+                retry_after = r.headers.get('Retry-After')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if self.metrics is not None:
+                    self._observe(method, url, 'error', start)
+                error = e
+            if attempt >= self.max_retries or not should_retry(method, error):
+                raise error
+            time.sleep(backoff(attempt, retry_after))
+            attempt += 1
 
-    def _send_paginated_message(self, endpoint, params=None):
+    def _observe(self, method, url, status, start):
+        self.metrics.request(method, url[len(self.url):], status,
+                             time.perf_counter() - start)
+
+    def _send_paginated_message(self, endpoint, params=None, decode=None):
         """ Send API message that results in a paginated response.
         The paginated responses are abstracted away by making API requests on
         demand as the response is iterated over.
@@ -287,17 +581,38 @@ class PublicClient(object):
         Args:
             endpoint (str): Endpoint (to be added to base URL)
             params (Optional[dict]): HTTP request parameters
+            decode (Optional[callable]): Converts each decoded page, e.g.
+                trades.to_trades; one converted page is yielded per request
+                instead of its objects.
         Yields:
             dict: API response objects
         """
         if params is None:
             params = dict()
+        pages = self._pages(endpoint, params)
+        if self.prefetch:
+            pages = prefetch(pages, self.prefetch)
+        for r in pages:
+            results = loads(r.content)
+            if decode is not None:
+                yield decode(results)
+            else:
+                for result in results:
+                    yield result
+
+    def _pages(self, endpoint, params):
+        """ Request the pages of a paginated response one after another.
+        Args:
+            endpoint (str): Endpoint (to be added to base URL)
+            params (dict): HTTP request parameters; `after` is updated in
+                place as pages are fetched.
+        Yields:
+            requests.Response: One response per page.
+        """
         url = self.url + endpoint
         while True:
-            r = self.session.get(url, params=params, auth=self.auth, timeout=30)
-            results = r.json()
-            for result in results:
-                yield result
+            r = self._request('get', url, params=params)
+            yield r
             # If there are no more pages, we're done. Otherwise update `after`
             # param to get next page.
             # If this request included `before` don't get any more pages - the
@@ -307,6 +622,34 @@ class PublicClient(object):
                 break
             else:
                 params['after'] = r.headers['cb-after']
+
+    def _dump_paginated_message(self, endpoint, path, params=None, depth=4):
+        """ Write every page of a paginated response to disk.
+        Pages are fetched on a background thread while earlier ones are
+        written, and their bodies are written as received, one JSON array per
+        line, without being decoded. Read them back with read_dump().
+        Args:
+            endpoint (str): Endpoint (to be added to base URL)
+            path (str): Output file, appended to.
+            params (Optional[dict]): HTTP request parameters
+            depth (Optional[int]): Pages buffered ahead of the writer.
+        Returns:
+            dict: {'pages': pages written, 'after': cursor of the last page,
+                for resuming with params={'after': ...}}
+        """
+        if params is None:
+            params = dict()
+        written = 0
+        cursor = None
+        with open(path, 'ab') as f:
+            for r in prefetch(self._pages(endpoint, params), depth):
+                body = r.content.strip()
+                if b'\n' in body:
+                    body = json.dumps(loads(body), separators=(',', ':')).encode()
+                f.write(body + b'\n')
+                written += 1
+                cursor = r.headers.get('cb-after')
+        return {'pages': written, 'after': cursor}
                 
 class AuthenticatedClient(PublicClient):
     """ Provides access to Private Endpoints on the cbpro API.
@@ -318,17 +661,27 @@ class AuthenticatedClient(PublicClient):
         session (requests.Session): Persistent HTTP connection object.
     """
     def __init__(self, key, b64secret, passphrase,
-                 api_url="https://api.pro.coinbase.com"):
+                 api_url="https://api.pro.coinbase.com", timeout=30):
         """ Create an instance of the AuthenticatedClient class.
         Args:
             key (str): Your API key.
             b64secret (str): The secret key matching your API key.
             passphrase (str): Passphrase chosen when setting up key.
             api_url (Optional[str]): API URL. Defaults to cbpro API.
+            timeout (Optional[float]): Seconds to wait for each request.
         """
-        super(AuthenticatedClient, self).__init__(api_url)
+        super(AuthenticatedClient, self).__init__(api_url, timeout)
         self.auth = CBProAuth(key, b64secret, passphrase)
         self.session = requests.Session()
+        self.limiter = private_limiter
+
+    def sync_time(self):
+        """ Offset request timestamps to the API server clock, avoiding
+        rejections from local clock skew.
+        Returns:
+            float: Seconds added to the local clock.
+        """
+        return self.auth.sync(self)
 
     def get_account(self, account_id):
         """ Get information for a single account.
@@ -408,6 +761,18 @@ class AuthenticatedClient(PublicClient):
         endpoint = '/accounts/{}/ledger'.format(account_id)
         return self._send_paginated_message(endpoint, params=kwargs)
 
+    def dump_account_history(self, account_id, path, **kwargs):
+        """ Write the account history to disk, see get_account_history.
+        Args:
+            account_id (str): Account id to get history of.
+            path (str): Output file, appended to.
+            kwargs (dict): Additional HTTP request parameters.
+        Returns:
+            dict: Pages written and the `after` cursor to resume from.
+        """
+        endpoint = '/accounts/{}/ledger'.format(account_id)
+        return self._dump_paginated_message(endpoint, path, params=kwargs)
+
     def get_account_holds(self, account_id, **kwargs):
         """ Get holds on an account.
         This method returns a generator which may make multiple HTTP requests
@@ -865,6 +1230,50 @@ class AuthenticatedClient(PublicClient):
 
         return self._send_paginated_message('/fills', params=params)
 
+    def get_fill_records(self, product_id=None, order_id=None, **kwargs):
+        """ get_fills() as pages of decode.Fill records, with numeric price,
+        size and fee.
+        Args:
+            product_id (str): Limit list to this product_id
+            order_id (str): Limit list to this order_id
+            kwargs (dict): Additional HTTP request parameters.
+        Yields:
+            list: decode.Fill records of one page, newest first.
+        """
+        if (product_id is None) and (order_id is None):
+            raise ValueError('Either product_id or order_id must be specified.')
+
+        params = {}
+        if product_id:
+            params['product_id'] = product_id
+        if order_id:
+            params['order_id'] = order_id
+        params.update(kwargs)
+
+        return self._send_paginated_message('/fills', params=params, decode=to_fills)
+
+    def dump_fills(self, path, product_id=None, order_id=None, **kwargs):
+        """ Write fills to disk, see get_fills.
+        Args:
+            path (str): Output file, appended to.
+            product_id (str): Limit list to this product_id
+            order_id (str): Limit list to this order_id
+            kwargs (dict): Additional HTTP request parameters.
+        Returns:
+            dict: Pages written and the `after` cursor to resume from.
+        """
+        if (product_id is None) and (order_id is None):
+            raise ValueError('Either product_id or order_id must be specified.')
+
+        params = {}
+        if product_id:
+            params['product_id'] = product_id
+        if order_id:
+            params['order_id'] = order_id
+        params.update(kwargs)
+
+        return self._dump_paginated_message('/fills', path, params=params)
+
     def get_fundings(self, status=None, **kwargs):
         """ Every order placed with a margin profile that draws funding
         will create a funding record.
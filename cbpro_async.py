@@ -0,0 +1,256 @@
+import asyncio
+import json
+import time
+
+import requests
+
+from cbpro import (PublicClient, AuthenticatedClient, CBProAPIError,
+                   api_error, backoff, should_retry)
+from candles import Candles
+from decode import loads
+
+"""
+
+Asyncio variants of PublicClient and AuthenticatedClient.
+
+Every public method keeps the signature of its cbpro counterpart. Methods
+backed by _send_message return a coroutine; paginated ones (get_fills,
+get_product_trades, ...) return an async generator, and the dump_* methods a
+coroutine that writes the pages. Requests are prepared and signed exactly as
+in cbpro (requests.Request + CBProAuth) and sent through an aiohttp session,
+which can be shared between clients so they use one connection pool:
+
+    async with aiohttp.ClientSession() as session:
+        pc = AsyncPublicClient(session=session)
+        ac = AsyncAuthenticatedClient(key, b64secret, passphrase, session=session)
+        ticker, book, candles, accounts = await asyncio.gather(
+            pc.get_product_ticker('BTC-USD'),
+            pc.get_product_order_book('BTC-USD', level=2),
+            pc.get_product_historic_rates('BTC-USD', granularity=3600),
+            ac.get_accounts())
+
+Requires the `aiohttp` package.
+
+"""
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError('The async client requires the `aiohttp` package: '
+                          'pip install aiohttp')
+    return aiohttp
+
+
+class AsyncClientMixin(object):
+    """ Replaces the requests transport of a cbpro client with aiohttp. """
+
+    def _init_async(self, session, limit):
+        # The requests.Session from the cbpro constructor is never used.
+        self.session = None
+        self.aio_session = session
+        self.own_session = session is None
+        self.limit = limit
+
+    def _get_session(self):
+        if self.aio_session is None:
+            aiohttp = _aiohttp()
+            self.aio_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit))
+        return self.aio_session
+
+    async def close(self):
+        """ Close the aiohttp session if this client created it. """
+        if self.own_session and self.aio_session is not None:
+            await self.aio_session.close()
+            self.aio_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, method, url, params=None, data=None, raw=False):
+        """ Send one request under the shared rate limiter, retrying where
+        safe, as PublicClient._request does.
+        Args:
+            raw (Optional[bool]): Return the body undecoded.
+        Returns:
+            tuple: (decoded JSON, or the body bytes if `raw`, response headers)
+        Raises:
+            CBProAPIError: The API returned an error payload.
+        """
+        aiohttp = _aiohttp()
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        attempt = 0
+        while True:
+            delay = self.limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Prepare and sign with requests for every attempt, so the URL,
+            # body and signature are what the synchronous client would send.
+            prepared = requests.Request(method.upper(), url, params=params,
+                                        data=data).prepare()
+            if self.auth is not None:
+                prepared = self.auth(prepared)
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                async with session.request(prepared.method, prepared.url,
+                                           data=prepared.body,
+                                           headers=dict(prepared.headers),
+                                           timeout=timeout) as r:
+                    body = await r.read()
+                    if self.metrics is not None:
+                        self._observe(method, url, r.status, start)
+                    if r.status < 400:
+                        return (body if raw else loads(body)), r.headers
+                    try:
+                        payload = loads(body)
+                    except ValueError:
+                        # e.g. an HTML 502 page from a gateway
+                        payload = body.decode('utf-8', 'replace')
+                    error = api_error(r.status, payload)
+                    retry_after = r.headers.get('Retry-After')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if self.metrics is not None:
+                    self._observe(method, url, 'error', start)
+                error = e
+            if attempt >= self.max_retries or not self._should_retry(method, error):
+                raise error
+            await asyncio.sleep(backoff(attempt, retry_after))
+            attempt += 1
+
+    @staticmethod
+    def _should_retry(method, error):
+        if isinstance(error, Exception) and not isinstance(error, CBProAPIError):
+            # Connection problems and timeouts, as for requests in cbpro.
+            return method.lower() in ('get', 'delete')
+        return should_retry(method, error)
+
+    async def get_candles(self, product_id, start=None, end=None, granularity=None):
+        """ See PublicClient.get_candles. """
+        return Candles.from_json(await self.get_product_historic_rates(
+            product_id, start=start, end=end, granularity=granularity))
+
+    async def _send_message(self, method, endpoint, params=None, data=None):
+        """Send API request.
+        Args:
+            method (str): HTTP method (get, post, delete, etc.)
+            endpoint (str): Endpoint (to be added to base URL)
+            params (Optional[dict]): HTTP request parameters
+            data (Optional[str]): JSON-encoded string payload for POST
+        Returns:
+            dict/list: JSON response
+        """
+        results, _ = await self._request(method, self.url + endpoint,
+                                         params=params, data=data)
+        return results
+
+    async def _send_paginated_message(self, endpoint, params=None, decode=None):
+        """ Send API message that results in a paginated response.
+        See PublicClient._send_paginated_message.
+        Yields:
+            dict: API response objects
+        """
+        if params is None:
+            params = dict()
+        url = self.url + endpoint
+        while True:
+            results, headers = await self._request('get', url, params=params)
+            if decode is not None:
+                yield decode(results)
+            else:
+                for result in results:
+                    yield result
+            if not headers.get('cb-after') or \
+                    params.get('before') is not None:
+                break
+            else:
+                params['after'] = headers['cb-after']
+
+    async def _dump_paginated_message(self, endpoint, path, params=None, depth=4):
+        """ Write every page of a paginated response to disk.
+        See PublicClient._dump_paginated_message; pages are requested one
+        after another, so `depth` is unused.
+        Returns:
+            dict: {'pages': pages written, 'after': cursor of the last page}
+        """
+        if params is None:
+            params = dict()
+        url = self.url + endpoint
+        written = 0
+        cursor = None
+        with open(path, 'ab') as f:
+            while True:
+                body, headers = await self._request('get', url, params=params, raw=True)
+                body = body.strip()
+                if b'\n' in body:
+                    body = json.dumps(loads(body), separators=(',', ':')).encode()
+                f.write(body + b'\n')
+                written += 1
+                cursor = headers.get('cb-after')
+                if not cursor or params.get('before') is not None:
+                    break
+                params['after'] = cursor
+        return {'pages': written, 'after': cursor}
+
+
+class AsyncPublicClient(AsyncClientMixin, PublicClient):
+    """ Asyncio cbpro public client. See PublicClient for the methods. """
+
+    def __init__(self, api_url='https://api.pro.coinbase.com', timeout=30,
+                 session=None, limit=100):
+        """ Create an async public client.
+        Args:
+            api_url (Optional[str]): API URL. Defaults to cbpro API.
+            timeout (Optional[float]): Seconds to wait for each request.
+            session (Optional[aiohttp.ClientSession]): Session to share with
+                other clients. By default the client creates its own.
+            limit (Optional[int]): Connection pool size for an own session.
+        """
+        super(AsyncPublicClient, self).__init__(api_url, timeout)
+        self._init_async(session, limit)
+
+
+class AsyncAuthenticatedClient(AsyncClientMixin, AuthenticatedClient):
+    """ Asyncio cbpro authenticated client. See AuthenticatedClient. """
+
+    def __init__(self, key, b64secret, passphrase,
+                 api_url='https://api.pro.coinbase.com', timeout=30,
+                 session=None, limit=100):
+        """ Create an async authenticated client.
+        Args:
+            key (str): Your API key.
+            b64secret (str): The secret key matching your API key.
+            passphrase (str): Passphrase chosen when setting up key.
+            api_url (Optional[str]): API URL. Defaults to cbpro API.
+            timeout (Optional[float]): Seconds to wait for each request.
+            session (Optional[aiohttp.ClientSession]): Session to share with
+                other clients. By default the client creates its own.
+            limit (Optional[int]): Connection pool size for an own session.
+        """
+        super(AsyncAuthenticatedClient, self).__init__(key, b64secret, passphrase,
+                                                       api_url, timeout)
+        self._init_async(session, limit)
+
+    async def sync_time(self):
+        """ See AuthenticatedClient.sync_time; only the HTTP exchange is timed. """
+        aiohttp = _aiohttp()
+        delay = self.limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        session = self._get_session()
+        start = time.time()
+        async with session.get(self.url + '/time',
+                               timeout=aiohttp.ClientTimeout(total=self.timeout)) as r:
+            body = await r.read()
+            end = time.time()
+            status = r.status
+        if status >= 400:
+            raise api_error(status, body.decode('utf-8', 'replace'))
+        return self.auth.calibrate(start, float(loads(body)['epoch']), end)
+
@@ -0,0 +1,82 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+
+Response decoding.
+
+loads() parses JSON bodies with orjson when it is installed, falling back to
+the standard library; both return the same Python objects. The clients decode
+every response with it.
+
+Numeric API fields arrive as strings ("price": "10.00000000"). Rather than
+keeping the dicts and calling float() at every use, payloads can be converted
+once: candles with store.to_records(), trades with trades.to_trades() and
+fills with to_fills(), whose Fill records hold numbers in __slots__ at a
+fraction of the memory of a dict.
+
+"""
+
+if orjson is not None:
+    loads = orjson.loads
+else:
+    loads = json.loads
+
+
+class Fill(object):
+    """ One get_fills() entry with numeric fields.
+    Reads like the dict it came from, fill['price'] or fill.get('fee'), so it
+    can be passed wherever a fill dict is expected.
+    """
+
+    __slots__ = ('trade_id', 'product_id', 'order_id', 'created_at', 'price', 'size',
+                 'fee', 'side', 'liquidity', 'settled')
+
+    def __init__(self, trade_id, product_id, order_id, created_at, price, size,
+                 fee=0., side=None, liquidity=None, settled=False):
+        self.trade_id = trade_id
+        self.product_id = product_id
+        self.order_id = order_id
+        self.created_at = created_at
+        self.price = price
+        self.size = size
+        self.fee = fee
+        self.side = side
+        self.liquidity = liquidity
+        self.settled = settled
+
+    @classmethod
+    def from_dict(cls, fill):
+        return cls(int(fill['trade_id']), fill.get('product_id'), fill.get('order_id'),
+                   fill.get('created_at'), float(fill['price']), float(fill['size']),
+                   float(fill.get('fee') or 0), fill.get('side'), fill.get('liquidity'),
+                   bool(fill.get('settled')))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if isinstance(key, str) else default
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'Fill({} {} {} @ {})'.format(self.trade_id, self.side, self.size, self.price)
+
+
+def to_fills(results):
+    """ Convert get_fills() results to Fill records.
+    Args:
+        results (list): Fill dicts as returned by the API.
+    Returns:
+        list: Fill records, in the order given.
+    """
+    return [Fill.from_dict(x) for x in results]
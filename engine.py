@@ -0,0 +1,682 @@
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import requests
+
+from cbpro import PublicClient, CBProAPIError
+from accounts import AccountCache
+from indicators import Crossover, crossover_table
+from metrics import metrics
+from orders import OrderTracker
+from scheduler import Scheduler
+from store import CandleStore
+
+"""
+
+Event-driven strategy engine shared by backtests and live trading.
+
+A Strategy reacts to closed bars (on_bar) and fills (on_fill) and trades
+through a broker; it never calls the API itself. The Engine feeds it bars
+from a data source and routes fills back from the broker:
+
+- sources: ArraySource / StoreSource replay stored candles, RestSource polls
+  get_product_historic_rates() at each bar close, FeedSource builds bars from
+  the websocket matches channel.
+- brokers: SimBroker fills market orders at the next bar's open with a fee,
+  as backtest.py does; LiveBroker places real orders with an
+  AuthenticatedClient, through an execution.Executor where one is given, and
+  reports fills through an OrderTracker.
+
+Bars are sequences [ time, low, high, open, close, volume ], the layout of
+get_product_historic_rates() rows, store.CANDLE_DTYPE and feed.BarAggregator.
+
+Replayed sources also hand their whole history to Strategy.prepare() before
+the first bar, so a strategy can precompute indicators in one vectorized
+pass; CrossoverStrategy does, with indicators.crossover_table(), and falls
+back to indicators.Crossover for bars it did not see in advance.
+
+btc_algo.run() trades CrossoverStrategy live as Engine(CrossoverStrategy,
+RestSource, LiveBroker); runner.MultiRunner places its orders through a
+LiveBroker too. Stages of each live bar are timed in metrics.metrics
+under `engine_stage_seconds`: data (RestSource), signal (CrossoverStrategy),
+balance, submit and fill (LiveBroker).
+
+"""
+
+logger = logging.getLogger(__name__)
+# Silent unless the application configures logging, e.g. btc_algo.start_logging().
+logger.addHandler(logging.NullHandler())
+
+TIME, LOW, HIGH, OPEN, CLOSE, VOLUME = range(6)
+
+
+def split(product_id):
+    """ (base, quote) currencies of a product, e.g. ('BTC', 'USD'). """
+    base, quote = product_id.split('-')
+    return base, quote
+
+
+class Strategy(object):
+    """ Base class for strategies run by an Engine.
+    Attributes:
+        broker: The engine's broker, set by start().
+    """
+
+    def start(self, engine):
+        self.engine = engine
+        self.broker = engine.broker
+
+    def warmup(self, product_id, candles):
+        """ Closed bars from before the run, or older bars a live source
+        caught up on along with a newer one; seed state without trading.
+        """
+
+    def prepare(self, product_id, candles):
+        """ Every bar that is about to be replayed, when known in advance. """
+
+    def on_bar(self, product_id, bar):
+        """ Called with each closed bar. """
+
+    def on_fill(self, fill):
+        """ Called with each fill, in get_fills() format. """
+
+
+class CrossoverStrategy(Strategy):
+    """ The moving average crossover: step `size` into the base currency
+    while the fast mean is above the slow one, out otherwise.
+    """
+
+    def __init__(self, product_id='BTC-USD', avg1=50, avg2=100, size=0.001):
+        self.product_id = product_id
+        self.base, self.quote = split(product_id)
+        self.avg1 = avg1
+        self.avg2 = avg2
+        self.size = size
+        self.crossover = Crossover(avg1, avg2)
+        self.closes = np.empty(0)
+        self.signal = None
+        self.times = None
+        self.offset = 0
+        self.index = 0
+
+    def warmup(self, product_id, candles):
+        if product_id != self.product_id:
+            return
+        # A live source may call again mid-run with bars it caught up on.
+        closes = np.asarray(candles['close'], dtype=np.float64)
+        self.closes = np.concatenate([self.closes, closes])
+        self.crossover.extend(closes)
+
+    def prepare(self, product_id, candles):
+        if product_id != self.product_id:
+            return
+        self.closes = np.concatenate([self.closes, candles['close']])
+        self.offset = len(self.closes) - len(candles)
+        self.times = candles['time'].tolist()
+        self.signal = crossover_table(self.closes, [(self.avg1, self.avg2)])[0][self.offset:].tolist()
+        self.index = 0
+
+    def is_long(self, bar):
+        if self.signal is not None:
+            i = self.index
+            if i < len(self.times) and self.times[i] == bar[TIME]:
+                self.index += 1
+                return self.signal[i]
+            # Not the bar prepare() expected: continue with rolling means
+            # seeded from the bars seen so far.
+            logger.warning('{} unexpected bar at {}, computing means per bar'.format(
+                self.product_id, bar[TIME]))
+            self.crossover = Crossover(self.avg1, self.avg2, self.closes[:self.offset + i])
+            self.signal = None
+        self.crossover.update(bar[CLOSE])
+        return self.crossover.long
+
+    def on_bar(self, product_id, bar):
+        if product_id != self.product_id:
+            return
+        if metrics.enabled:
+            with metrics.span('engine_stage_seconds', stage='signal'):
+                long = self.is_long(bar)
+        else:
+            # Replays skip the span's call per bar.
+            long = self.is_long(bar)
+        if long:
+            if self.broker.available(self.quote):
+                self.broker.buy(self.product_id, self.size)
+        else:
+            if self.broker.available(self.base):
+                self.broker.sell(self.product_id, self.size)
+
+
+class Source(object):
+    """ Base class for bar sources. Iterating yields (product_id, bar). """
+
+    def on_history(self, product_id, candles):
+        """ Called with bars that are not to be traded; Engine.start() sets
+        it to Strategy.warmup.
+        """
+
+    def warmup(self):
+        """ dict: Closed bars from before the run, by product_id. """
+        return {}
+
+    def replay(self):
+        """ dict: Every bar that will be yielded, by product_id, if known. """
+        return {}
+
+    def stop(self):
+        pass
+
+
+class ArraySource(Source):
+    """ Replays candles held in memory, oldest first. """
+
+    def __init__(self, product_id, candles, warmup=0):
+        """ Create an array source.
+        Args:
+            product_id (str): Product
+            candles (np.ndarray): Bars in store.CANDLE_DTYPE, ascending.
+            warmup (Optional[int]): Leading bars passed to Strategy.warmup()
+                instead of being traded on.
+        """
+        self.product_id = product_id
+        self.history = candles[:warmup]
+        self.candles = candles[warmup:]
+
+    def warmup(self):
+        return {self.product_id: self.history}
+
+    def replay(self):
+        return {self.product_id: self.candles}
+
+    def __iter__(self):
+        product_id = self.product_id
+        for bar in self.candles.tolist():
+            yield product_id, bar
+
+
+class StoreSource(ArraySource):
+    """ Replays bars from a CandleStore, optionally between two epoch times. """
+
+    def __init__(self, product_id, granularity=3600, store=None, start=None, end=None, warmup=0):
+        store = store if store is not None else CandleStore()
+        candles = store.load(product_id, granularity)
+        times = candles['time']
+        lo = 0 if start is None else int(np.searchsorted(times, start))
+        hi = len(candles) if end is None else int(np.searchsorted(times, end))
+        if start is not None:
+            # Warmup bars come from before `start`, as far as the store goes.
+            first = max(lo - warmup, 0)
+            warmup = lo - first
+        else:
+            first = 0
+        super(StoreSource, self).__init__(product_id, candles[first:hi], warmup=warmup)
+
+
+class _QueueSource(Source):
+    # Live sources push bars onto a queue from a background thread.
+
+    def __init__(self):
+        self.bars = queue.Queue()
+        self.stopped = False
+
+    def push(self, product_id, bar):
+        self.bars.put((product_id, list(bar)))
+
+    def push_history(self, product_id, candles):
+        """ Queue bars for on_history(), in order with the pushed bars. """
+        self.bars.put((product_id, candles))
+
+    def stop(self):
+        self.stopped = True
+        self.bars.put(None)
+
+    def _items(self, get):
+        while not self.stopped:
+            try:
+                item = get()
+            except queue.Empty:
+                return
+            if item is None:
+                return
+            if isinstance(item[1], np.ndarray):
+                self.on_history(*item)
+            else:
+                yield item
+
+    def __iter__(self):
+        self.begin()
+        for item in self._items(self.bars.get):
+            yield item
+
+    def drain(self):
+        """ Yield the bars queued so far without waiting or starting the source. """
+        return self._items(self.bars.get_nowait)
+
+
+class RestSource(_QueueSource):
+    """ Closed bars from get_product_historic_rates(), polled at each bar
+    close through a CandleStore, as History.update() does.
+    """
+
+    def __init__(self, product_id='BTC-USD', granularity=3600, client=None,
+                 store=None, lookback=200, delay=1., clock=time.time):
+        super(RestSource, self).__init__()
+        self.product_id = product_id
+        self.granularity = granularity
+        self.client = client if client is not None else PublicClient()
+        self.store = store if store is not None else CandleStore()
+        self.lookback = lookback
+        self.delay = delay
+        # Wall clock deciding which bars have closed; simexchange swaps in simulated time.
+        self.clock = clock
+        self.scheduler = Scheduler(clock=clock)
+
+    def warmup(self):
+        self.fetch()
+        return {self.product_id: self.store.load(self.product_id, self.granularity,
+                                                 count=self.lookback)}
+
+    def fetch(self):
+        """ Closed bars missing from the store, as a CANDLE_DTYPE array. """
+        return self.store.update(self.client, self.product_id, self.granularity,
+                                 lookback=self.lookback, now=self.clock())
+
+    def poll(self, boundary=None):
+        if boundary is not None:
+            metrics.observe('engine_cycle_lag_seconds', self.clock() - boundary)
+        with metrics.span('engine_stage_seconds', stage='data'):
+            new = self.fetch()
+        if len(new) > 1:
+            # Bars missed in a stall or published late: the strategy catches
+            # up on them, but only the newest is traded.
+            self.push_history(self.product_id, new[:-1])
+        if len(new):
+            self.push(self.product_id, new[-1].tolist())
+
+    def begin(self):
+        # One poll after a stall; the store update fetches every missed bar.
+        self.scheduler.every(self.granularity, self.poll, delay=self.delay, catch_up=False)
+        threading.Thread(target=self.scheduler.run, daemon=True).start()
+
+    def stop(self):
+        self.scheduler.stop()
+        super(RestSource, self).stop()
+
+
+class FeedSource(_QueueSource):
+    """ Bars built from the websocket matches channel (feed.bar_feed), for
+    one or more products. Each closed bar is also appended to `store`, if
+    given, so a restart can warm up from it.
+    """
+
+    def __init__(self, product_ids, granularity=3600, store=None, lookback=200, **kwargs):
+        super(FeedSource, self).__init__()
+        self.product_ids = list(product_ids)
+        self.granularity = granularity
+        self.store = store
+        self.lookback = lookback
+        self.kwargs = kwargs
+        self.feed = None
+
+    def warmup(self):
+        if self.store is None:
+            return {}
+        return dict((p, self.store.load(p, self.granularity, count=self.lookback))
+                    for p in self.product_ids)
+
+    def on_bar(self, product_id, bar):
+        if self.store is not None:
+            self.store.append(product_id, self.granularity, [bar])
+        self.push(product_id, bar)
+
+    def begin(self):
+        from feed import bar_feed
+        self.feed, aggregator = bar_feed(self.product_ids, self.granularity, self.on_bar,
+                                         **self.kwargs)
+
+        async def main():
+            clock = asyncio.ensure_future(aggregator.clock())
+            try:
+                await self.feed.run()
+            finally:
+                clock.cancel()
+        threading.Thread(target=asyncio.run, args=(main(),), daemon=True).start()
+
+    def stop(self):
+        if self.feed is not None:
+            self.feed.stop()
+        super(FeedSource, self).stop()
+
+
+class SimBroker(object):
+    """ Simulated broker: market orders fill in full at the open of the next
+    bar of their product, paying `fee` of the notional.
+    Attributes:
+        balances (dict): Balance by currency.
+        orders (list): Every order placed, as order dicts.
+        fills (list): Every fill, in get_fills() format except that
+            created_at is the fill bar's epoch time.
+        equity (list): Balances marked to each bar's close, in `quote`.
+    """
+
+    def __init__(self, balances=None, fee=0.005, quote='USD'):
+        """ Create a simulated broker.
+        Args:
+            balances (Optional[dict]): Starting balance by currency,
+                e.g. {'USD': 1000.}.
+            fee (Optional[float]): Taker fee as a fraction of notional.
+            quote (Optional[str]): Currency the equity curve is kept in.
+        """
+        self.balances = dict(balances or {})
+        self.fee = fee
+        self.quote = quote
+        self.pending = []
+        self.orders = []
+        self.fills = []
+        self.equity = []
+        self.prices = {}
+        self.pairs = {}
+        self.marks = {}
+        self.on_fill = None
+        self.ids = itertools.count(1)
+
+    def available(self, currency):
+        return self.balances.get(currency, 0.)
+
+    def buy(self, product_id, size):
+        return self._place(product_id, 'buy', size)
+
+    def sell(self, product_id, size):
+        return self._place(product_id, 'sell', size)
+
+    def _place(self, product_id, side, size):
+        order = {'id': str(next(self.ids)), 'product_id': product_id, 'side': side,
+                 'type': 'market', 'size': size, 'filled_size': 0., 'status': 'pending'}
+        self.orders.append(order)
+        self.pending.append(order)
+        return order
+
+    def on_bar(self, product_id, bar):
+        if self.pending:
+            waiting = []
+            for order in self.pending:
+                if order['product_id'] == product_id:
+                    self._fill(order, bar)
+                else:
+                    waiting.append(order)
+            self.pending = waiting
+        self.prices[product_id] = bar[CLOSE]
+        self.equity.append(self.value())
+
+    def _split(self, product_id):
+        pair = self.pairs.get(product_id)
+        if pair is None:
+            pair = self.pairs[product_id] = split(product_id)
+        return pair
+
+    def _fill(self, order, bar):
+        base, quote = self._split(order['product_id'])
+        balances = self.balances
+        size = order['size']
+        price = bar[OPEN]
+        value = size * price
+        fee = value * self.fee
+        order['status'] = 'done'
+        # Orders the balances cannot cover are rejected, as the exchange would.
+        if order['side'] == 'buy':
+            if balances.get(quote, 0.) < value + fee:
+                order['done_reason'] = 'rejected'
+                return
+            balances[base] = balances.get(base, 0.) + size
+            balances[quote] -= value + fee
+        else:
+            if balances.get(base, 0.) < size - 1e-12:
+                order['done_reason'] = 'rejected'
+                return
+            balances[base] -= size
+            balances[quote] = balances.get(quote, 0.) + value - fee
+        order['filled_size'] = size
+        order['done_reason'] = 'filled'
+        fill = {
+            'trade_id': len(self.fills) + 1,
+            'product_id': order['product_id'],
+            'order_id': order['id'],
+            'side': order['side'],
+            'price': price,
+            'size': size,
+            'fee': fee,
+            'liquidity': 'T',
+            'created_at': bar[TIME],
+        }
+        self.fills.append(fill)
+        if self.on_fill is not None:
+            self.on_fill(fill)
+
+    def value(self):
+        """ Balances marked to the last close, in `quote`. """
+        total = 0.
+        prices = self.prices
+        for currency, amount in self.balances.items():
+            if currency == self.quote:
+                total += amount
+            elif amount:
+                product_id = self.marks.get(currency)
+                if product_id is None:
+                    product_id = self.marks[currency] = '{}-{}'.format(currency, self.quote)
+                price = prices.get(product_id)
+                if price is not None:
+                    total += amount * price
+        return total
+
+
+class LiveBroker(object):
+    """ Places orders with an AuthenticatedClient.
+    Balances come from an AccountCache. Fills reach the strategy from an
+    OrderTracker: feed it user channel messages, or leave `poll` set to
+    apply get_fills() deltas at every bar. A failed balance read counts as
+    no balance and a rejected order is logged, as the exchange answers an
+    order the balances cannot cover (400 Insufficient funds), so neither
+    ends the run.
+    """
+
+    def __init__(self, auth_client, account=None, orders=None, poll=True,
+                 executors=None, books=None, confirm_timeout=1.):
+        """ Create a live broker.
+        Args:
+            auth_client (AuthenticatedClient): Client for orders and fills.
+            account (Optional[AccountCache]): Shared balance snapshot.
+            orders (Optional[OrderTracker]): Shared order tracker.
+            poll (Optional[bool]): Poll get_fills() after each order and at
+                each bar while orders are open, for runs without the user
+                channel.
+            executors (Optional[dict]): execution.Executor by product_id;
+                orders for those products are sent through it instead of as
+                plain market orders.
+            books (Optional[dict]): orderbook.OrderBook by product_id, kept
+                current from the level2 feed; the expected price of each
+                order is logged from it. Defaults to the executors' books.
+            confirm_timeout (Optional[float]): Without `poll`, seconds to
+                wait for the user channel to report an order done before
+                returning, so its fills (and their latency) are seen then
+                rather than at the next bar.
+        """
+        self.auth_client = auth_client
+        self.account = account if account is not None else AccountCache(auth_client)
+        self.orders = orders if orders is not None else OrderTracker(auth_client)
+        self.orders.on_fill = self._on_fill
+        self.poll = poll
+        self.confirm_timeout = confirm_timeout
+        self.executors = dict(executors or {})
+        self.books = dict(books or {})
+        for product_id, executor in self.executors.items():
+            # IOC slices are confirmed through the same tracker.
+            if executor.orders is None:
+                executor.orders = self.orders
+            if executor.book is not None:
+                self.books.setdefault(product_id, executor.book)
+        self.on_fill = None
+        # Placement time by order id, until the first fill is reported.
+        self.placed = {}
+
+    def _on_fill(self, fill):
+        placed = self.placed.pop(fill.get('order_id'), None)
+        if placed is not None:
+            metrics.observe('engine_stage_seconds', time.time() - placed, stage='fill')
+        self.account.invalidate()
+        if self.on_fill is not None:
+            self.on_fill(fill)
+
+    def available(self, currency):
+        try:
+            with metrics.span('engine_stage_seconds', stage='balance'):
+                return self.account.available(currency)
+        except (CBProAPIError, requests.RequestException, ValueError) as e:
+            logger.warning('{} - {} balance unavailable: {}'.format(datetime.now(), currency, e))
+            return 0.
+
+    def buy(self, product_id, size):
+        return self._place(product_id, 'buy', size)
+
+    def sell(self, product_id, size):
+        return self._place(product_id, 'sell', size)
+
+    def _place(self, product_id, side, size):
+        book = self.books.get(product_id)
+        if book is not None:
+            price, filled = book.vwap(side, size)
+            logger.warning('{} - {} {} {} expected at {} for {} on the book'.format(
+                datetime.now(), product_id, side, size, price, filled))
+        executor = self.executors.get(product_id)
+        if self.poll:
+            try:
+                self.orders.seed(product_id)
+            except (CBProAPIError, requests.RequestException) as e:
+                logger.warning('{} - {} fills unavailable: {}'.format(datetime.now(), product_id, e))
+        try:
+            with metrics.span('engine_stage_seconds', stage='submit'):
+                if executor is not None:
+                    result = executor.execute(side, size)
+                    orders = result.orders
+                else:
+                    result = self.auth_client.place_market_order(product_id, side, size=size)
+                    orders = [result]
+        except (CBProAPIError, requests.RequestException) as e:
+            self.account.invalidate()
+            logger.warning('{} - {} {} {} failed: {}'.format(
+                datetime.now(), product_id, side, size, e))
+            return None
+        self.account.invalidate()
+        logger.warning('{} - {}'.format(datetime.now(), result))
+        handles = []
+        for order in orders:
+            if isinstance(order, dict) and 'id' in order:
+                if metrics.enabled:
+                    self.placed[order['id']] = time.time()
+                handles.append(self.orders.track(order))
+        if handles:
+            self._confirm(product_id, handles)
+        return result
+
+    def _confirm(self, product_id, handles):
+        # Market orders fill on arrival: report the fills now, not a bar later.
+        if self.poll:
+            try:
+                self.orders.poll_fills(product_id)
+            except (CBProAPIError, requests.RequestException) as e:
+                logger.warning('{} - {} fills unavailable: {}'.format(datetime.now(), product_id, e))
+            return
+        deadline = time.time() + self.confirm_timeout
+        for handle in handles:
+            handle.wait(max(deadline - time.time(), 0.))
+
+    def on_bar(self, product_id, bar):
+        if self.poll and self.orders.open_orders():
+            self.orders.poll_fills(product_id)
+
+
+class Engine(object):
+    """ Runs a strategy over a source of bars, trading through a broker.
+    Attributes:
+        after_bar (callable): Optional, called as after_bar(product_id, bar)
+            once the strategy has seen each bar.
+    """
+
+    def __init__(self, strategy, source, broker, halt_on_error=True):
+        """ Create an engine.
+        Args:
+            strategy (Strategy): Strategy to run.
+            source (Source): Bars to run it on.
+            broker: SimBroker, LiveBroker or anything with their methods.
+            halt_on_error (Optional[bool]): Let an exception raised while
+                handling a bar end run(), as backtests want. Live runs pass
+                False to log it and carry on with the next bar.
+        """
+        self.strategy = strategy
+        self.source = source
+        self.broker = broker
+        self.halt_on_error = halt_on_error
+        self.after_bar = None
+        self.bars = 0
+
+    def start(self):
+        """ Wire the strategy to the broker and hand it the source's history. """
+        self.broker.on_fill = self.strategy.on_fill
+        self.source.on_history = self.strategy.warmup
+        self.strategy.start(self)
+        for product_id, candles in self.source.warmup().items():
+            self.strategy.warmup(product_id, candles)
+        for product_id, candles in self.source.replay().items():
+            self.strategy.prepare(product_id, candles)
+
+    def on_bar(self, product_id, bar):
+        """ Feed one bar to the broker, then the strategy. """
+        self.broker.on_bar(product_id, bar)
+        self.strategy.on_bar(product_id, bar)
+        self.bars += 1
+        if self.after_bar is not None:
+            self.after_bar(product_id, bar)
+
+    def run(self):
+        """ Feed every bar from the source to the broker, then the strategy.
+        Returns:
+            Engine
+        """
+        self.start()
+        broker_bar = self.broker.on_bar
+        strategy_bar = self.strategy.on_bar
+        after_bar = self.after_bar
+        try:
+            if self.halt_on_error:
+                for product_id, bar in self.source:
+                    broker_bar(product_id, bar)
+                    strategy_bar(product_id, bar)
+                    self.bars += 1
+                    if after_bar is not None:
+                        after_bar(product_id, bar)
+            else:
+                for product_id, bar in self.source:
+                    try:
+                        self.on_bar(product_id, bar)
+                    except Exception:
+                        logger.exception('{} bar at {} failed'.format(product_id, bar[TIME]))
+        finally:
+            self.source.stop()
+        return self
+
+    def stop(self):
+        self.source.stop()
+
+
+if __name__ == '__main__':
+    strategy = CrossoverStrategy()
+    broker = SimBroker({'USD': 1000.})
+    engine = Engine(strategy, StoreSource('BTC-USD', 3600), broker).run()
+    print('{} bars, {} fills, equity {:.2f}'.format(
+        engine.bars, len(broker.fills), broker.equity[-1] if broker.equity else 1000.))
@@ -0,0 +1,259 @@
+import logging
+import math
+import time
+import uuid
+
+from cbpro import CBProAPIError
+from feed import parse_time
+
+"""
+
+Slippage-aware order execution.
+
+Executor picks how to send an order from its estimated impact on the local
+order book (orderbook.OrderBook):
+
+- 'market': impact within `max_impact`, or no book to estimate from.
+- 'post_only': a limit order at the best bid (buy) or ask (sell) that only
+  rests, paying no taker fee; used when `passive` is set.
+- 'sliced': several IOC limit orders, each sized to the depth inside the
+  impact band and priced at its edge, with a pause between slices for the
+  book to refill. Whatever is left after `max_slices` is sent as market.
+
+Every order is recorded in an ExecutionReport with submit-to-ack latency and,
+once reconciled against get_fills(), realized price, fees, fill latency and
+slippage versus the mid at decision time.
+
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionReport(object):
+    """ Outcome of one Executor.execute() call.
+    Attributes:
+        side (str): 'buy' or 'sell'.
+        size (float): Size requested.
+        method (str): 'market', 'post_only' or 'sliced'.
+        arrival (float): Book mid when the order was decided, or None.
+        estimate (float): Expected average price from the book, or None.
+        orders (list): Order responses, in the order sent.
+        latencies (list): Seconds from submit to response, per order.
+        submitted (float): Epoch time of the first submit.
+        fills (list): Fills from get_fills(), after reconcile().
+    """
+
+    def __init__(self, side, size, method, arrival, estimate):
+        self.side = side
+        self.size = size
+        self.method = method
+        self.arrival = arrival
+        self.estimate = estimate
+        self.orders = []
+        self.latencies = []
+        self.submitted = None
+        self.fills = []
+
+    def __repr__(self):
+        return 'ExecutionReport({} {} via {}, {} orders, price {}, slippage {})'.format(
+            self.side, self.size, self.method, len(self.orders), self.price, self.slippage)
+
+    @property
+    def filled(self):
+        return sum(float(x['size']) for x in self.fills)
+
+    @property
+    def price(self):
+        """ Realized average price, once reconciled. """
+        filled = self.filled
+        if not filled:
+            return None
+        return sum(float(x['size']) * float(x['price']) for x in self.fills) / filled
+
+    @property
+    def fees(self):
+        return sum(float(x.get('fee') or 0) for x in self.fills)
+
+    @property
+    def slippage(self):
+        """ Realized cost versus the arrival mid, as a fraction; positive is worse. """
+        price = self.price
+        if price is None or not self.arrival:
+            return None
+        if self.side == 'buy':
+            return (price - self.arrival) / self.arrival
+        return (self.arrival - price) / self.arrival
+
+    @property
+    def fill_latency(self):
+        """ Seconds from the first submit to the last fill, once reconciled. """
+        if not self.fills or self.submitted is None:
+            return None
+        return max(parse_time(x['created_at']) for x in self.fills) - self.submitted
+
+
+class Executor(object):
+    """ Sends orders for one product using the cheapest suitable method.
+    Attributes:
+        reports (list): Every ExecutionReport produced, oldest first.
+    """
+
+    def __init__(self, auth_client, product_id='BTC-USD', book=None,
+                 max_impact=0.0005, passive=False, max_slices=5,
+                 pause=1., quote_increment=0.01, orders=None, confirm_timeout=5.):
+        """ Create an executor.
+        Args:
+            auth_client (AuthenticatedClient): Client for orders and fills.
+            product_id (Optional[str]): Product
+            book (Optional[OrderBook]): Local book used to estimate impact.
+            max_impact (Optional[float]): Largest acceptable slippage versus
+                the mid for a single order, as a fraction.
+            passive (Optional[bool]): Rest a post_only limit order instead of
+                taking liquidity when the impact is too high.
+            max_slices (Optional[int]): Most IOC slices before the remainder
+                is sent as a market order.
+            pause (Optional[float]): Seconds between slices.
+            quote_increment (Optional[float]): Price tick for limit prices.
+            orders (Optional[OrderTracker]): Tracker fed from the user
+                channel; IOC fills are confirmed through it instead of by
+                polling get_order().
+            confirm_timeout (Optional[float]): Seconds to wait for an IOC
+                slice to be done before sizing the next one.
+        """
+        self.auth_client = auth_client
+        self.product_id = product_id
+        self.book = book
+        self.max_impact = max_impact
+        self.passive = passive
+        self.max_slices = max_slices
+        self.pause = pause
+        self.quote_increment = quote_increment
+        self.orders = orders
+        self.confirm_timeout = confirm_timeout
+        self.reports = []
+
+    def _round(self, price, side):
+        # Round limit prices away from crossing further than intended.
+        ticks = price / self.quote_increment
+        ticks = math.floor(ticks + 1e-9) if side == 'buy' else math.ceil(ticks - 1e-9)
+        return round(ticks * self.quote_increment, 8)
+
+    def plan(self, side, size):
+        """ Choose an execution method for an order.
+        Returns:
+            str: 'market', 'post_only' or 'sliced'.
+        """
+        if self.book is None or self.book.mid is None:
+            return 'market'
+        impact = self.book.impact(side, size)
+        price, filled = self.book.vwap(side, size)
+        if impact is not None and filled >= size and impact <= self.max_impact:
+            return 'market'
+        if self.passive:
+            return 'post_only'
+        return 'sliced'
+
+    def _send(self, report, method, **kwargs):
+        start = time.time()
+        if report.submitted is None:
+            report.submitted = start
+        kwargs.setdefault('client_oid', str(uuid.uuid4()))
+        order = method(self.product_id, report.side, **kwargs)
+        report.latencies.append(time.time() - start)
+        report.orders.append(order)
+        return order
+
+    def execute(self, side, size):
+        """ Send an order of `size` using the method chosen by plan().
+        Returns:
+            ExecutionReport
+        """
+        method = self.plan(side, size)
+        arrival = self.book.mid if self.book is not None else None
+        estimate = self.book.vwap(side, size)[0] if self.book is not None else None
+        report = ExecutionReport(side, size, method, arrival, estimate)
+
+        if method == 'market':
+            self._send(report, self.auth_client.place_market_order, size=size)
+        elif method == 'post_only':
+            best = self.book.best_bid if side == 'buy' else self.book.best_ask
+            self._send(report, self.auth_client.place_limit_order,
+                       price=best[0], size=size, post_only=True)
+        else:
+            self._slice(report, side, size)
+        self.reports.append(report)
+        return report
+
+    def _slice(self, report, side, size):
+        remaining = size
+        for i in range(self.max_slices):
+            mid = self.book.mid
+            if mid is None:
+                break
+            # Everything resting inside the impact band can be taken by one IOC.
+            edge = mid * (1 + self.max_impact) if side == 'buy' else mid * (1 - self.max_impact)
+            edge = self._round(edge, side)
+            available = self.book.depth('sell' if side == 'buy' else 'buy', edge)
+            take = min(remaining, available)
+            if take > 0:
+                order = self._send(report, self.auth_client.place_limit_order,
+                                   price=edge, size=round(take, 8), time_in_force='IOC')
+                remaining -= self._filled(order)
+            if remaining <= 1e-12:
+                return
+            time.sleep(self.pause)
+        if remaining > 1e-12:
+            self._send(report, self.auth_client.place_market_order, size=round(remaining, 8))
+
+    def _filled(self, order):
+        """ Size an IOC order filled, once the exchange reports it done.
+        The POST /orders reply is usually still pending with nothing filled,
+        so the final state comes from the order tracker or get_order().
+        """
+        if not isinstance(order, dict) or not order.get('id'):
+            return 0.
+        state = order
+        if state.get('status') != 'done' and self.orders is not None:
+            state = self.orders.track(order).wait(self.confirm_timeout) or state
+        deadline = time.time() + self.confirm_timeout
+        while state.get('status') != 'done' and time.time() < deadline:
+            time.sleep(0.1)
+            try:
+                state = self.auth_client.get_order(order['id'])
+            except CBProAPIError as e:
+                # Canceled orders without matches are gone.
+                if e.status_code == 404:
+                    return 0.
+                raise
+        if state.get('status') != 'done':
+            logger.warning('{} IOC {} not done after {}s; counting {} filled'.format(
+                self.product_id, order['id'], self.confirm_timeout, state.get('filled_size')))
+        return float(state.get('filled_size') or 0)
+
+    def reconcile(self, report):
+        """ Fetch the fills of every order in `report` to compute realized
+        price, fees, fill latency and slippage.
+        """
+        fills = []
+        for order in report.orders:
+            if isinstance(order, dict) and order.get('id'):
+                fills.extend(self.auth_client.get_fills(order_id=order['id']))
+        report.fills = fills
+        if report.slippage is not None:
+            logger.warning('{} {} {} via {}: price {}, slippage {:.5f}, fees {}'.format(
+                self.product_id, report.side, report.size, report.method,
+                report.price, report.slippage, report.fees))
+        return report
+
+    def summary(self):
+        """ Mean slippage and latencies over every reconciled report. """
+        done = [r for r in self.reports if r.slippage is not None]
+        latencies = [x for r in self.reports for x in r.latencies]
+        fill_latencies = [r.fill_latency for r in done if r.fill_latency is not None]
+        return {
+            'orders': len(self.reports),
+            'reconciled': len(done),
+            'mean_slippage': sum(r.slippage for r in done) / len(done) if done else None,
+            'mean_ack_latency': sum(latencies) / len(latencies) if latencies else None,
+            'mean_fill_latency': sum(fill_latencies) / len(fill_latencies) if fill_latencies else None,
+        }
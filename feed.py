@@ -0,0 +1,329 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime
+
+"""
+
+Websocket market data feed.
+
+WebsocketFeed subscribes to the Coinbase Pro websocket feed (matches, ticker,
+level2, ...), reconnects with backoff when the connection drops and detects
+gaps: duplicated or missed match messages are found by trade_id, which is
+contiguous per product, and `full` channel messages by sequence number.
+Sequence numbers are shared between channels (a ticker carries the sequence
+of the match behind it), so they are compared per product and channel. Given
+the `auth` of an AuthenticatedClient it signs its subscription, as the user
+channel requires.
+
+BarAggregator turns match messages into OHLCV bars locally and pushes each
+closed bar, as [ time, low, high, open, close, volume ], to a callback such as
+History.on_bar.
+
+ReplayServer is a local stand-in for the feed that replays recorded messages,
+one JSON object per line, to any client that subscribes.
+
+Requires the `websockets` package.
+
+"""
+
+FEED_URL = 'wss://ws-feed.pro.coinbase.com'
+
+logger = logging.getLogger(__name__)
+
+# Channel of each message type outside the full channel; matches are checked
+# by trade_id instead.
+MESSAGE_CHANNELS = {
+    'ticker': 'ticker',
+    'heartbeat': 'heartbeat',
+    'status': 'status',
+}
+
+
+def _websockets():
+    try:
+        import websockets
+    except ImportError:
+        raise ImportError('The websocket feed requires the `websockets` package: '
+                          'pip install websockets')
+    return websockets
+
+
+def parse_time(value):
+    """ Convert an ISO 8601 timestamp from the feed to epoch seconds. """
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class WebsocketFeed(object):
+    """ Asyncio client for the websocket feed.
+    Attributes:
+        product_ids (list): Products subscribed to.
+        channels (list): Channels subscribed to.
+        url (str): Feed URL.
+    """
+
+    def __init__(self, product_ids, channels=('matches',), url=FEED_URL,
+                 on_message=None, on_gap=None, reconnect_delay=1.,
+                 max_reconnect_delay=60., auth=None):
+        """ Create a websocket feed client.
+        Args:
+            product_ids (list): Products to subscribe to.
+            channels (Optional[list]): Channels, e.g. 'matches', 'ticker',
+                'level2', 'heartbeat'.
+            url (Optional[str]): Feed URL. Defaults to the cbpro feed.
+            on_message (Optional[callable]): Called with each decoded message
+                that is not a duplicate.
+            on_gap (Optional[callable]): Called as on_gap(product_id, expected,
+                received) when messages were missed, e.g. across a reconnect.
+            reconnect_delay (Optional[float]): First reconnect wait, seconds.
+            max_reconnect_delay (Optional[float]): Cap for the doubling wait.
+            auth (Optional[CBProAuth]): Signs the subscription, e.g.
+                AuthenticatedClient.auth; needed for the user channel.
+        """
+        self.product_ids = list(product_ids)
+        self.channels = list(channels)
+        self.url = url
+        self.on_message = on_message
+        self.on_gap = on_gap
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.auth = auth
+        # Last sequence by (product_id, channel).
+        self.last_sequence = {}
+        self.last_trade_id = {}
+        self.gaps = 0
+        self.stopped = False
+        self.ws = None
+        # Event loop run() is on, for stop() from other threads.
+        self.loop = None
+
+    def subscription(self):
+        msg = {
+            'type': 'subscribe',
+            'product_ids': self.product_ids,
+            'channels': self.channels
+        }
+        if self.auth is not None:
+            # Signed as a GET of /users/self/verify, freshly on each connect.
+            timestamp = str(time.time() + self.auth.offset)
+            msg['signature'] = self.auth.sign(timestamp, 'GET', '/users/self/verify')
+            msg['key'] = self.auth.api_key
+            msg['passphrase'] = self.auth.passphrase
+            msg['timestamp'] = timestamp
+        return msg
+
+    async def run(self):
+        """ Connect, subscribe and dispatch messages until stop() is called. """
+        websockets = _websockets()
+        self.loop = asyncio.get_running_loop()
+        delay = self.reconnect_delay
+        while not self.stopped:
+            try:
+                async with websockets.connect(self.url, max_size=None) as ws:
+                    self.ws = ws
+                    await ws.send(json.dumps(self.subscription()))
+                    delay = self.reconnect_delay
+                    async for raw in ws:
+                        self.handle(json.loads(raw))
+                        if self.stopped:
+                            break
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                logger.warning('websocket feed disconnected: {}'.format(e))
+            finally:
+                self.ws = None
+            if self.stopped:
+                break
+            # Jittered exponential backoff between reconnects.
+            await asyncio.sleep(delay * (0.5 + random.random() / 2))
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def stop(self):
+        """ Close the connection; safe to call from any thread. """
+        self.stopped = True
+        ws = self.ws
+        if ws is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            asyncio.ensure_future(ws.close())
+        else:
+            # run() owns the socket; hand the close to its loop.
+            asyncio.run_coroutine_threadsafe(ws.close(), self.loop)
+
+    def handle(self, msg):
+        """ Check one message for duplicates and gaps, then dispatch it.
+        Returns:
+            bool: False if the message was a duplicate and was dropped.
+        """
+        product_id = msg.get('product_id')
+        sequence = msg.get('sequence')
+        kind = msg.get('type')
+        match = kind in ('match', 'last_match')
+        if product_id is not None and sequence is not None and \
+                (not match or 'full' in self.channels):
+            channel = MESSAGE_CHANNELS.get(kind, 'full')
+            key = (product_id, channel)
+            last = self.last_sequence.get(key)
+            if last is not None and sequence <= last:
+                return False
+            # Only the full channel numbers every message for a product.
+            if last is not None and sequence > last + 1 and channel == 'full':
+                self._gap(product_id, last + 1, sequence)
+            self.last_sequence[key] = sequence
+
+        if match:
+            trade_id = msg['trade_id']
+            last = self.last_trade_id.get(product_id)
+            if last is not None and trade_id <= last:
+                return False
+            if last is not None and trade_id > last + 1:
+                self._gap(product_id, last + 1, trade_id)
+            self.last_trade_id[product_id] = trade_id
+
+        if self.on_message is not None:
+            self.on_message(msg)
+        return True
+
+    def _gap(self, product_id, expected, received):
+        self.gaps += 1
+        logger.warning('{} feed gap: expected {}, received {}'.format(
+            product_id, expected, received))
+        if self.on_gap is not None:
+            self.on_gap(product_id, expected, received)
+
+
+class BarAggregator(object):
+    """ Builds OHLCV bars from match messages.
+    A bar is emitted once a trade arrives in a later interval, or when flush()
+    is called after the interval has ended. Intervals without trades produce
+    no bar, as with get_product_historic_rates().
+    """
+
+    def __init__(self, granularity, on_bar):
+        """ Create a bar aggregator.
+        Args:
+            granularity (int): Bar size in seconds.
+            on_bar (callable): Called as on_bar(product_id, bar) with bar as
+                [ time, low, high, open, close, volume ].
+        """
+        self.granularity = granularity
+        self.on_bar = on_bar
+        self.bars = {}
+
+    def on_message(self, msg):
+        # last_match is the trade before we subscribed; it only seeds trade_id.
+        if msg.get('type') != 'match':
+            return
+        product_id = msg['product_id']
+        when = parse_time(msg['time'])
+        price = float(msg['price'])
+        size = float(msg['size'])
+        start = int(when) // self.granularity * self.granularity
+
+        bar = self.bars.get(product_id)
+        if bar is not None and start > bar[0]:
+            self.on_bar(product_id, bar)
+            bar = None
+        if bar is None:
+            self.bars[product_id] = [start, price, price, price, price, size]
+        elif start == bar[0]:
+            bar[1] = min(bar[1], price)
+            bar[2] = max(bar[2], price)
+            bar[4] = price
+            bar[5] += size
+
+    def flush(self, now=None):
+        """ Emit every bar whose interval ended at or before `now`. """
+        if now is None:
+            now = time.time()
+        for product_id, bar in list(self.bars.items()):
+            if bar[0] + self.granularity <= now:
+                del self.bars[product_id]
+                self.on_bar(product_id, bar)
+
+    async def clock(self, delay=0.25):
+        """ Flush bars on each interval boundary, `delay` seconds after it. """
+        while True:
+            now = time.time()
+            boundary = (int(now) // self.granularity + 1) * self.granularity
+            await asyncio.sleep(boundary + delay - now)
+            self.flush()
+
+
+def bar_feed(product_ids, granularity, on_bar, **kwargs):
+    """ Websocket feed that pushes closed bars to `on_bar`.
+    Returns:
+        tuple: (WebsocketFeed, BarAggregator). Run both with
+            asyncio.gather(feed.run(), aggregator.clock()).
+    """
+    aggregator = BarAggregator(granularity, on_bar)
+    feed = WebsocketFeed(product_ids, channels=['matches', 'heartbeat'],
+                         on_message=aggregator.on_message, **kwargs)
+    return feed, aggregator
+
+
+class ReplayServer(object):
+    """ Local websocket server that replays recorded feed messages.
+    Each client gets the recorded messages for the products it subscribes to,
+    in file order, after its subscribe message.
+    """
+
+    def __init__(self, messages, host='127.0.0.1', port=0, speed=None):
+        """ Create a replay server.
+        Args:
+            messages (str/list): Path to a file of JSON lines, or a list of
+                message dicts.
+            host (Optional[str]): Interface to bind.
+            port (Optional[int]): Port to bind; 0 picks a free port.
+            speed (Optional[float]): Replay at `speed` times real time using
+                message timestamps. By default messages are sent back to back.
+        """
+        if isinstance(messages, str):
+            with open(messages) as f:
+                messages = [json.loads(line) for line in f if line.strip()]
+        self.messages = messages
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.server = None
+
+    @property
+    def url(self):
+        return 'ws://{}:{}'.format(self.host, self.port)
+
+    async def start(self):
+        websockets = _websockets()
+        self.server = await websockets.serve(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _serve(self, ws, *args):
+        request = json.loads(await ws.recv())
+        products = set(request.get('product_ids', []))
+        await ws.send(json.dumps({'type': 'subscriptions',
+                                  'channels': request.get('channels', [])}))
+        previous = None
+        for msg in self.messages:
+            if msg.get('product_id') not in products:
+                continue
+            if self.speed and 'time' in msg:
+                when = parse_time(msg['time'])
+                if previous is not None and when > previous:
+                    await asyncio.sleep((when - previous) / self.speed)
+                previous = when
+            await ws.send(json.dumps(msg))
@@ -0,0 +1,174 @@
+import numpy as np
+
+"""
+
+Moving average engine.
+
+sma() and sma_table() compute full series for a historical array in one
+vectorized pass from a single cumulative sum. RollingMeans keeps running sums
+over a NumPy ring buffer so each new bar updates every window at once in
+constant time.
+
+Until `window` bars have been seen, averages are taken over the bars that are
+available, i.e. np.mean(close[-window:]).
+
+The crossover signal, SMA(fast) > SMA(slow), is defined here only: in bulk by
+crossover_table() for backtests and sweeps, and bar by bar by Crossover for
+History, engine.CrossoverStrategy and runner.MultiRunner.
+
+"""
+
+
+def _cumsum(values):
+    # Offsetting by the first value keeps the running sum small, which keeps
+    # differences of it accurate over long minute-bar histories.
+    values = np.asarray(values, dtype=np.float64)
+    offset = values[0] if len(values) else 0.
+    sums = np.empty(len(values) + 1)
+    sums[0] = 0.
+    np.cumsum(values - offset, out=sums[1:])
+    return sums, offset
+
+
+def sma_table(values, windows):
+    """ Simple moving averages for several windows from one cumulative sum.
+    Args:
+        values (np.ndarray): Input series, e.g. closes.
+        windows (list): Window lengths in bars.
+    Returns:
+        np.ndarray: Shape (len(windows), len(values)); row i is the SMA of
+            windows[i] at every bar.
+    """
+    sums, offset = _cumsum(values)
+    n = len(sums) - 1
+    table = np.empty((len(windows), n))
+    for row, window in zip(table, windows):
+        window = min(int(window), n)
+        # Partial windows at the start, then one slice difference for the rest.
+        row[:window] = sums[1:window + 1] / np.arange(1, window + 1)
+        np.subtract(sums[window + 1:], sums[1:n - window + 1], out=row[window:])
+        row[window:] /= window
+    table += offset
+    return table
+
+
+def sma(values, window):
+    """ Simple moving average of `values` at every bar.
+    Args:
+        values (np.ndarray): Input series, e.g. closes.
+        window (int): Window length in bars.
+    Returns:
+        np.ndarray: SMA series, same length as `values`.
+    """
+    return sma_table(values, [window])[0]
+
+
+def crossover_table(values, pairs):
+    """ Fast-over-slow signal for many (fast, slow) window pairs.
+    Each distinct window is averaged once, however many pairs share it.
+    Args:
+        values (np.ndarray): Input series, e.g. closes.
+        pairs (list): (fast, slow) window tuples.
+    Returns:
+        np.ndarray: Boolean array of shape (len(pairs), len(values)), True
+            where SMA(fast) > SMA(slow).
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    windows, index = np.unique(pairs, return_inverse=True)
+    index = index.reshape(pairs.shape)
+    table = sma_table(values, windows)
+    return table[index[:, 0]] > table[index[:, 1]]
+
+
+class RollingMeans(object):
+    """ Constant-time rolling means for a fixed set of windows.
+    All windows share one ring buffer sized to the longest window.
+    Attributes:
+        windows (np.ndarray): Window lengths in bars.
+        count (int): Number of values seen.
+    """
+
+    def __init__(self, windows, values=None, resync=10000):
+        """ Create rolling means.
+        Args:
+            windows (list): Window lengths in bars.
+            values (Optional[np.ndarray]): History to seed the buffer with.
+            resync (Optional[int]): Recompute the sums exactly every `resync`
+                updates so floating point error cannot accumulate.
+        """
+        self.windows = np.asarray(windows, dtype=np.int64)
+        self.size = int(self.windows.max())
+        self.buffer = np.zeros(self.size)
+        self.sums = np.zeros(len(self.windows))
+        self.count = 0
+        self.pos = 0
+        self.resync = resync
+        if values is not None:
+            self.extend(values)
+
+    def extend(self, values):
+        """ Add many values at once, vectorized. """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        if len(values) < self.size:
+            for value in values:
+                self.update(value)
+            return
+        tail = values[-self.size:]
+        self.buffer[:] = tail
+        self.pos = 0
+        self.count += len(values)
+        self._resum()
+
+    def update(self, value):
+        """ Add one value and update every window in O(1). """
+        # The value leaving window w was written w bars ago.
+        leaving = self.buffer[(self.pos - self.windows) % self.size]
+        leaving[self.count < self.windows] = 0.
+        self.sums += value - leaving
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+        self.count += 1
+        if self.count % self.resync == 0:
+            self._resum()
+
+    def _resum(self):
+        # Oldest-to-newest view of the buffer.
+        ordered = np.roll(self.buffer, -self.pos)
+        n = np.minimum(self.windows, self.count)
+        sums = np.concatenate([[0.], np.cumsum(ordered[::-1])])
+        self.sums = sums[n]
+
+    @property
+    def means(self):
+        """ np.ndarray: Current mean for each window. """
+        n = np.minimum(self.windows, self.count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / n
+
+
+class Crossover(object):
+    """ Fast-over-slow signal kept current bar by bar; the rolling
+    counterpart of crossover_table().
+    Attributes:
+        fast (int): Fast window in bars.
+        slow (int): Slow window in bars.
+    """
+
+    def __init__(self, fast, slow, values=None):
+        self.fast = fast
+        self.slow = slow
+        self.means = RollingMeans([fast, slow], values)
+
+    def extend(self, values):
+        self.means.extend(values)
+
+    def update(self, value):
+        self.means.update(value)
+
+    @property
+    def long(self):
+        """ bool: True while SMA(fast) > SMA(slow); False before any bar. """
+        fast, slow = self.means.means
+        return bool(fast > slow)
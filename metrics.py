@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+
+Timing spans and latency histograms.
+
+Metrics collects histograms keyed by name and labels. Stages of a decision
+cycle are timed with spans:
+
+    with metrics.span('engine_stage_seconds', stage='signal'):
+        long = strategy.is_long(bar)
+
+and cbpro clients report the latency of every HTTP request once instrumented
+with metrics.instrument(client). Everything is exported as a JSON file
+(write()) or in the Prometheus text format (to_prometheus(), or over HTTP
+with serve()).
+
+The module-level `metrics` starts disabled: span() then returns a shared
+no-op context manager and observe() returns immediately, so instrumented
+code costs one attribute check per call.
+
+"""
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+
+# Path segments that identify a single object (order and account ids, numeric
+# ids) are folded so each endpoint has one histogram.
+ID_SEGMENT = re.compile(r'/(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+                        r'|[0-9a-f]{24,}|\d+|client:[^/]+)(?=/|$)', re.I)
+
+
+def endpoint(path):
+    """ Endpoint label for a request path, e.g. '/orders/:id'. """
+    return ID_SEGMENT.sub('/:id', path)
+
+
+class Histogram(object):
+    """ Counts of observations per bucket, with their sum and count.
+    Attributes:
+        buckets (tuple): Upper bounds, ascending; an implicit +Inf follows.
+        counts (list): Observations per bucket, not cumulative.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding quantile `q`, or None if empty. """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(.5),
+            'p99': self.quantile(.99),
+        }
+
+
+class _Span(object):
+
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _NullSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Metrics(object):
+    """ Registry of histograms.
+    Attributes:
+        enabled (bool): Record observations; when False nothing is recorded.
+        histograms (dict): Histogram by (name, sorted label items).
+    """
+
+    def __init__(self, enabled=True, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        """ Record `value` (seconds) in the histogram for name and labels. """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def request(self, method, path, status, seconds):
+        """ Record the latency of one HTTP request, labelled by endpoint. """
+        self.observe('cbpro_http_request_seconds', seconds, method=method.upper(),
+                     endpoint=endpoint(path.split('?')[0]), status=str(status))
+
+    def span(self, name, **labels):
+        """ Context manager recording the time spent inside it. """
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, labels)
+
+    def instrument(self, client):
+        """ Record request latencies of a cbpro client in this registry. """
+        client.metrics = self
+        return client
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def snapshot(self):
+        """ Every histogram as a list of dicts with name and labels. """
+        with self.lock:
+            items = sorted(self.histograms.items())
+            return [dict(h.to_dict(), name=name, labels=dict(labels)) for (name, labels), h in items]
+
+    def write(self, path):
+        """ Write snapshot() to `path` as JSON, replacing the file. """
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'time': time.time(), 'histograms': self.snapshot()}, f, indent=1)
+        # Readers never see a partly written file.
+        os.replace(path + '.tmp', path)
+
+    def to_prometheus(self):
+        """ Histograms in the Prometheus text exposition format. """
+        lines = []
+        typed = set()
+        for entry in self.snapshot():
+            name = entry['name']
+            if name not in typed:
+                lines.append('# TYPE {} histogram'.format(name))
+                typed.add(name)
+            labels = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                      for k, v in sorted(entry['labels'].items())]
+            total = 0
+            for bound, count in zip(entry['buckets'] + ['+Inf'], entry['counts']):
+                total += count
+                le = labels + ['le="{}"'.format(bound)]
+                lines.append('{}_bucket{{{}}} {}'.format(name, ','.join(le), total))
+            suffix = '{{{}}}'.format(','.join(labels)) if labels else ''
+            lines.append('{}_sum{} {}'.format(name, suffix, repr(entry['sum'])))
+            lines.append('{}_count{} {}'.format(name, suffix, entry['count']))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """ Serve to_prometheus() at /metrics from a background thread.
+        Returns:
+            ThreadingHTTPServer: Call shutdown() to stop it.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+metrics = Metrics(enabled=False)
@@ -0,0 +1,262 @@
+import json
+from bisect import bisect_left, insort
+
+"""
+
+Local level 2 order book.
+
+OrderBook is built from a snapshot (the level2 websocket `snapshot` message or
+get_product_order_book(level=2)) and kept current from `l2update` messages.
+Each side keeps a size per price in a dict and its prices in SortedKeys,
+ordered worst to best. SortedKeys splits the keys into chunks of bounded size
+indexed by their largest key, so adding or removing a level is a bisect over
+the chunks and one within a chunk, O(log n), plus moving at most 2 * LOAD
+entries (and, once every LOAD inserts at worst, one entry of the chunk
+index). Best bid/ask reads are O(1), walking depth for VWAP starts at the
+best price without sorting, and a snapshot is sorted once rather than
+inserted level by level.
+
+"""
+
+
+LOAD = 256
+
+
+class SortedKeys(object):
+    """ Sorted keys in chunks of LOAD to 2 * LOAD entries.
+    Attributes:
+        chunks (list): Sorted lists, each holding keys above the previous one.
+        maxes (list): Largest key of each chunk.
+    """
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.chunks = [keys[i:i + LOAD] for i in range(0, len(keys), LOAD)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.size = len(keys)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key):
+        """ Insert a key that is not present. """
+        self.size += 1
+        if not self.chunks:
+            self.chunks.append([key])
+            self.maxes.append(key)
+            return
+        i = bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            i -= 1
+            self.chunks[i].append(key)
+            self.maxes[i] = key
+        else:
+            insort(self.chunks[i], key)
+        chunk = self.chunks[i]
+        if len(chunk) > 2 * LOAD:
+            self.chunks[i:i + 1] = [chunk[:LOAD], chunk[LOAD:]]
+            self.maxes[i:i + 1] = [chunk[LOAD - 1], chunk[-1]]
+
+    def remove(self, key):
+        """ Delete a key that is present. """
+        i = bisect_left(self.maxes, key)
+        chunk = self.chunks[i]
+        j = bisect_left(chunk, key)
+        del chunk[j]
+        self.size -= 1
+        if not chunk:
+            del self.chunks[i]
+            del self.maxes[i]
+        elif j == len(chunk):
+            self.maxes[i] = chunk[-1]
+
+    def last(self):
+        return self.chunks[-1][-1]
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            for key in chunk:
+                yield key
+
+    def __reversed__(self):
+        for chunk in reversed(self.chunks):
+            for key in reversed(chunk):
+                yield key
+
+
+class BookSide(object):
+    """ One side of the book.
+    Attributes:
+        sizes (dict): Size by price.
+        keys (SortedKeys): Sort keys, worst price first, best price last.
+            Bids use the price itself and asks its negation.
+    """
+
+    def __init__(self, bids):
+        self.sign = 1. if bids else -1.
+        self.sizes = {}
+        self.keys = SortedKeys()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.sizes = {}
+        self.keys = SortedKeys()
+
+    def load(self, levels):
+        """ Replace the side with (price, size) levels, sorting them once. """
+        self.sizes = dict((price, size) for price, size in levels if size > 0)
+        self.keys = SortedKeys(self.sign * price for price in self.sizes)
+
+    def set(self, price, size):
+        """ Set the size at a price level; size 0 removes the level. """
+        if size > 0:
+            if price not in self.sizes:
+                self.keys.add(self.sign * price)
+            self.sizes[price] = size
+        elif price in self.sizes:
+            del self.sizes[price]
+            self.keys.remove(self.sign * price)
+
+    def best(self):
+        """ (price, size) at the best level, or None if the side is empty. """
+        if not self.keys:
+            return None
+        price = self.sign * self.keys.last()
+        return price, self.sizes[price]
+
+    def levels(self):
+        """ Iterate (price, size) from the best level outwards. """
+        sizes = self.sizes
+        sign = self.sign
+        for key in reversed(self.keys):
+            price = sign * key
+            yield price, sizes[price]
+
+
+class OrderBook(object):
+    """ Level 2 book for one product.
+    Attributes:
+        product_id (str): Product
+        bids (BookSide): Buy orders.
+        asks (BookSide): Sell orders.
+        sequence (int): Sequence of the last snapshot, if known.
+    """
+
+    def __init__(self, product_id=None):
+        self.product_id = product_id
+        self.bids = BookSide(bids=True)
+        self.asks = BookSide(bids=False)
+        self.sequence = None
+
+    def load_snapshot(self, snapshot):
+        """ Replace the book with a snapshot.
+        Args:
+            snapshot (dict): A websocket `snapshot` message or a level 2
+                get_product_order_book() response.
+        """
+        for side, levels in ((self.bids, snapshot['bids']), (self.asks, snapshot['asks'])):
+            side.load((float(level[0]), float(level[1])) for level in levels)
+        if snapshot.get('sequence') is not None:
+            self.sequence = int(snapshot['sequence'])
+
+    def update(self, side, price, size):
+        """ Apply one level change; side is 'buy' for bids, 'sell' for asks. """
+        book = self.bids if side == 'buy' else self.asks
+        book.set(float(price), float(size))
+
+    def on_message(self, msg):
+        """ Apply a level2 channel message, e.g. from feed.WebsocketFeed. """
+        kind = msg.get('type')
+        if self.product_id is not None and msg.get('product_id') not in (None, self.product_id):
+            return
+        if kind == 'snapshot':
+            self.load_snapshot(msg)
+        elif kind == 'l2update':
+            for side, price, size in msg['changes']:
+                self.update(side, price, size)
+
+    @property
+    def best_bid(self):
+        return self.bids.best()
+
+    @property
+    def best_ask(self):
+        return self.asks.best()
+
+    @property
+    def spread(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    @property
+    def mid(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (ask[0] + bid[0]) / 2
+
+    def size_at(self, price, side):
+        """ Size resting at `price` on `side` ('buy' or 'sell'). """
+        book = self.bids if side == 'buy' else self.asks
+        return book.sizes.get(float(price), 0.)
+
+    def depth(self, side, price):
+        """ Size resting on `side` at `price` or better. """
+        book = self.bids if side == 'buy' else self.asks
+        total = 0.
+        for level, size in book.levels():
+            if (level < price) if side == 'buy' else (level > price):
+                break
+            total += size
+        return total
+
+    def vwap(self, side, size):
+        """ Average price a market order of `size` would pay now.
+        Args:
+            side (str): Order side; a 'buy' walks the asks, a 'sell' the bids.
+            size (float): Order size in the base currency.
+        Returns:
+            tuple: (average price, size filled). The size filled is less than
+                `size` if the book is too thin; the price is None if nothing
+                would fill.
+        """
+        book = self.asks if side == 'buy' else self.bids
+        remaining = size
+        cost = 0.
+        for price, available in book.levels():
+            take = min(available, remaining)
+            cost += take * price
+            remaining -= take
+            if remaining <= 0:
+                break
+        filled = size - max(remaining, 0.)
+        return (cost / filled if filled else None), filled
+
+    def impact(self, side, size):
+        """ Expected slippage of a market order versus the mid, as a fraction. """
+        price, filled = self.vwap(side, size)
+        mid = self.mid
+        if price is None or mid is None:
+            return None
+        return (price - mid) / mid if side == 'buy' else (mid - price) / mid
+
+
+def replay(path, product_id=None):
+    """ Build a book by replaying recorded level2 messages.
+    Args:
+        path (str): File with one feed message per line, starting with (or
+            containing) a snapshot.
+        product_id (Optional[str]): Only apply messages for this product.
+    Returns:
+        OrderBook
+    """
+    book = OrderBook(product_id)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                book.on_message(json.loads(line))
+    return book
@@ -0,0 +1,226 @@
+import asyncio
+import threading
+
+"""
+
+Local order state tracking.
+
+OrderTracker keeps a table of orders indexed by id and client_oid, updated
+from user channel messages (feed.WebsocketFeed with channels=['user'] and
+auth=client.auth) or, as a fallback, from batched get_fills() deltas. Each
+tracked order has an OrderHandle that can be waited on from threads
+(handle.wait(timeout)) or awaited from asyncio (await handle), so confirming
+a fill takes no get_order() polling.
+
+"""
+
+DONE = 'done'
+
+
+class OrderHandle(object):
+    """ Waitable view of one tracked order.
+    Attributes:
+        order (dict): Latest known state, as from get_order(), with
+            filled_size kept as a float.
+    """
+
+    def __init__(self, order):
+        self.order = order
+        self.event = threading.Event()
+        self.waiters = []
+        self.lock = threading.Lock()
+
+    @property
+    def id(self):
+        return self.order.get('id')
+
+    @property
+    def done(self):
+        return self.event.is_set()
+
+    def _finish(self):
+        with self.lock:
+            self.event.set()
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, self.order)
+
+    def wait(self, timeout=None):
+        """ Block until the order is done.
+        Returns:
+            dict: Final order state, or None on timeout.
+        """
+        if self.event.wait(timeout):
+            return self.order
+        return None
+
+    def __await__(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.event.is_set():
+                future.set_result(self.order)
+            else:
+                self.waiters.append((loop, future))
+        return future.__await__()
+
+
+def _resolve(future, order):
+    if not future.done():
+        future.set_result(order)
+
+
+class OrderTracker(object):
+    """ Table of open and finished orders.
+    Attributes:
+        orders (dict): OrderHandle by order id.
+        client_oids (dict): Order id by client_oid.
+        on_fill (callable): Optional; called with each new fill, e.g.
+            AccountCache.apply_fill.
+    """
+
+    def __init__(self, auth_client=None, on_fill=None):
+        self.auth_client = auth_client
+        self.on_fill = on_fill
+        self.orders = {}
+        self.client_oids = {}
+        self.seen_trades = set()
+        self.last_trade_id = {}
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """ OrderHandle by order id or client_oid, or None. """
+        with self.lock:
+            order_id = self.client_oids.get(key, key)
+            return self.orders.get(order_id)
+
+    def open_orders(self):
+        with self.lock:
+            return [h for h in self.orders.values() if not h.done]
+
+    def _handle(self, order_id, client_oid=None):
+        # Orders can be seen on the user channel before place_order() returns.
+        handle = self.orders.get(order_id)
+        if handle is None:
+            handle = OrderHandle({'id': order_id, 'filled_size': 0.})
+            self.orders[order_id] = handle
+        if client_oid:
+            self.client_oids[client_oid] = order_id
+            handle.order['client_oid'] = client_oid
+        return handle
+
+    def track(self, order, client_oid=None):
+        """ Start tracking an order from its place_order() response.
+        Args:
+            order (dict): Order details as returned by place_order().
+            client_oid (Optional[str]): The client_oid sent with the order.
+        Returns:
+            OrderHandle
+        """
+        with self.lock:
+            handle = self._handle(order['id'], client_oid or order.get('client_oid'))
+            # Anything the user channel already reported takes precedence.
+            for key, value in order.items():
+                if key not in handle.order:
+                    handle.order[key] = value
+            handle.order['filled_size'] = float(handle.order.get('filled_size') or 0)
+            finished = handle.order.get('status') == DONE
+        if finished:
+            handle._finish()
+        return handle
+
+    def on_message(self, msg):
+        """ Apply a user channel message. """
+        kind = msg.get('type')
+        finished = None
+        with self.lock:
+            if kind == 'received':
+                handle = self._handle(msg['order_id'], msg.get('client_oid'))
+                handle.order.setdefault('status', 'pending')
+                for key in ('side', 'product_id', 'size', 'funds'):
+                    if msg.get(key) is not None:
+                        handle.order.setdefault(key, msg[key])
+            elif kind == 'open':
+                handle = self.orders.get(msg['order_id'])
+                if handle is not None and handle.order.get('status') != DONE:
+                    handle.order['status'] = 'open'
+            elif kind == 'match':
+                for key in ('taker_order_id', 'maker_order_id'):
+                    handle = self.orders.get(msg.get(key))
+                    if handle is not None:
+                        self._fill(handle, {
+                            'trade_id': msg['trade_id'],
+                            'product_id': msg['product_id'],
+                            'order_id': handle.id,
+                            'price': msg['price'],
+                            'size': msg['size'],
+                            'side': handle.order.get('side') or msg['side'],
+                            'created_at': msg.get('time'),
+                        })
+            elif kind == 'done':
+                finished = self.orders.get(msg['order_id'])
+                if finished is not None:
+                    finished.order['status'] = DONE
+                    finished.order['done_reason'] = msg.get('reason')
+        if finished is not None:
+            finished._finish()
+
+    def _fill(self, handle, fill):
+        key = (fill.get('product_id'), int(fill['trade_id']), handle.id)
+        if key in self.seen_trades:
+            return False
+        self.seen_trades.add(key)
+        handle.order['filled_size'] += float(fill['size'])
+        handle.order.setdefault('fills', []).append(fill)
+        if self.on_fill is not None:
+            self.on_fill(fill)
+        return True
+
+    def seed(self, product_id):
+        """ Start the poll_fills() cursor of `product_id` at its newest fill,
+        read with one limit=1 request, so the first poll does not page
+        through every earlier fill. Call it before placing the first order
+        to be polled; does nothing once the cursor is set.
+        """
+        if product_id in self.last_trade_id:
+            return
+        fills = self.auth_client.get_fills(product_id=product_id, limit=1)
+        try:
+            newest = next(iter(fills), None)
+        finally:
+            # Stop the generator before it requests the next page.
+            if hasattr(fills, 'close'):
+                fills.close()
+        with self.lock:
+            self.last_trade_id.setdefault(product_id, int(newest['trade_id']) if newest else 0)
+
+    def poll_fills(self, product_id):
+        """ Fallback without the user channel: apply fills newer than the last
+        seen for `product_id` with one get_fills() request.
+        Orders are marked done once their filled size reaches their size.
+        Returns:
+            int: Number of new fills applied.
+        """
+        params = {}
+        last = self.last_trade_id.get(product_id)
+        if last is not None:
+            params['before'] = last
+        new = 0
+        finished = []
+        for fill in self.auth_client.get_fills(product_id=product_id, **params):
+            with self.lock:
+                self.last_trade_id[product_id] = max(int(fill['trade_id']),
+                                                     self.last_trade_id.get(product_id, 0))
+                handle = self.orders.get(fill['order_id'])
+                if handle is None or not self._fill(handle, fill):
+                    continue
+                new += 1
+                size = handle.order.get('size')
+                if size is not None and handle.order['filled_size'] >= float(size) - 1e-12 \
+                        and handle.order.get('status') != DONE:
+                    handle.order['status'] = DONE
+                    handle.order['done_reason'] = 'filled'
+                    finished.append(handle)
+        for handle in finished:
+            handle._finish()
+        return new
@@ -0,0 +1,219 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from scheduler import GRANULARITIES
+from store import CANDLE_DTYPE, CandleStore
+
+"""
+
+Multi-timeframe views derived from the finest stored bars.
+
+get_product_historic_rates() serves six granularities and each one is its own
+REST fetch. TimeframeCache instead reads the finest granularity kept in a
+CandleStore (normally minute bars) and resamples it into any multiple of it,
+including ones the API does not offer, e.g. 4h:
+
+    cache = TimeframeCache(store)
+    hourly = cache.get('BTC-USD', 3600, count=200)
+    daily = cache.get('BTC-USD', 86400)
+
+Bars are aligned to multiples of the granularity since the epoch, as the
+exchange aligns them (daily bars open at 00:00 UTC). Each resampled series is
+kept in memory and brought up to date from only the minute bars appended to
+the store since the last call, folding them into the coarse bar in progress;
+a call with nothing new is a file size check and a slice. History prepended
+to the store by backfill rebuilds the series. Series are evicted
+least recently used first once they exceed `max_bytes`.
+
+"""
+
+
+def resample(bars, granularity):
+    """ Aggregate bars into coarser bars.
+    Intervals without bars produce no bar, as with the candles endpoint.
+    Args:
+        bars (np.ndarray): Bars in CANDLE_DTYPE, ascending by time.
+        granularity (int): Bar size in seconds, a multiple of the size of
+            `bars`.
+    Returns:
+        np.ndarray: Bars in CANDLE_DTYPE, `time` being the bar open. The last
+            bar may cover only part of its interval.
+    """
+    if not len(bars):
+        return np.empty(0, dtype=CANDLE_DTYPE)
+    bucket = bars['time'] // granularity
+    starts = np.flatnonzero(np.concatenate([[True], bucket[1:] != bucket[:-1]]))
+    ends = np.append(starts[1:], len(bars)) - 1
+    out = np.empty(len(starts), dtype=CANDLE_DTYPE)
+    out['time'] = bucket[starts] * granularity
+    out['low'] = np.minimum.reduceat(bars['low'], starts)
+    out['high'] = np.maximum.reduceat(bars['high'], starts)
+    out['open'] = bars['open'][starts]
+    out['close'] = bars['close'][ends]
+    out['volume'] = np.add.reduceat(bars['volume'], starts)
+    return out
+
+
+class _Series(object):
+    """ Resampled bars of one product and granularity, the last possibly partial. """
+
+    __slots__ = ('buffer', 'size', 'consumed', 'first', 'end')
+
+    def __init__(self):
+        self.buffer = np.empty(0, dtype=CANDLE_DTYPE)
+        self.size = 0
+        # Finer bars of the store already folded in.
+        self.consumed = 0
+        # Open time of the oldest of them, to tell when history was prepended.
+        self.first = None
+        # Close time of the newest of them.
+        self.end = None
+
+    @property
+    def bars(self):
+        return self.buffer[:self.size]
+
+    def extend(self, bars):
+        """ Fold resampled `bars` in, merging a bar still in progress. """
+        if self.size and len(bars) and bars['time'][0] == self.buffer['time'][self.size - 1]:
+            last = self.buffer[self.size - 1]
+            first = bars[0]
+            last['low'] = min(last['low'], first['low'])
+            last['high'] = max(last['high'], first['high'])
+            last['close'] = first['close']
+            last['volume'] += first['volume']
+            bars = bars[1:]
+        size = self.size + len(bars)
+        if size > len(self.buffer):
+            # Grow geometrically so appending stays amortized O(new bars).
+            buffer = np.empty(max(size, 2 * len(self.buffer)), dtype=CANDLE_DTYPE)
+            buffer[:self.size] = self.buffer[:self.size]
+            self.buffer = buffer
+        self.buffer[self.size:size] = bars
+        self.size = size
+
+
+class TimeframeCache(object):
+    """ LRU cache of timeframes resampled from a CandleStore.
+    Attributes:
+        store (CandleStore): Source of the finest bars.
+        base (Optional[int]): Granularity to resample from. Defaults to the
+            finest one stored for each product.
+        max_bytes (int): Memory held by cached series before eviction.
+        hits (int): Lookups served from a cached series.
+        misses (int): Lookups that built a series from the whole store.
+    """
+
+    def __init__(self, store=None, base=None, max_bytes=256 * 2 ** 20):
+        self.store = store or CandleStore()
+        self.base = base
+        self.max_bytes = max_bytes
+        self.series = OrderedDict()
+        self.bases = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def base_granularity(self, product_id):
+        """ Finest granularity stored for `product_id`, or None. """
+        if self.base is not None:
+            return self.base
+        if product_id not in self.bases:
+            for granularity in GRANULARITIES:
+                if self.store.count(product_id, granularity):
+                    self.bases[product_id] = granularity
+                    break
+            else:
+                return None
+        return self.bases[product_id]
+
+    def update(self, client, product_id, **kwargs):
+        """ Fetch closed base bars missing from the store; see CandleStore.update(). """
+        base = self.base_granularity(product_id) or GRANULARITIES[0]
+        return self.store.update(client, product_id, base, **kwargs)
+
+    def get(self, product_id, granularity, count=None, now=None, partial=False):
+        """ Bars of `product_id` at `granularity`, resampled from the store.
+        Args:
+            product_id (str): Product
+            granularity (int): Bar size in seconds, a multiple of the base
+                granularity, e.g. 14400 for 4h.
+            count (Optional[int]): Only the most recent `count` bars.
+            now (Optional[float]): Current epoch time; bars ending after it
+                are still open. Defaults to the end of the newest base bar.
+            partial (Optional[bool]): Keep the last bar even if it is still
+                open. Its values change as base bars arrive.
+        Returns:
+            np.ndarray: Read-only bars in CANDLE_DTYPE, ascending by time.
+        """
+        base = self.base_granularity(product_id)
+        if base is None:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        if granularity % base:
+            raise ValueError('Granularity {} is not a multiple of the stored {}'.format(
+                granularity, base))
+        with self.lock:
+            if granularity == base:
+                bars = self.store.load(product_id, base, count)
+                end = bars['time'][-1] + base if len(bars) else None
+            else:
+                series = self._refresh(product_id, base, granularity)
+                bars, end = series.bars, series.end
+            if len(bars) and not partial:
+                if now is None:
+                    now = end
+                if bars['time'][-1] + granularity > now:
+                    bars = bars[:-1]
+            if count is not None:
+                bars = bars[max(len(bars) - count, 0):]
+            bars = bars.view()
+            bars.flags.writeable = False
+            return bars
+
+    def _refresh(self, product_id, base, granularity):
+        key = (product_id, base, granularity)
+        total = self.store.count(product_id, base)
+        series = self.series.get(key)
+        if series is not None and series.consumed <= total:
+            self.series.move_to_end(key)
+            self.hits += 1
+        else:
+            if series is not None:
+                self._drop(key)
+            self.misses += 1
+            series = self.series[key] = _Series()
+        if total > series.consumed and series.consumed:
+            # Bars were added; if backfill put them in front of the folded
+            # ones, the series no longer lines up with the file.
+            if self.store.first_time(product_id, base) != series.first:
+                self._drop(key)
+                series = self.series[key] = _Series()
+        if total > series.consumed:
+            before = series.buffer.nbytes
+            bars = self.store.load(product_id, base, total - series.consumed)
+            if not series.consumed:
+                series.first = int(bars['time'][0])
+            series.extend(resample(bars, granularity))
+            series.consumed = total
+            series.end = int(bars['time'][-1]) + base
+            self.nbytes += series.buffer.nbytes - before
+            self._evict(key)
+        return series
+
+    def _drop(self, key):
+        self.nbytes -= self.series.pop(key).buffer.nbytes
+
+    def _evict(self, keep):
+        for key in list(self.series):
+            if self.nbytes <= self.max_bytes:
+                break
+            if key != keep:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+            self.bases.clear()
+            self.nbytes = 0
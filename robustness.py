@@ -0,0 +1,290 @@
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from backtest import backtest
+from indicators import sma
+from store import CANDLE_DTYPE, CandleStore
+
+"""
+
+Walk-forward and Monte Carlo robustness tests for the crossover.
+
+walk_forward() picks the best (fast, slow) pair on each training window and
+scores it on the following, unseen test window. monte_carlo() backtests
+every pair on many resampled histories: either block-bootstrapped returns
+(new price paths that keep short-range structure) or random start offsets
+into the real history.
+
+SMA arrays are memoized per (dataset, window) in an IndicatorCache, so the
+thousands of folds and offsets that slice the same history compute each
+average once; a bootstrapped path is averaged once for all pairs tested on
+it. Work runs on a process pool; each worker receives the candles once, and
+every sample draws from its own child of one SeedSequence, so results are
+the same for any number of workers.
+
+"""
+
+
+class IndicatorCache(object):
+    """ LRU cache of SMA arrays keyed by (dataset key, window).
+    Attributes:
+        hits (int): Lookups served from the cache.
+        misses (int): Lookups that computed an average.
+    """
+
+    def __init__(self, max_bytes=512 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.arrays = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def sma(self, key, values, window):
+        """ SMA of `values` for `window`, computed once per (key, window). """
+        name = (key, int(window))
+        array = self.arrays.get(name)
+        if array is not None:
+            self.arrays.move_to_end(name)
+            self.hits += 1
+            return array
+        self.misses += 1
+        array = sma(values, window)
+        array.flags.writeable = False
+        self.arrays[name] = array
+        self.nbytes += array.nbytes
+        while self.nbytes > self.max_bytes and len(self.arrays) > 1:
+            _, old = self.arrays.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return array
+
+    def signal(self, key, values, fast, slow):
+        """ Crossover signal, True where SMA(fast) > SMA(slow). """
+        return self.sma(key, values, fast) > self.sma(key, values, slow)
+
+    def drop(self, key):
+        """ Forget every average of dataset `key`. """
+        for name in [x for x in self.arrays if x[0] == key]:
+            self.nbytes -= self.arrays.pop(name).nbytes
+
+    def clear(self):
+        self.arrays.clear()
+        self.nbytes = 0
+
+
+# Per worker process: the candles under test and the cache of their averages.
+_candles = None
+_cache = IndicatorCache()
+
+
+def _init(candles):
+    global _candles
+    _candles = candles
+    _cache.clear()
+
+
+def _score(candles, signal, fast, slow, size, granularity, kwargs):
+    result = backtest(candles, avg1=fast, avg2=slow, size=size,
+                      granularity=granularity, signal=signal, **kwargs)
+    return result.stats
+
+
+def _rank_key(rank):
+    # NaN stats rank last.
+    return lambda row: -row[rank] if np.isfinite(row[rank]) else np.inf
+
+
+def folds(n, train, test, step=None):
+    """ (train_start, test_start, test_end) bar indices for walk-forward.
+    Args:
+        n (int): Bars in the history.
+        train (int): Bars in each training window.
+        test (int): Bars in each test window.
+        step (Optional[int]): Bars between folds. Defaults to `test`, so
+            test windows tile the history without overlap.
+    """
+    step = step or test
+    return [(start, start + train, min(start + train + test, n))
+            for start in range(0, n - train - 1, step)]
+
+
+def _fold(task):
+    (train_start, test_start, test_end), pairs, size, granularity, rank, kwargs = task
+    close = _candles['close']
+    # Averages over the whole history, sliced, so each fold starts warmed up.
+    signals = dict(((f, s), _cache.signal('history', close, f, s)) for f, s in pairs)
+    train = _candles[train_start:test_start]
+    scores = []
+    for fast, slow in pairs:
+        row = {'avg1': fast, 'avg2': slow}
+        row.update(_score(train, signals[(fast, slow)][train_start:test_start],
+                          fast, slow, size, granularity, kwargs))
+        scores.append(row)
+    best = min(scores, key=_rank_key(rank))
+    test = _candles[test_start:test_end]
+    out = _score(test, signals[(best['avg1'], best['avg2'])][test_start:test_end],
+                 best['avg1'], best['avg2'], size, granularity, kwargs)
+    return {
+        'train_start': int(_candles['time'][train_start]),
+        'test_start': int(_candles['time'][test_start]),
+        'test_end': int(_candles['time'][test_end - 1]),
+        'avg1': best['avg1'], 'avg2': best['avg2'],
+        'train_' + rank: best[rank],
+        'test': out,
+    }
+
+
+def walk_forward(candles, fast=(50,), slow=(100,), train=24 * 365, test=24 * 90,
+                 step=None, size=0.001, granularity=3600, rank='sharpe',
+                 workers=None, **kwargs):
+    """ Walk-forward optimization of the crossover windows.
+    Args:
+        candles (np.ndarray): Bars in store.CANDLE_DTYPE, ascending.
+        fast (Optional[list]): Fast windows to choose from (History.avg1).
+        slow (Optional[list]): Slow windows to choose from (History.avg2).
+        train (Optional[int]): Bars to optimize on per fold.
+        test (Optional[int]): Bars to score the chosen pair on per fold.
+        step (Optional[int]): Bars between folds; defaults to `test`.
+        size (Optional[float]): Order size (Account.size).
+        granularity (Optional[int]): Bar size in seconds.
+        rank (Optional[str]): Stat to maximize on the training window.
+        workers (Optional[int]): Processes. Defaults to os.cpu_count().
+        **kwargs: Passed to backtest(), e.g. fee.
+    Returns:
+        list: One dict per fold, oldest first, with the pair chosen, its
+            training score and its out-of-sample `test` stats.
+    """
+    pairs = [(f, s) for f, s in itertools.product(fast, slow) if f < s]
+    tasks = [(fold, pairs, size, granularity, rank, kwargs)
+             for fold in folds(len(candles), train, test, step)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init,
+                             initargs=(candles,)) as executor:
+        return list(executor.map(_fold, tasks))
+
+
+def block_bootstrap(candles, rng, block=24 * 7):
+    """ Synthetic history from moving blocks of log returns.
+    The path starts at the first close and keeps the original bar times.
+    Args:
+        candles (np.ndarray): Bars in store.CANDLE_DTYPE.
+        rng (np.random.Generator): Random source.
+        block (Optional[int]): Bars per block; longer blocks keep more of
+            the trends the crossover trades on.
+    Returns:
+        np.ndarray: Bars in store.CANDLE_DTYPE.
+    """
+    close = np.asarray(candles['close'], dtype=np.float64)
+    returns = np.diff(np.log(close))
+    n = len(returns)
+    block = max(1, min(block, n))
+    starts = rng.integers(0, n - block + 1, size=-(-n // block))
+    index = (starts[:, None] + np.arange(block)).ravel()[:n]
+    path = close[0] * np.exp(np.concatenate([[0.], np.cumsum(returns[index])]))
+    synthetic = np.empty(len(close), dtype=CANDLE_DTYPE)
+    synthetic['time'] = candles['time']
+    synthetic['close'] = path
+    synthetic['open'] = np.concatenate([[path[0]], path[:-1]])
+    synthetic['high'] = np.maximum(synthetic['open'], path)
+    synthetic['low'] = np.minimum(synthetic['open'], path)
+    synthetic['volume'] = candles['volume']
+    return synthetic
+
+
+def _samples(task):
+    method, samples, pairs, length, block, size, granularity, kwargs = task
+    rows = []
+    for sample, seed in samples:
+        rng = np.random.default_rng(seed)
+        if method == 'bootstrap':
+            candles = block_bootstrap(_candles, rng, block)
+            key, start = ('bootstrap', sample), 0
+        else:
+            start = int(rng.integers(0, len(_candles) - length + 1))
+            candles = _candles
+            key = 'history'
+        end = start + length
+        window = candles[start:end]
+        close = candles['close']
+        for fast, slow in pairs:
+            signal = _cache.signal(key, close, fast, slow)[start:end]
+            row = {'sample': sample, 'start': int(candles['time'][start]),
+                   'avg1': fast, 'avg2': slow}
+            row.update(_score(window, signal, fast, slow, size, granularity, kwargs))
+            rows.append(row)
+        if method == 'bootstrap':
+            # A resampled path is never seen again; keep the room for history.
+            _cache.drop(key)
+    return rows
+
+
+def monte_carlo(candles, pairs=((50, 100),), samples=1000, method='bootstrap',
+                length=None, block=24 * 7, seed=0, size=0.001, granularity=3600,
+                workers=None, chunk=16, **kwargs):
+    """ Backtest crossover pairs on many resampled histories.
+    Args:
+        candles (np.ndarray): Bars in store.CANDLE_DTYPE, ascending.
+        pairs (Optional[list]): (fast, slow) windows to test.
+        samples (Optional[int]): Number of resampled histories.
+        method (Optional[str]): 'bootstrap' for block-resampled returns or
+            'offset' for random start offsets into `candles`.
+        length (Optional[int]): Bars per sample. Defaults to the whole
+            history for 'bootstrap' and half of it for 'offset'.
+        block (Optional[int]): Bars per bootstrap block.
+        seed (Optional[int]): Seed of the SeedSequence every sample's
+            generator is spawned from.
+        size (Optional[float]): Order size (Account.size).
+        granularity (Optional[int]): Bar size in seconds.
+        workers (Optional[int]): Processes. Defaults to os.cpu_count().
+        chunk (Optional[int]): Samples per task.
+        **kwargs: Passed to backtest(), e.g. fee.
+    Returns:
+        list: One dict per (sample, pair) with its stats, in sample order.
+    """
+    if method not in ('bootstrap', 'offset'):
+        raise ValueError('method must be bootstrap or offset')
+    if length is None:
+        length = len(candles) if method == 'bootstrap' else len(candles) // 2
+    length = min(length, len(candles))
+    pairs = [tuple(int(w) for w in pair) for pair in pairs]
+    seeds = list(enumerate(np.random.SeedSequence(seed).spawn(samples)))
+    tasks = [(method, seeds[i:i + chunk], pairs, length, block, size, granularity, kwargs)
+             for i in range(0, samples, chunk)]
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init,
+                             initargs=(candles,)) as executor:
+        for result in executor.map(_samples, tasks):
+            rows.extend(result)
+    return rows
+
+
+def summarize(rows, stat='sharpe', percentiles=(5, 25, 50, 75, 95)):
+    """ Distribution of `stat` per pair over monte_carlo() or walk_forward() rows.
+    Returns:
+        list: One dict per (avg1, avg2) with the mean, the share of samples
+            above zero and the requested percentiles.
+    """
+    groups = {}
+    for row in rows:
+        value = row['test'][stat] if 'test' in row else row[stat]
+        groups.setdefault((row['avg1'], row['avg2']), []).append(value)
+    summary = []
+    for (fast, slow), values in sorted(groups.items()):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        entry = {'avg1': fast, 'avg2': slow, 'samples': len(values),
+                 'mean': float(values.mean()) if len(values) else np.nan,
+                 'positive': float((values > 0).mean()) if len(values) else np.nan}
+        for p, value in zip(percentiles, np.percentile(values, percentiles) if len(values)
+                            else [np.nan] * len(percentiles)):
+            entry['p{}'.format(p)] = float(value)
+        summary.append(entry)
+    return summary
+
+
+if __name__ == '__main__':
+    candles = CandleStore().load('BTC-USD', 3600)
+    for fold in walk_forward(candles, fast=range(10, 100, 10), slow=range(50, 300, 25)):
+        print(fold['test_start'], fold['avg1'], fold['avg2'], round(fold['test']['sharpe'], 3))
+    for entry in summarize(monte_carlo(candles, pairs=[(50, 100)], samples=200)):
+        print(entry)
@@ -0,0 +1,167 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from btc_algo import History, api_key, secret, passphrase, start_logging
+from cbpro import PublicClient, AuthenticatedClient
+from accounts import AccountCache
+from engine import LiveBroker, split
+from scheduler import Scheduler
+from store import CandleStore
+from metrics import metrics
+
+"""
+
+Multi-product runner.
+
+Runs the History crossover on many products from one process. All products
+share one PublicClient for candles (and so the public rate limiter) and one
+engine.LiveBroker for orders, with its AccountCache, so a decision cycle
+costs one get_accounts() call however many products are traded. Each
+product's signal is its History.signal(), kept current bar by bar by
+indicators.Crossover.
+
+"""
+
+
+class MultiRunner(object):
+    """ One History per product, stepped together and traded through one
+    LiveBroker.
+    Attributes:
+        histories (dict): History by product_id.
+        sizes (dict): Order size by product_id.
+        broker (LiveBroker): Places every product's orders.
+    """
+
+    def __init__(self, product_ids, auth_client=None, granularity=3600,
+                 sizes=None, store=None, workers=4, size=0.001, executors=None, books=None):
+        """ Create a multi-product runner.
+        Args:
+            product_ids (list): Products to trade, e.g. 'ETH-USD'.
+            auth_client (Optional[AuthenticatedClient]): Shared order client.
+            granularity (Optional[int]): Bar size in seconds.
+            sizes (Optional[dict]): Order size by product_id. Products not
+                listed use `size`.
+            store (Optional[CandleStore]): Shared candle store.
+            workers (Optional[int]): Concurrent candle requests.
+            size (Optional[float]): Default order size.
+            executors (Optional[dict]): execution.Executor by product_id,
+                see LiveBroker.
+            books (Optional[dict]): orderbook.OrderBook by product_id, see
+                LiveBroker.
+        """
+        if auth_client is None:
+            auth_client = AuthenticatedClient(api_key, secret, passphrase)
+        if store is None:
+            store = CandleStore()
+        self.product_ids = list(product_ids)
+        self.granularity = granularity
+        self.client = metrics.instrument(PublicClient())
+        self.auth_client = metrics.instrument(auth_client)
+        self.account = AccountCache(auth_client)
+        self.broker = LiveBroker(self.auth_client, account=self.account,
+                                 executors=executors, books=books)
+        self.workers = workers
+        self.histories = {}
+        self.sizes = {}
+        for product_id in self.product_ids:
+            self.histories[product_id] = History(product_id, granularity, store, client=self.client)
+            self.sizes[product_id] = (sizes or {}).get(product_id, size)
+
+    @classmethod
+    def from_products(cls, quote='USD', exclude=(), **kwargs):
+        """ Runner for every online product quoted in `quote`.
+        Order sizes default to each product's base_min_size.
+        """
+        products = [x for x in PublicClient().get_products()
+                    if x['quote_currency'] == quote and x['id'] not in exclude
+                    and x.get('status', 'online') == 'online']
+        sizes = dict((x['id'], float(x['base_min_size'])) for x in products)
+        sizes.update(kwargs.pop('sizes', None) or {})
+        return cls([x['id'] for x in products], sizes=sizes, **kwargs)
+
+    def update(self):
+        """ Top up every product's candles, a few requests at a time.
+        Returns:
+            list: Products whose update succeeded, in product_ids order.
+        """
+        updated = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for product_id, error in zip(self.product_ids,
+                                         executor.map(self._update, self.product_ids)):
+                if error is not None:
+                    logging.warning('{} candle update failed: {}'.format(product_id, error))
+                else:
+                    updated.append(product_id)
+        return updated
+
+    def _update(self, product_id):
+        try:
+            self.histories[product_id].update()
+        except Exception as e:
+            return e
+
+    def signals(self, product_ids=None):
+        """ Crossover signal for every product, from the rolling means kept
+        by each History.
+        Args:
+            product_ids (Optional[list]): Only these products.
+        Returns:
+            dict: True/False by product_id.
+        """
+        if product_ids is None:
+            product_ids = self.product_ids
+        return dict((p, self.histories[p].signal()) for p in product_ids)
+
+    def step(self, boundary=None):
+        """ One decision cycle for every product whose candles could be
+        updated; the others sit the cycle out rather than trade on a stale
+        bar.
+        Returns:
+            dict: Order responses by product_id.
+        """
+        if boundary is not None:
+            metrics.observe('runner_cycle_lag_seconds', time.time() - boundary)
+        with metrics.span('runner_stage_seconds', stage='data'):
+            updated = self.update()
+        # Fills of the last cycle's orders, as the engine reports them at each bar.
+        for product_id in self.product_ids:
+            self.broker.on_bar(product_id, None)
+        with metrics.span('runner_stage_seconds', stage='signal'):
+            signals = self.signals(updated)
+
+        # Decide from one balance snapshot before placing anything; each
+        # order invalidates the cache, so reading it afterwards would refresh.
+        with metrics.span('runner_stage_seconds', stage='balance'):
+            self.account.refresh()
+            sides = {}
+            for product_id in updated:
+                base, quote = split(product_id)
+                if signals[product_id]:
+                    if self.broker.available(quote):
+                        sides[product_id] = 'buy'
+                else:
+                    if self.broker.available(base):
+                        sides[product_id] = 'sell'
+
+        # The broker logs each order, and each rejection instead of raising.
+        orders = {}
+        for product_id, side in sides.items():
+            place = self.broker.buy if side == 'buy' else self.broker.sell
+            order = place(product_id, self.sizes[product_id])
+            if order is not None:
+                orders[product_id] = order
+        return orders
+
+    def run(self):
+        start_logging()
+        # Sign with the server clock; re-synced daily to follow local drift.
+        self.auth_client.sync_time()
+        scheduler = Scheduler()
+        scheduler.every(self.granularity, self.step, delay=1., catch_up=False)
+        scheduler.every(86400, lambda boundary: self.auth_client.sync_time(), catch_up=False)
+        scheduler.run()
+
+
+if __name__ == '__main__':
+    MultiRunner.from_products().run()
@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+
+Bar-boundary scheduler.
+
+Fires callbacks at the close of every bar (UTC-aligned multiples of the
+granularity) for any number of jobs from one thread. Boundaries are computed
+from the wall clock but waited for on the monotonic clock, re-reading the wall
+clock at least once a minute so clock adjustments are picked up. The last
+couple of milliseconds before a boundary are spent polling rather than
+sleeping, for millisecond trigger latency.
+
+Boundaries missed while the process was stalled or suspended are fired in
+order when it wakes, unless the job was added with catch_up=False.
+
+"""
+
+GRANULARITIES = [60, 300, 900, 3600, 21600, 86400]
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """ A callback fired on every boundary of one granularity.
+    Attributes:
+        granularity (int): Bar size in seconds.
+        callback (callable): Called as callback(boundary), boundary being the
+            epoch time at which the bar closed.
+        delay (float): Seconds after the boundary to fire.
+        catch_up (bool): Fire once per missed boundary rather than once.
+        next (int): Next boundary to fire.
+    """
+
+    def __init__(self, granularity, callback, delay=0., catch_up=True, now=None):
+        if granularity not in GRANULARITIES:
+            raise ValueError('Specified granularity is {}, must be in approved values: {}'.format(
+                granularity, GRANULARITIES))
+        if now is None:
+            now = time.time()
+        self.granularity = granularity
+        self.callback = callback
+        self.delay = delay
+        self.catch_up = catch_up
+        self.next = (int(now - delay) // granularity + 1) * granularity
+
+    def due(self):
+        """ Wall time at which the job next fires. """
+        return self.next + self.delay
+
+
+class Scheduler(object):
+    """ Runs jobs on bar boundaries.
+    Attributes:
+        jobs (list): Heap of (due, order, Job).
+    """
+
+    def __init__(self, workers=None, spin=0.002, clock=time.time):
+        """ Create a scheduler.
+        Args:
+            workers (Optional[int]): Run callbacks on a thread pool of this
+                size so a slow job cannot delay others. By default callbacks
+                run inline, in due order.
+            spin (Optional[float]): Seconds before a boundary to stop sleeping
+                and poll instead.
+            clock (Optional[callable]): Wall clock, epoch seconds.
+        """
+        self.jobs = []
+        self.order = itertools.count()
+        self.spin = spin
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.stopped = False
+
+    def every(self, granularity, callback, delay=0., catch_up=True):
+        """ Fire `callback` at the close of every `granularity` bar.
+        Args:
+            granularity (int): Bar size in seconds, one of GRANULARITIES.
+            callback (callable): Called as callback(boundary).
+            delay (Optional[float]): Seconds after the boundary to fire, e.g.
+                to let the exchange publish the closed candle.
+            catch_up (Optional[bool]): Fire once for every missed boundary.
+        Returns:
+            Job
+        """
+        job = Job(granularity, callback, delay, catch_up, now=self.clock())
+        heapq.heappush(self.jobs, (job.due(), next(self.order), job))
+        return job
+
+    def stop(self):
+        self.stopped = True
+
+    def wait(self, target):
+        """ Block until wall time `target`, sleeping on the monotonic clock. """
+        while not self.stopped:
+            remaining = target - self.clock()
+            if remaining <= 0:
+                return
+            if remaining > self.spin:
+                # Wake at least once a minute to pick up wall clock changes.
+                time.sleep(min(remaining - self.spin, 60.))
+            else:
+                deadline = time.monotonic() + remaining
+                while time.monotonic() < deadline:
+                    pass
+                return
+
+    def run_pending(self):
+        """ Fire every job that is due now.
+        Returns:
+            int: Number of callbacks fired.
+        """
+        now = self.clock()
+        fired = 0
+        while self.jobs and self.jobs[0][0] <= now:
+            _, _, job = heapq.heappop(self.jobs)
+            boundaries = range(job.next, int(now - job.delay) + 1, job.granularity)
+            if len(boundaries) > 1:
+                logger.warning('{} missed bar boundaries at granularity {}'.format(
+                    len(boundaries) - 1, job.granularity))
+                if not job.catch_up:
+                    boundaries = boundaries[-1:]
+            for boundary in boundaries:
+                self._fire(job, boundary)
+                fired += 1
+            job.next = boundaries[-1] + job.granularity
+            heapq.heappush(self.jobs, (job.due(), next(self.order), job))
+        return fired
+
+    def _fire(self, job, boundary):
+        if self.executor is not None:
+            self.executor.submit(self._call, job, boundary)
+        else:
+            self._call(job, boundary)
+
+    def _call(self, job, boundary):
+        try:
+            job.callback(boundary)
+        except Exception:
+            logger.exception('scheduled job failed at {}'.format(boundary))
+
+    def run(self):
+        """ Fire jobs on their boundaries until stop() is called. """
+        while self.jobs and not self.stopped:
+            self.wait(self.jobs[0][0])
+            if not self.stopped:
+                self.run_pending()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
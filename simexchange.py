@@ -0,0 +1,719 @@
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from feed import parse_time
+from orderbook import OrderBook
+
+"""
+
+Local simulated exchange.
+
+SimExchange serves the REST paths cbpro.py calls, on a local HTTP server, from
+a simulated clock:
+
+- public: /time, /products, /products/{id}/candles, /products/{id}/book,
+  /products/{id}/ticker
+- private: /accounts, /accounts/{id}, /orders (place, list, cancel),
+  /orders/{id}, /fills. These check CB-ACCESS-KEY, CB-ACCESS-PASSPHRASE and
+  CB-ACCESS-SIGN as the exchange does, and reject timestamps more than
+  `max_skew` seconds from both the wall clock and the simulated clock.
+
+Orders match against a level 2 book replayed from recorded level2 messages
+(see orderbook.OrderBook) or, without messages, a synthetic book of one level
+each side of the last closed candle. Market and IOC/FOK orders take
+liquidity at once; GTC limit orders rest and fill as the replayed book
+crosses them.
+
+Simulated time only moves with advance()/advance_to(), or run_clock() at a
+multiple of real time:
+
+    with SimExchange(candles, balances={'USD': 10000.}) as exchange:
+        client = cbpro.AuthenticatedClient(exchange.key, exchange.secret,
+                                           exchange.passphrase, api_url=exchange.url)
+        exchange.advance(3600)
+
+For soak tests, connect() serves a client's requests in process through a
+requests transport adapter, skipping sockets and server threads; soak() runs
+the engine as btc_algo.run() does (CrossoverStrategy, RestSource, LiveBroker)
+this way, one simulated bar per cycle (`python simexchange.py`).
+
+"""
+
+PRIVATE = ('/accounts', '/orders', '/fills')
+LOCAL_URL = 'http://simexchange.local'
+
+
+class SimError(Exception):
+    """ Error returned to the client as {'message': ...} with `status`. """
+
+    def __init__(self, status, message):
+        super(SimError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+def iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def number(value):
+    """ Decimal string as the API formats amounts. """
+    return '{:.8f}'.format(value).rstrip('0').rstrip('.') or '0'
+
+
+class SimExchange(object):
+    """ Simulated exchange for one product.
+    Attributes:
+        now (float): Simulated epoch time.
+        book (OrderBook): Current book.
+        accounts (dict): Account dicts by currency, amounts as floats.
+        orders (dict): Order dicts by id, amounts as floats.
+        fills (list): Every fill, oldest first.
+    """
+
+    def __init__(self, candles=None, product_id='BTC-USD', granularity=60,
+                 messages=None, balances=None, fee=0.005, start=None,
+                 key='key', secret=None, passphrase='passphrase',
+                 spread=0.0002, depth=1000., max_skew=30., page=100):
+        """ Create a simulated exchange.
+        Args:
+            candles (Optional[np.ndarray]): Bars in store.CANDLE_DTYPE served
+                by /candles and, without messages, used to price the book.
+            product_id (Optional[str]): Product traded.
+            granularity (Optional[int]): Bar size of `candles` in seconds.
+            messages (Optional[list]): level2 `snapshot` and `l2update`
+                messages with `time`, replayed into the book as time moves.
+            balances (Optional[dict]): Starting balance by currency.
+            fee (Optional[float]): Fee as a fraction of notional.
+            start (Optional[float]): Initial simulated time. Defaults to the
+                close of the first candle or the first message time.
+            key, secret, passphrase (Optional[str]): API credentials to accept;
+                a random secret is generated if none is given.
+            spread (Optional[float]): Synthetic book spread, as a fraction.
+            depth (Optional[float]): Synthetic book size per side.
+            max_skew (Optional[float]): Seconds a request timestamp may differ
+                from the wall clock or the simulated clock.
+            page (Optional[int]): Largest page for paginated endpoints.
+        """
+        self.product_id = product_id
+        self.base, self.quote = product_id.split('-')
+        self.granularity = granularity
+        self.candles = candles
+        self.messages = [dict(m, epoch=parse_time(m['time'])) for m in messages or []]
+        self.message_index = 0
+        self.fee = fee
+        self.key = key
+        self.secret = secret or base64.b64encode(uuid.uuid4().bytes * 4).decode()
+        self.hmac_key = base64.b64decode(self.secret)
+        self.passphrase = passphrase
+        self.spread = spread
+        self.depth = depth
+        self.max_skew = max_skew
+        self.page = page
+        self.book = OrderBook(product_id)
+        self.synthetic_price = None
+        self.accounts = {}
+        for currency in (self.base, self.quote):
+            self.accounts[currency] = {'id': str(uuid.uuid4()), 'currency': currency,
+                                       'balance': 0., 'hold': 0.}
+        for currency, amount in (balances or {}).items():
+            self.accounts.setdefault(currency, {'id': str(uuid.uuid4()), 'currency': currency,
+                                                'balance': 0., 'hold': 0.})
+            self.accounts[currency]['balance'] = float(amount)
+        self.orders = {}
+        self.sequence = itertools.count(1)
+        self.resting = []
+        self.fills = []
+        self.lock = threading.RLock()
+        self.server = None
+        self.clock_thread = None
+        self.routes = [
+            ('GET', re.compile(r'^/time$'), self.get_time),
+            ('GET', re.compile(r'^/products$'), self.get_products),
+            ('GET', re.compile(r'^/products/([^/]+)/candles$'), self.get_candles),
+            ('GET', re.compile(r'^/products/([^/]+)/book$'), self.get_book),
+            ('GET', re.compile(r'^/products/([^/]+)/ticker$'), self.get_ticker),
+            ('GET', re.compile(r'^/accounts/?$'), self.get_accounts),
+            ('GET', re.compile(r'^/accounts/([^/]+)$'), self.get_account),
+            ('POST', re.compile(r'^/orders$'), self.place_order),
+            ('GET', re.compile(r'^/orders$'), self.get_orders),
+            ('DELETE', re.compile(r'^/orders$'), self.cancel_all),
+            ('GET', re.compile(r'^/orders/([^/]+)$'), self.get_order),
+            ('DELETE', re.compile(r'^/orders/([^/]+)$'), self.cancel_order),
+            ('GET', re.compile(r'^/fills$'), self.get_fills),
+        ]
+        if start is None:
+            if candles is not None and len(candles):
+                start = int(candles['time'][0]) + granularity
+            elif self.messages:
+                start = self.messages[0]['epoch']
+            else:
+                start = time.time()
+        self.now = float(start)
+        self.advance_to(self.now)
+
+    # Simulated time
+
+    def clock(self):
+        """ Simulated epoch time; usable as a clock for Scheduler or History. """
+        return self.now
+
+    def advance(self, seconds):
+        return self.advance_to(self.now + seconds)
+
+    def advance_to(self, when):
+        """ Move simulated time forward to `when`, replaying the book and
+        filling resting orders it crosses.
+        """
+        with self.lock:
+            self.now = max(self.now, float(when))
+            messages = self.messages
+            while self.message_index < len(messages) and \
+                    messages[self.message_index]['epoch'] <= self.now:
+                self.book.on_message(messages[self.message_index])
+                self.message_index += 1
+            if not messages:
+                self._synthetic_book()
+            if self.resting:
+                self._match_resting()
+        return self.now
+
+    def run_clock(self, speed=60., tick=0.01):
+        """ Advance simulated time at `speed` times real time on a background
+        thread until stop().
+        """
+        def run():
+            last = time.monotonic()
+            while self.clock_thread is not None:
+                time.sleep(tick)
+                now = time.monotonic()
+                self.advance((now - last) * speed)
+                last = now
+        self.clock_thread = threading.Thread(target=run, daemon=True)
+        self.clock_thread.start()
+
+    def _closed(self):
+        # Candles whose bar has closed by now.
+        if self.candles is None or not len(self.candles):
+            return 0
+        return int(np.searchsorted(self.candles['time'], self.now - self.granularity, 'right'))
+
+    def _synthetic_book(self):
+        closed = self._closed()
+        if not closed:
+            return
+        price = float(self.candles['close'][closed - 1])
+        if price == self.synthetic_price:
+            return
+        self.synthetic_price = price
+        half = self.spread / 2
+        self.book.load_snapshot({
+            'bids': [[round(price * (1 - half), 8), self.depth]],
+            'asks': [[round(price * (1 + half), 8), self.depth]],
+        })
+
+    # HTTP
+
+    def start(self, host='127.0.0.1', port=0):
+        """ Serve on a background thread; the base URL is `url`. """
+        exchange = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload, headers = exchange.handle(self.command, self.path, body,
+                                                           self.headers)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_DELETE = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def stop(self):
+        self.clock_thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def connect(self, client):
+        """ Point a cbpro client at this exchange without a socket: its
+        requests are served in process, through the same signing, routing and
+        JSON encoding as over HTTP.
+        """
+        client.url = LOCAL_URL
+        client.session.mount(LOCAL_URL, SimAdapter(self))
+        return client
+
+    def handle(self, method, path_url, body, headers):
+        """ Serve one request.
+        Returns:
+            tuple: (status, JSON payload, extra headers)
+        """
+        parts = urlsplit(path_url)
+        query = dict((k, v if len(v) > 1 else v[0]) for k, v in parse_qs(parts.query).items())
+        try:
+            if parts.path.startswith(PRIVATE):
+                self.authenticate(method, path_url, body, headers)
+            for route_method, pattern, func in self.routes:
+                match = pattern.match(parts.path)
+                if match and route_method == method:
+                    data = json.loads(body) if body else {}
+                    with self.lock:
+                        result = func(query, data, *match.groups())
+                    if isinstance(result, tuple):
+                        return 200, result[0], result[1]
+                    return 200, result, {}
+            raise SimError(404, 'NotFound')
+        except SimError as e:
+            return e.status, {'message': e.message}, {}
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'message': 'Invalid request: {}'.format(e)}, {}
+
+    def authenticate(self, method, path_url, body, headers):
+        """ Check a private request's credentials and signature. """
+        if headers.get('CB-ACCESS-KEY') != self.key:
+            raise SimError(401, 'Invalid API Key')
+        if headers.get('CB-ACCESS-PASSPHRASE') != self.passphrase:
+            raise SimError(401, 'Invalid Passphrase')
+        timestamp = headers.get('CB-ACCESS-TIMESTAMP') or ''
+        try:
+            timestamp_value = float(timestamp)
+        except ValueError:
+            raise SimError(400, 'invalid timestamp')
+        # Clients synced with /time (sync_time()) sign with simulated time.
+        skew = min(abs(timestamp_value - time.time()), abs(timestamp_value - self.now))
+        if skew > self.max_skew:
+            raise SimError(400, 'request timestamp expired')
+        message = (timestamp + method + path_url).encode('ascii') + body
+        expected = base64.b64encode(hmac.new(self.hmac_key, message, hashlib.sha256).digest())
+        if not hmac.compare_digest(expected, (headers.get('CB-ACCESS-SIGN') or '').encode()):
+            raise SimError(401, 'invalid signature')
+
+    def _product(self, product_id):
+        if product_id != self.product_id:
+            raise SimError(404, 'NotFound')
+
+    # Public endpoints
+
+    def get_time(self, query, data):
+        return {'iso': iso(self.now), 'epoch': self.now}
+
+    def get_products(self, query, data):
+        return [{'id': self.product_id, 'base_currency': self.base,
+                 'quote_currency': self.quote, 'base_min_size': '0.001',
+                 'base_max_size': '10000', 'quote_increment': '0.01',
+                 'display_name': '{}/{}'.format(self.base, self.quote), 'status': 'online'}]
+
+    def get_candles(self, query, data, product_id):
+        self._product(product_id)
+        granularity = int(query.get('granularity', self.granularity))
+        if granularity != self.granularity:
+            raise SimError(400, 'Unsupported granularity')
+        closed = self._closed()
+        # The bar in progress is served too, as the exchange does.
+        visible = self.candles[:min(closed + 1, len(self.candles))] \
+            if self.candles is not None else []
+        if not len(visible):
+            return []
+        end = parse_time(query['end']) if 'end' in query else self.now
+        start = parse_time(query['start']) if 'start' in query else end - 300 * granularity
+        if (end - start) / granularity > 300:
+            raise SimError(400, 'granularity too small for the requested time range')
+        times = visible['time']
+        window = visible[np.searchsorted(times, start):np.searchsorted(times, end, 'right')]
+        rows = np.stack([window[name].astype(np.float64) for name in
+                         ('time', 'low', 'high', 'open', 'close', 'volume')], axis=1)[::-1]
+        return [[int(row[0])] + row[1:].tolist() for row in rows]
+
+    def get_book(self, query, data, product_id):
+        self._product(product_id)
+        level = int(query.get('level', 1))
+        bids = list(self.book.bids.levels())
+        asks = list(self.book.asks.levels())
+        if level == 1:
+            bids, asks = bids[:1], asks[:1]
+        elif level == 2:
+            bids, asks = bids[:50], asks[:50]
+        return {'sequence': self.message_index,
+                'bids': [[number(p), number(s), 1] for p, s in bids],
+                'asks': [[number(p), number(s), 1] for p, s in asks]}
+
+    def get_ticker(self, query, data, product_id):
+        self._product(product_id)
+        bid, ask = self.book.best_bid, self.book.best_ask
+        last = float(self.fills[-1]['price']) if self.fills else self.book.mid
+        return {'trade_id': len(self.fills), 'price': number(last or 0),
+                'bid': number(bid[0]) if bid else None, 'ask': number(ask[0]) if ask else None,
+                'volume': '0', 'time': iso(self.now)}
+
+    # Accounts
+
+    def _account(self, account):
+        available = account['balance'] - account['hold']
+        return {'id': account['id'], 'currency': account['currency'],
+                'balance': number(account['balance']), 'hold': number(account['hold']),
+                'available': number(available), 'profile_id': 'sim', 'trading_enabled': True}
+
+    def get_accounts(self, query, data):
+        return [self._account(x) for x in self.accounts.values()]
+
+    def get_account(self, query, data, account_id):
+        for account in self.accounts.values():
+            if account['id'] == account_id:
+                return self._account(account)
+        raise SimError(404, 'NotFound')
+
+    def available(self, currency):
+        account = self.accounts[currency]
+        return account['balance'] - account['hold']
+
+    # Orders
+
+    def _order(self, order):
+        public = dict((k, v) for k, v in order.items() if not k.startswith('_'))
+        for key in ('price', 'size', 'funds', 'filled_size', 'executed_value', 'fill_fees'):
+            if public.get(key) is not None:
+                public[key] = number(public[key])
+        return public
+
+    def place_order(self, query, data):
+        self._product(data.get('product_id'))
+        side = data['side']
+        kind = data.get('type', 'limit')
+        if side not in ('buy', 'sell') or kind not in ('market', 'limit'):
+            raise SimError(400, 'Invalid order')
+        size = float(data['size']) if data.get('size') is not None else None
+        funds = float(data['funds']) if data.get('funds') is not None else None
+        price = float(data['price']) if kind == 'limit' else None
+        tif = data.get('time_in_force', 'GTC') if kind == 'limit' else None
+        post_only = bool(data.get('post_only')) if kind == 'limit' else False
+        if kind == 'limit' and (size is None or price is None):
+            raise SimError(400, 'size and price are required')
+        if kind == 'market' and (size is None) == (funds is None):
+            raise SimError(400, 'one of size or funds is required')
+        if (size is not None and size <= 0) or (funds is not None and funds <= 0):
+            raise SimError(400, 'size is too small')
+
+        # Hold what the order can spend, as the exchange does.
+        if side == 'sell':
+            currency, hold = self.base, size
+        elif funds is not None:
+            currency, hold = self.quote, funds
+        elif price is not None:
+            currency, hold = self.quote, price * size * (1 + self.fee)
+        else:
+            estimate, filled = self.book.vwap('buy', size)
+            if not filled:
+                raise SimError(400, 'Insufficient liquidity')
+            currency, hold = self.quote, estimate * size * (1 + self.fee)
+        if self.available(currency) < hold - 1e-9:
+            raise SimError(400, 'Insufficient funds')
+        self.accounts[currency]['hold'] += hold
+
+        order = {
+            'id': str(uuid.uuid4()), 'product_id': self.product_id, 'side': side,
+            'type': kind, 'price': price, 'size': size, 'funds': funds,
+            'time_in_force': tif, 'post_only': post_only, 'stp': data.get('stp', 'dc'),
+            'created_at': iso(self.now), 'fill_fees': 0., 'filled_size': 0.,
+            'executed_value': 0., 'status': 'pending', 'settled': False,
+            '_hold': hold, '_currency': currency, '_sequence': next(self.sequence),
+        }
+        if data.get('client_oid'):
+            order['client_oid'] = data['client_oid']
+        self.orders[order['id']] = order
+
+        if post_only and self._crosses(order):
+            order['status'] = 'rejected'
+            order['reject_reason'] = 'post only'
+            self._done(order, 'rejected')
+        elif kind == 'limit' and tif == 'FOK' and self._fillable(order) < size - 1e-12:
+            self._done(order, 'canceled')
+        else:
+            self._take(order)
+            if order['status'] != 'done':
+                if kind == 'market' or tif in ('IOC', 'FOK'):
+                    self._done(order, 'canceled' if order['filled_size'] < (size or 0) else 'filled')
+                else:
+                    order['status'] = 'open'
+                    self.resting.append(order)
+        return self._order(order)
+
+    def _crosses(self, order):
+        best = self.book.best_ask if order['side'] == 'buy' else self.book.best_bid
+        if best is None:
+            return False
+        return best[0] <= order['price'] if order['side'] == 'buy' else best[0] >= order['price']
+
+    def _fillable(self, order):
+        book = self.book.asks if order['side'] == 'buy' else self.book.bids
+        total = 0.
+        for price, size in book.levels():
+            if (price > order['price']) if order['side'] == 'buy' else (price < order['price']):
+                break
+            total += size
+        return total
+
+    def _take(self, order, liquidity='T'):
+        """ Match `order` against the opposite side of the book, consuming the
+        levels it takes until the replayed book overwrites them.
+        """
+        side = self.book.asks if order['side'] == 'buy' else self.book.bids
+        limit = order['price']
+        for price, available in list(side.levels()):
+            if limit is not None and ((price > limit) if order['side'] == 'buy' else (price < limit)):
+                break
+            if order['size'] is not None:
+                take = min(available, order['size'] - order['filled_size'])
+            else:
+                remaining = order['funds'] - order['executed_value'] - order['fill_fees']
+                take = min(available, remaining / (price * (1 + self.fee)))
+            take = round(take, 8)
+            if take <= 0:
+                break
+            self._fill(order, limit if liquidity == 'M' else price, take, liquidity)
+            side.set(price, available - take)
+            if order['status'] == 'done':
+                return
+
+    def _fill(self, order, price, size, liquidity):
+        value = price * size
+        fee = value * self.fee
+        base, quote = self.accounts[self.base], self.accounts[self.quote]
+        if order['side'] == 'buy':
+            base['balance'] += size
+            quote['balance'] -= value + fee
+            released = min(order['_hold'], value + fee)
+        else:
+            base['balance'] -= size
+            quote['balance'] += value - fee
+            released = min(order['_hold'], size)
+        order['_hold'] -= released
+        self.accounts[order['_currency']]['hold'] -= released
+        order['filled_size'] += size
+        order['executed_value'] += value
+        order['fill_fees'] += fee
+        self.fills.append({
+            'created_at': iso(self.now), 'trade_id': len(self.fills) + 1,
+            'product_id': self.product_id, 'order_id': order['id'], 'user_id': 'sim',
+            'profile_id': 'sim', 'liquidity': liquidity, 'price': number(price),
+            'size': number(size), 'fee': number(fee), 'side': order['side'],
+            'settled': True, 'usd_volume': number(value),
+        })
+        if order['size'] is not None and order['filled_size'] >= order['size'] - 1e-12:
+            self._done(order, 'filled')
+        elif order['funds'] is not None and \
+                order['executed_value'] + order['fill_fees'] >= order['funds'] - 0.01:
+            self._done(order, 'filled')
+
+    def _done(self, order, reason):
+        self.accounts[order['_currency']]['hold'] -= order['_hold']
+        order['_hold'] = 0.
+        if order['status'] != 'rejected':
+            order['status'] = 'done'
+        order['done_reason'] = reason
+        order['done_at'] = iso(self.now)
+        order['settled'] = True
+
+    def _match_resting(self):
+        for order in list(self.resting):
+            if self._crosses(order):
+                self._take(order, liquidity='M')
+        self.resting = [x for x in self.resting if x['status'] != 'done']
+
+    def _paginate(self, items, key, query):
+        # Newest first, with cb-before/cb-after cursors as the exchange sends.
+        limit = min(int(query.get('limit', self.page)), self.page)
+        if query.get('before') is not None:
+            items = [x for x in items if key(x) > int(query['before'])]
+            page = items[:limit]
+            page.reverse()
+        else:
+            items.reverse()
+            if query.get('after') is not None:
+                items = [x for x in items if key(x) < int(query['after'])]
+            page = items[:limit]
+        headers = {}
+        if page:
+            headers['cb-before'] = str(key(page[0]))
+            if len(items) > limit:
+                headers['cb-after'] = str(key(page[-1]))
+        return page, headers
+
+    def get_orders(self, query, data):
+        statuses = query.get('status', ['open', 'pending', 'active'])
+        if isinstance(statuses, str):
+            statuses = [statuses]
+        orders = [x for x in self.orders.values()
+                  if 'all' in statuses or x['status'] in statuses]
+        page, headers = self._paginate(orders, lambda x: x['_sequence'], query)
+        return [self._order(x) for x in page], headers
+
+    def get_order(self, query, data, order_id):
+        if order_id.startswith('client:'):
+            matches = [x for x in self.orders.values() if x.get('client_oid') == order_id[7:]]
+            order = matches[0] if matches else None
+        else:
+            order = self.orders.get(order_id)
+        if order is None:
+            raise SimError(404, 'NotFound')
+        return self._order(order)
+
+    def cancel_order(self, query, data, order_id):
+        order = self.orders.get(order_id)
+        if order is None or order['status'] != 'open':
+            raise SimError(404, 'order not found')
+        self._done(order, 'canceled')
+        self.resting.remove(order)
+        return [order_id]
+
+    def cancel_all(self, query, data):
+        canceled = [x['id'] for x in self.resting]
+        for order in self.resting:
+            self._done(order, 'canceled')
+        self.resting = []
+        return canceled
+
+    def get_fills(self, query, data):
+        if 'order_id' not in query and 'product_id' not in query:
+            raise SimError(400, 'Either order_id or product_id is required')
+        fills = [x for x in self.fills
+                 if query.get('order_id') in (None, x['order_id'])
+                 and query.get('product_id') in (None, x['product_id'])]
+        return self._paginate(fills, lambda x: x['trade_id'], query)
+
+
+class SimAdapter(BaseAdapter):
+    """ requests transport adapter that sends requests to a SimExchange. """
+
+    def __init__(self, exchange):
+        super(SimAdapter, self).__init__()
+        self.exchange = exchange
+
+    def send(self, request, **kwargs):
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        status, payload, headers = self.exchange.handle(request.method, request.path_url,
+                                                        body, request.headers)
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(payload).encode()
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def soak(cycles=1000, bars=None, granularity=3600, http=False):
+    """ Run the live engine of btc_algo.run() against a SimExchange, one
+    simulated bar per cycle, and report cycles per second.
+    Args:
+        cycles (Optional[int]): Decision cycles to run.
+        bars (Optional[np.ndarray]): Candles to replay; random by default.
+        granularity (Optional[int]): Bar size in seconds.
+        http (Optional[bool]): Serve over a local socket instead of in process.
+    """
+    import shutil
+    import tempfile
+    import cbpro
+    from engine import CrossoverStrategy, RestSource, LiveBroker, Engine
+    from store import CandleStore, CANDLE_DTYPE
+
+    if bars is None:
+        rng = np.random.default_rng(0)
+        bars = np.empty(cycles + 300, dtype=CANDLE_DTYPE)
+        bars['time'] = (1500000000 // granularity + np.arange(len(bars))) * granularity
+        close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.01, len(bars))))
+        bars['open'] = np.concatenate([[close[0]], close[:-1]])
+        bars['close'] = close
+        bars['high'] = np.maximum(bars['open'], close)
+        bars['low'] = np.minimum(bars['open'], close)
+        bars['volume'] = 1.
+    root = tempfile.mkdtemp()
+    unlimited = cbpro.RateLimiter(1e9, 1e9)
+    exchange = SimExchange(bars, granularity=granularity, balances={'USD': 1000.},
+                           start=int(bars['time'][200]) + 1)
+    try:
+        if http:
+            exchange.start()
+        client = cbpro.PublicClient(exchange.url if http else LOCAL_URL)
+        auth_client = cbpro.AuthenticatedClient(exchange.key, exchange.secret, exchange.passphrase,
+                                                api_url=exchange.url if http else LOCAL_URL)
+        for c in (client, auth_client):
+            c.limiter = unlimited
+            # Skip requests' per-call proxy lookups in the environment.
+            c.session.trust_env = False
+            if not http:
+                exchange.connect(c)
+        source = RestSource('BTC-USD', granularity, client=client, store=CandleStore(root),
+                            clock=exchange.clock)
+        engine = Engine(CrossoverStrategy('BTC-USD'), source, LiveBroker(auth_client))
+        start = time.perf_counter()
+        engine.start()
+        for _ in range(cycles):
+            exchange.advance(granularity)
+            source.poll()
+            for product_id, bar in source.drain():
+                engine.on_bar(product_id, bar)
+        elapsed = time.perf_counter() - start
+    finally:
+        exchange.stop()
+        shutil.rmtree(root)
+    print('{} cycles in {:.2f}s, {:.0f} cycles/s, {} fills, {} {:.2f} / {} {:.8f}'.format(
+        cycles, elapsed, cycles / elapsed, len(exchange.fills),
+        exchange.quote, exchange.accounts[exchange.quote]['balance'],
+        exchange.base, exchange.accounts[exchange.base]['balance']))
+    return exchange
+
+
+if __name__ == '__main__':
+    soak()
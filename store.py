@@ -0,0 +1,237 @@
+import os
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+"""
+
+Local candle store.
+
+One binary file per product and granularity, holding fixed-width records in
+the same column order as get_product_historic_rates():
+[ time, low, high, open, close, volume ].
+
+Only closed bars are ever written, so new bars are only appended to a file.
+History older than the first stored bar is written to a separate segment and
+merged in front of it in one step (prepend()), which shifts every stored bar:
+readers caching offsets into a file must check first_time() as well as its
+length. Reading the tail of a file is a
+single seek, so startup stays fast no matter how much history has been
+collected.
+
+"""
+
+CANDLE_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('low', '<f8'),
+    ('high', '<f8'),
+    ('open', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+])
+
+MAX_CANDLES = 200
+
+
+def to_iso(epoch):
+    """ Format epoch seconds as an ISO 8601 UTC string for the candles API. """
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def to_records(candles):
+    """ Convert candles into a sorted, de-duplicated CANDLE_DTYPE array.
+    Args:
+        candles (list/np.ndarray): Rows of [ time, low, high, open, close,
+            volume ], as returned by get_product_historic_rates(), or an
+            array already in CANDLE_DTYPE.
+    Returns:
+        np.ndarray: Records in ascending time order, one per timestamp.
+    """
+    if isinstance(candles, np.ndarray) and candles.dtype == CANDLE_DTYPE:
+        records = candles
+    else:
+        if not isinstance(candles, list):
+            raise ValueError('Expected a list of candles, got: {}'.format(candles))
+        rows = np.asarray(candles, dtype=np.float64).reshape(-1, len(CANDLE_DTYPE))
+        records = np.empty(len(rows), dtype=CANDLE_DTYPE)
+        for i, name in enumerate(CANDLE_DTYPE.names):
+            records[name] = rows[:, i]
+    _, index = np.unique(records['time'], return_index=True)
+    return records[index]
+
+
+def windows(start, end, granularity, size=MAX_CANDLES):
+    """ Split [start, end) into request windows of at most `size` bars.
+    Args:
+        start (int): Epoch seconds, aligned to `granularity`.
+        end (int): Epoch seconds, exclusive.
+        granularity (int): Bar size in seconds
+        size (Optional[int]): Bars per window. Default is 200.
+    Yields:
+        tuple: (window_start, window_end) epoch seconds, end exclusive.
+    """
+    while start < end:
+        stop = min(start + size * granularity, end)
+        yield start, stop
+        start = stop
+
+
+def fetch_window(client, product_id, granularity, start, end):
+    """ Fetch the bars opening in [start, end) as CANDLE_DTYPE records. """
+    # The candles endpoint treats `end` as inclusive.
+    candles = client.get_product_historic_rates(
+        product_id,
+        start=to_iso(start),
+        end=to_iso(end - granularity),
+        granularity=granularity
+    )
+    records = to_records(candles)
+    return records[(records['time'] >= start) & (records['time'] < end)]
+
+
+class CandleStore(object):
+    """ On-disk candle store, appended to as bars close and prepended to by
+    backfill.
+    Attributes:
+        root (str): Directory holding one file per product and granularity.
+    """
+
+    def __init__(self, root='./candles'):
+        self.root = root
+
+    def path(self, product_id, granularity):
+        return os.path.join(self.root, '{}-{}.bin'.format(product_id, granularity))
+
+    def count(self, product_id, granularity):
+        """ Number of bars stored for a product and granularity. """
+        path = self.path(product_id, granularity)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // CANDLE_DTYPE.itemsize
+
+    def load(self, product_id, granularity, count=None):
+        """ Read stored bars.
+        Args:
+            product_id (str): Product
+            granularity (int): Bar size in seconds
+            count (Optional[int]): Only read the most recent `count` bars.
+        Returns:
+            np.ndarray: Bars in CANDLE_DTYPE, ascending by time.
+        """
+        total = self.count(product_id, granularity)
+        if count is None or count > total:
+            count = total
+        if count == 0:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        with open(self.path(product_id, granularity), 'rb') as f:
+            f.seek((total - count) * CANDLE_DTYPE.itemsize)
+            return np.fromfile(f, dtype=CANDLE_DTYPE, count=count)
+
+    def last_time(self, product_id, granularity):
+        """ Open time of the newest stored bar, or None if the store is empty. """
+        last = self.load(product_id, granularity, count=1)
+        return int(last['time'][0]) if len(last) else None
+
+    def first_time(self, product_id, granularity):
+        """ Open time of the oldest stored bar, or None if the store is empty. """
+        if not self.count(product_id, granularity):
+            return None
+        first = np.fromfile(self.path(product_id, granularity), dtype=CANDLE_DTYPE, count=1)
+        return int(first['time'][0])
+
+    def prepend(self, product_id, granularity, segments):
+        """ Insert bars older than the first stored bar.
+        The older bars are streamed into a new segment file, the stored bars
+        are copied after them and the segment then replaces the file, so
+        readers see either the old file or the merged one.
+        Args:
+            product_id (str): Product
+            granularity (int): Bar size in seconds
+            segments (iterable): Arrays of bars in ascending order, e.g. from
+                backfill.iter_backfill(); bars not older than the first
+                stored bar are dropped.
+        Returns:
+            int: Number of bars written.
+        """
+        path = self.path(product_id, granularity)
+        first = self.first_time(product_id, granularity)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        written = 0
+        last = None
+        try:
+            with open(path + '.head', 'wb') as f:
+                for records in segments:
+                    records = to_records(records)
+                    if first is not None:
+                        records = records[records['time'] < first]
+                    if last is not None:
+                        records = records[records['time'] > last]
+                    if len(records):
+                        records.tofile(f)
+                        written += len(records)
+                        last = records['time'][-1]
+                if written and first is not None:
+                    with open(path, 'rb') as stored:
+                        while True:
+                            block = stored.read(2 ** 20 * CANDLE_DTYPE.itemsize)
+                            if not block:
+                                break
+                            f.write(block)
+            if written:
+                os.replace(path + '.head', path)
+        finally:
+            if os.path.exists(path + '.head'):
+                os.remove(path + '.head')
+        return written
+
+    def append(self, product_id, granularity, candles):
+        """ Append bars newer than the last stored bar.
+        Args:
+            product_id (str): Product
+            granularity (int): Bar size in seconds
+            candles (list/np.ndarray): Bars in any order, see to_records().
+        Returns:
+            np.ndarray: The bars actually written.
+        """
+        records = to_records(candles)
+        last = self.last_time(product_id, granularity)
+        if last is not None:
+            records = records[records['time'] > last]
+        if len(records):
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+            with open(self.path(product_id, granularity), 'ab') as f:
+                records.tofile(f)
+        return records
+
+    def update(self, client, product_id, granularity, lookback=MAX_CANDLES, now=None):
+        """ Fetch and append only the closed bars missing from the store.
+        An empty store is seeded with the last `lookback` bars. Requests are
+        split into windows of at most 200 candles.
+        Args:
+            client (PublicClient): Client used to call get_product_historic_rates.
+            product_id (str): Product
+            granularity (int): Bar size in seconds
+            lookback (Optional[int]): Bars to fetch when the store is empty.
+            now (Optional[float]): Current epoch time, defaults to time.time().
+        Returns:
+            np.ndarray: The bars appended.
+        """
+        if now is None:
+            now = time.time()
+        # Open time of the bar still in progress; it is never stored.
+        current = int(now) // granularity * granularity
+        last = self.last_time(product_id, granularity)
+        if last is None:
+            start = current - lookback * granularity
+        else:
+            start = last + granularity
+
+        written = []
+        for window_start, window_end in windows(start, current, granularity):
+            records = fetch_window(client, product_id, granularity, window_start, window_end)
+            written.append(self.append(product_id, granularity, records))
+        if not written:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return np.concatenate(written)
@@ -0,0 +1,103 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from backtest import backtest
+from indicators import crossover_table
+from store import CANDLE_DTYPE, CandleStore
+
+"""
+
+Parallel parameter sweep over the crossover backtest.
+
+Each worker process memory-maps the CandleStore file for a granularity
+instead of receiving a pickled copy, so every core reads the same pages from
+the OS cache. Tasks are grouped per granularity so all (fast, slow) pairs in a
+task share one cumulative sum, and the combined results come back ranked.
+
+"""
+
+_candles = {}
+
+
+def _load(path):
+    # One read-only map per file per worker process.
+    if path not in _candles:
+        _candles[path] = np.memmap(path, dtype=CANDLE_DTYPE, mode='r')
+    return _candles[path]
+
+
+def _run(task):
+    path, granularity, combos, kwargs = task
+    candles = _load(path)
+    close = np.ascontiguousarray(candles['close'])
+    pairs = sorted(set((fast, slow) for fast, slow, size in combos))
+    signals = dict(zip(pairs, crossover_table(close, pairs)))
+    results = []
+    for fast, slow, size in combos:
+        result = backtest(candles, avg1=fast, avg2=slow, size=size,
+                          granularity=granularity, signal=signals[(fast, slow)],
+                          **kwargs)
+        row = {'granularity': granularity, 'avg1': fast, 'avg2': slow, 'size': size}
+        row.update(result.stats)
+        results.append(row)
+    return results
+
+
+def sweep(product_id='BTC-USD', fast=(50,), slow=(100,), sizes=(0.001,),
+          granularities=(3600,), store=None, workers=None, chunk=16,
+          rank='sharpe', **kwargs):
+    """ Backtest every combination of parameters across a process pool.
+    Combinations where the fast window is not shorter than the slow one are
+    skipped.
+    Args:
+        product_id (Optional[str]): Product
+        fast (Optional[list]): Fast windows (History.avg1).
+        slow (Optional[list]): Slow windows (History.avg2).
+        sizes (Optional[list]): Order sizes (Account.size).
+        granularities (Optional[list]): Bar sizes; each must be in the store.
+        store (Optional[CandleStore]): Store holding the candles.
+        workers (Optional[int]): Processes. Defaults to os.cpu_count().
+        chunk (Optional[int]): Combinations per task.
+        rank (Optional[str]): Stat to sort by, descending.
+        **kwargs: Passed to backtest(), e.g. fee or cash.
+    Returns:
+        list: One dict of parameters and stats per combination, best first.
+    """
+    if store is None:
+        store = CandleStore()
+    combos = [(f, s, z) for f, s, z in itertools.product(fast, slow, sizes) if f < s]
+    tasks = []
+    for granularity in granularities:
+        path = store.path(product_id, granularity)
+        if not os.path.exists(path):
+            raise ValueError('No candles stored for {} at granularity {}'.format(
+                product_id, granularity))
+        for i in range(0, len(combos), chunk):
+            tasks.append((path, granularity, combos[i:i + chunk], kwargs))
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for rows in executor.map(_run, tasks):
+            results.extend(rows)
+    # NaN stats sort last.
+    results.sort(key=lambda x: -x[rank] if np.isfinite(x[rank]) else np.inf)
+    return results
+
+
+def format_table(results, limit=20):
+    """ Render ranked sweep results as a fixed-width text table. """
+    columns = ['granularity', 'avg1', 'avg2', 'size', 'total_return',
+               'annual_return', 'max_drawdown', 'sharpe', 'trades', 'fees']
+    lines = [' '.join('{:>13}'.format(c) for c in columns)]
+    for row in results[:limit]:
+        lines.append(' '.join(
+            '{:>13.4f}'.format(row[c]) if isinstance(row[c], float) else '{:>13}'.format(row[c])
+            for c in columns))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    results = sweep(fast=range(10, 100, 10), slow=range(50, 300, 25))
+    print(format_table(results))
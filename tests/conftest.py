@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cbpro
+import cbpro_async
+from store import CANDLE_DTYPE
+
+"""
+
+Shared fixtures: a scripted local HTTP server standing in for the REST API,
+clients pointed at it without rate limits or backoff sleeps, and random
+candles.
+
+"""
+
+
+class MockServer(object):
+    """ Local HTTP server answering from scripted routes.
+    Attributes:
+        routes (dict): By (method, path): a list of (status, body, headers)
+            responses, served in order with the last one repeated, or a
+            callable(query) returning one.
+        hits (list): (method, path, query, headers) of every request.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                parts = urlsplit(self.path)
+                query = dict((k, v[0]) for k, v in parse_qs(parts.query).items())
+                server.hits.append((self.command, parts.path, query, dict(self.headers)))
+                status, body, headers = server.respond(self.command, parts.path, query)
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_DELETE = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def route(self, method, path, *responses):
+        self.routes[(method, path)] = list(responses)
+
+    def respond(self, method, path, query):
+        responses = self.routes.get((method, path))
+        if responses is None:
+            return 404, {'message': 'NotFound'}, {}
+        if callable(responses):
+            return responses(query)
+        if len(responses) > 1:
+            return responses.pop(0)
+        return responses[0]
+
+    def count(self, path):
+        return sum(1 for hit in self.hits if hit[1] == path)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    server = MockServer()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # Retries happen at once; the waits themselves are covered by cbpro.backoff.
+    monkeypatch.setattr(cbpro, 'backoff', lambda attempt, retry_after=None: 0.)
+    monkeypatch.setattr(cbpro_async, 'backoff', lambda attempt, retry_after=None: 0.)
+
+
+def unlimited(client):
+    """ Give a client its own limiter with no practical limit. """
+    client.limiter = cbpro.RateLimiter(1e9, 1e9)
+    if getattr(client, 'session', None) is not None:
+        client.session.trust_env = False
+    return client
+
+
+def random_candles(count, start=1500000000 // 3600 * 3600, granularity=3600, seed=0):
+    """ `count` contiguous bars in CANDLE_DTYPE. """
+    rng = np.random.default_rng(seed)
+    bars = np.empty(count, dtype=CANDLE_DTYPE)
+    bars['time'] = start + np.arange(count) * granularity
+    close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.01, count)))
+    bars['open'] = np.concatenate([[close[0]], close[:-1]])
+    bars['close'] = close
+    bars['high'] = np.maximum(bars['open'], close)
+    bars['low'] = np.minimum(bars['open'], close)
+    bars['volume'] = 1.
+    return bars
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from backtest import backtest, step_positions
+from indicators import crossover_table
+from conftest import random_candles
+
+
+def reference(candles, avg1, avg2, size, cash, max_position, fee):
+    """ backtest() bar by bar: one order per bar, filled at the next open. """
+    signal = crossover_table(candles['close'], [(avg1, avg2)])[0]
+    position, stopped = 0., False
+    held, cashes = [], []
+    for t in range(len(candles)):
+        if t:
+            price = candles['open'][t]
+            if signal[t - 1] and not stopped and position < max_position - 1e-9:
+                if size * price * (1 + fee) <= cash:
+                    position += size
+                    cash -= size * price * (1 + fee)
+                else:
+                    stopped = True
+            elif not signal[t - 1] and position > 1e-9:
+                position -= size
+                cash += size * price * (1 - fee)
+            if not signal[t - 1]:
+                stopped = False
+        held.append(position)
+        cashes.append(cash)
+    return np.array(held), np.array(cashes)
+
+
+@pytest.mark.parametrize('cash', [1000., 50.])
+def test_backtest_matches_bar_by_bar(cash):
+    candles = random_candles(3000, seed=3)
+    result = backtest(candles, avg1=10, avg2=30, size=0.001, cash=cash, max_position=0.2)
+    held, cashes = reference(candles, 10, 30, 0.001, cash, 0.2, 0.005)
+    assert result.position == pytest.approx(held)
+    assert result.cash == pytest.approx(cashes)
+
+
+def test_fixed_max_position_never_borrows():
+    candles = random_candles(3000)
+    candles['open'] = candles['close'] = np.linspace(100., 1000., 3000)
+    result = backtest(candles)
+    assert result.cash.min() >= 0.
+    assert result.position.max() < 1.
+
+
+def test_step_positions_without_cash():
+    signal = np.array([True] * 4 + [False] * 2 + [True] * 3)
+    assert step_positions(signal, 3).tolist() == [1, 2, 3, 3, 2, 1, 2, 3, 3]
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+import cbpro
+# Bound before the autouse no_backoff fixture replaces cbpro.backoff.
+from cbpro import backoff
+from conftest import unlimited
+
+SECRET = 'c2VjcmV0'
+
+
+def public(server):
+    return unlimited(cbpro.PublicClient(server.url))
+
+
+def authenticated(server):
+    return unlimited(cbpro.AuthenticatedClient('key', SECRET, 'passphrase', api_url=server.url))
+
+
+def test_get_retries_rate_limit(server):
+    server.route('GET', '/time',
+                 (429, {'message': 'slow down'}, {'Retry-After': '0'}),
+                 (429, {'message': 'slow down'}, {}),
+                 (200, {'epoch': 1.5}, {}))
+    assert public(server).get_time() == {'epoch': 1.5}
+    assert server.count('/time') == 3
+
+
+def test_get_retries_html_gateway_error(server):
+    server.route('GET', '/time',
+                 (502, b'<html><body>Bad Gateway</body></html>', {'Content-Type': 'text/html'}),
+                 (200, {'epoch': 2.}, {}))
+    assert public(server).get_time() == {'epoch': 2.}
+    assert server.count('/time') == 2
+
+
+def test_get_gives_up_after_max_retries(server):
+    server.route('GET', '/time', (503, {'message': 'down'}, {}))
+    client = public(server)
+    with pytest.raises(cbpro.ServerError) as e:
+        client.get_time()
+    assert e.value.status_code == 503
+    assert e.value.message == 'down'
+    assert server.count('/time') == client.max_retries + 1
+
+
+def test_client_error_is_not_retried(server):
+    with pytest.raises(cbpro.CBProAPIError) as e:
+        public(server).get_product_ticker('XXX-USD')
+    assert e.value.status_code == 404
+    assert e.value.message == 'NotFound'
+    assert len(server.hits) == 1
+
+
+def test_post_is_not_retried_on_server_error(server):
+    server.route('POST', '/orders', (503, {'message': 'down'}, {}))
+    with pytest.raises(cbpro.ServerError):
+        authenticated(server).place_market_order('BTC-USD', 'buy', size=0.001)
+    assert server.count('/orders') == 1
+
+
+def test_post_is_retried_when_rate_limited(server):
+    server.route('POST', '/orders',
+                 (429, {'message': 'slow down'}, {}),
+                 (200, {'id': 'abc', 'status': 'pending'}, {}))
+    order = authenticated(server).place_market_order('BTC-USD', 'buy', size=0.001)
+    assert order['id'] == 'abc'
+    assert server.count('/orders') == 2
+
+
+def test_requests_are_signed(server):
+    server.route('GET', '/accounts/', (200, [], {}))
+    authenticated(server).get_accounts()
+    headers = server.hits[-1][3]
+    assert headers['CB-ACCESS-KEY'] == 'key'
+    assert headers['CB-ACCESS-PASSPHRASE'] == 'passphrase'
+    assert headers['CB-ACCESS-SIGN']
+
+
+def test_paginated_follows_cb_after(server):
+    def trades(query):
+        after = int(query.get('after', 3))
+        headers = {'cb-after': str(after - 1)} if after > 1 else {}
+        return 200, [{'trade_id': after}], headers
+    server.routes[('GET', '/products/BTC-USD/trades')] = trades
+    results = list(public(server).get_product_trades('BTC-USD'))
+    assert [x['trade_id'] for x in results] == [3, 2, 1]
+
+
+def test_sync_time_offsets_signatures(server):
+    offset = 100.
+    server.routes[('GET', '/time')] = lambda query: (200, {'epoch': time.time() + offset}, {})
+    client = authenticated(server)
+    assert abs(client.sync_time() - offset) < 1.
+    server.route('GET', '/accounts/', (200, [], {}))
+    client.get_accounts()
+    signed = float(server.hits[-1][3]['CB-ACCESS-TIMESTAMP'])
+    assert abs(signed - time.time() - offset) < 1.
+
+
+def test_backoff_honors_retry_after():
+    assert backoff(0, '5') == 5.
+    assert 0. <= backoff(3) <= 4.
+    assert 0. <= backoff(3, 'soon') <= 4.
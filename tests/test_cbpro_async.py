@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import cbpro
+from cbpro_async import AsyncPublicClient, AsyncAuthenticatedClient
+from candles import Candles
+from conftest import unlimited
+
+SECRET = 'c2VjcmV0'
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def call(server, method, *args, **kwargs):
+    """ Call a method of a fresh async public client and close it. """
+    async with unlimited(AsyncPublicClient(server.url, timeout=5)) as client:
+        return await getattr(client, method)(*args, **kwargs)
+
+
+def test_get(server):
+    server.route('GET', '/products/BTC-USD/ticker', (200, {'price': '100.5'}, {}))
+    assert run(call(server, 'get_product_ticker', 'BTC-USD')) == {'price': '100.5'}
+
+
+def test_get_retries_rate_limit(server):
+    server.route('GET', '/time',
+                 (429, {'message': 'slow down'}, {'Retry-After': '0'}),
+                 (200, {'epoch': 1.5}, {}))
+    assert run(call(server, 'get_time')) == {'epoch': 1.5}
+    assert server.count('/time') == 2
+
+
+def test_get_retries_html_gateway_error(server):
+    server.route('GET', '/time',
+                 (502, b'<html><body>Bad Gateway</body></html>', {'Content-Type': 'text/html'}),
+                 (200, {'epoch': 2.}, {}))
+    assert run(call(server, 'get_time')) == {'epoch': 2.}
+    assert server.count('/time') == 2
+
+
+def test_get_gives_up_after_max_retries(server):
+    server.route('GET', '/time', (502, b'Bad Gateway', {}))
+    with pytest.raises(cbpro.ServerError) as e:
+        run(call(server, 'get_time'))
+    assert e.value.message == 'Bad Gateway'
+    assert server.count('/time') == 4
+
+
+def test_client_error_is_not_retried(server):
+    with pytest.raises(cbpro.CBProAPIError) as e:
+        run(call(server, 'get_product_ticker', 'XXX-USD'))
+    assert e.value.status_code == 404
+    assert len(server.hits) == 1
+
+
+def test_post_is_not_retried_on_server_error(server):
+    server.route('POST', '/orders', (503, {'message': 'down'}, {}))
+
+    async def main():
+        async with unlimited(AsyncAuthenticatedClient('key', SECRET, 'passphrase',
+                                                      api_url=server.url)) as client:
+            await client.place_market_order('BTC-USD', 'buy', size=0.001)
+    with pytest.raises(cbpro.ServerError):
+        run(main())
+    assert server.count('/orders') == 1
+    assert server.hits[-1][3]['CB-ACCESS-SIGN']
+
+
+def test_timeout_is_retried_then_raised(server):
+    def slow(query):
+        time.sleep(0.3)
+        return 200, {}, {}
+    server.routes[('GET', '/time')] = slow
+
+    async def main():
+        async with unlimited(AsyncPublicClient(server.url, timeout=0.05)) as client:
+            client.max_retries = 1
+            await client.get_time()
+    with pytest.raises(asyncio.TimeoutError):
+        run(main())
+    assert server.count('/time') == 2
+
+
+def trades(query):
+    after = int(query.get('after', 3))
+    headers = {'cb-after': str(after - 1)} if after > 1 else {}
+    return 200, [{'trade_id': after}], headers
+
+
+def test_paginated(server):
+    server.routes[('GET', '/products/BTC-USD/trades')] = trades
+
+    async def main():
+        async with unlimited(AsyncPublicClient(server.url)) as client:
+            return [x async for x in client.get_product_trades('BTC-USD')]
+    assert [x['trade_id'] for x in run(main())] == [3, 2, 1]
+
+
+def test_dump_matches_sync_client(server, tmp_path):
+    server.routes[('GET', '/products/BTC-USD/trades')] = trades
+    sync_path = str(tmp_path / 'sync.jsonl')
+    async_path = str(tmp_path / 'async.jsonl')
+    unlimited(cbpro.PublicClient(server.url)).dump_product_trades('BTC-USD', sync_path)
+    result = run(call(server, 'dump_product_trades', 'BTC-USD', async_path))
+    assert result['pages'] == 3
+    with open(sync_path, 'rb') as a, open(async_path, 'rb') as b:
+        assert a.read() == b.read()
+    assert [x['trade_id'] for x in cbpro.read_dump(async_path)] == [3, 2, 1]
+
+
+def test_get_candles(server):
+    rows = [[1500003600, 1., 2., 1.5, 1.8, 10.], [1500000000, 1., 2., 1.2, 1.5, 5.]]
+    server.route('GET', '/products/BTC-USD/candles', (200, rows, {}))
+    candles = run(call(server, 'get_candles', 'BTC-USD', granularity=3600))
+    assert isinstance(candles, Candles)
+    assert candles.time.tolist() == [1500000000, 1500003600]
+    assert candles.close.tolist() == [1.5, 1.8]
+
+
+def test_gather_shares_one_session(server):
+    server.route('GET', '/products/BTC-USD/ticker', (200, {'price': '1'}, {}))
+    server.route('GET', '/accounts/', (200, [{'currency': 'USD'}], {}))
+
+    async def main():
+        async with unlimited(AsyncPublicClient(server.url)) as public:
+            private = unlimited(AsyncAuthenticatedClient('key', SECRET, 'passphrase',
+                                                         api_url=server.url,
+                                                         session=public._get_session()))
+            return await asyncio.gather(public.get_product_ticker('BTC-USD'),
+                                        private.get_accounts())
+    assert run(main()) == [{'price': '1'}, [{'currency': 'USD'}]]
+
+
+def test_sync_time(server):
+    offset = -50.
+    server.routes[('GET', '/time')] = lambda query: (200, {'epoch': time.time() + offset}, {})
+
+    async def main():
+        async with unlimited(AsyncAuthenticatedClient('key', SECRET, 'passphrase',
+                                                      api_url=server.url)) as client:
+            return await client.sync_time()
+    assert abs(run(main()) - offset) < 1.
@@ -0,0 +1,132 @@
+import cbpro
+from engine import Engine, Strategy, CrossoverStrategy, ArraySource, SimBroker, LiveBroker
+from simexchange import SimExchange
+from conftest import unlimited, random_candles
+
+
+def live_broker(exchange):
+    client = exchange.connect(unlimited(cbpro.AuthenticatedClient(
+        exchange.key, exchange.secret, exchange.passphrase)))
+    return LiveBroker(client)
+
+
+def test_rejected_order_is_logged_not_raised(caplog):
+    bars = random_candles(300)
+    # Fully long but for some USD dust: the balance reads as available.
+    exchange = SimExchange(bars, granularity=3600, balances={'USD': 0.5, 'BTC': 1.},
+                           start=int(bars['time'][200]) + 1)
+    broker = live_broker(exchange)
+    assert broker.available('USD') == 0.5
+    assert broker.buy('BTC-USD', 0.001) is None
+    assert 'Insufficient funds' in caplog.text
+    assert not exchange.orders
+    assert broker.sell('BTC-USD', 0.001)['id'] in exchange.orders
+
+
+def test_failed_balance_read_counts_as_none(caplog):
+    exchange = SimExchange(random_candles(10), granularity=3600)
+    broker = live_broker(exchange)
+    exchange.passphrase = 'changed'
+    assert broker.available('USD') == 0.
+    assert 'Invalid Passphrase' in caplog.text
+
+
+class Failing(Strategy):
+    """ Raises on every other bar. """
+
+    def __init__(self):
+        self.seen = []
+
+    def on_bar(self, product_id, bar):
+        self.seen.append(bar[0])
+        if len(self.seen) % 2:
+            raise RuntimeError('boom')
+
+
+def test_live_engine_carries_on_after_an_error(caplog):
+    bars = random_candles(6)
+    strategy = Failing()
+    engine = Engine(strategy, ArraySource('BTC-USD', bars), SimBroker(), halt_on_error=False).run()
+    assert strategy.seen == bars['time'].tolist()
+    assert engine.bars == 3
+    assert len([r for r in caplog.records if r.exc_info]) == 3
+
+
+def test_replay_buys_on_every_long_bar():
+    from indicators import crossover_table
+    bars = random_candles(1000)
+    broker = SimBroker({'USD': 1e6})
+    Engine(CrossoverStrategy(size=0.001), ArraySource('BTC-USD', bars), broker).run()
+    signal = crossover_table(bars['close'], [(50, 100)])[0]
+    assert sum(order['side'] == 'buy' for order in broker.orders) == signal.sum()
+
+
+class Recording(Strategy):
+    """ Records what the engine hands it. """
+
+    def __init__(self):
+        self.history = []
+        self.traded = []
+
+    def warmup(self, product_id, candles):
+        self.history.extend(candles['time'].tolist())
+
+    def on_bar(self, product_id, bar):
+        self.traded.append(bar[0])
+
+
+def test_rest_source_trades_only_the_newest_bar_after_a_stall(tmp_path):
+    from engine import RestSource
+    from store import CandleStore
+    bars = random_candles(300)
+    exchange = SimExchange(bars, granularity=3600, start=int(bars['time'][200]) + 1)
+    client = exchange.connect(unlimited(cbpro.PublicClient()))
+    source = RestSource('BTC-USD', 3600, client=client, store=CandleStore(str(tmp_path)),
+                        lookback=50, clock=exchange.clock)
+    strategy = Recording()
+    engine = Engine(strategy, source, SimBroker())
+    engine.start()
+    warm = len(strategy.history)
+    exchange.advance(5 * 3600)
+    source.poll()
+    for product_id, bar in source.drain():
+        engine.on_bar(product_id, bar)
+    times = bars['time'].tolist()
+    assert strategy.history[warm:] == times[200:204]
+    assert strategy.traded == [times[204]]
+
+
+def test_live_broker_sends_through_the_executor(caplog):
+    from execution import Executor, ExecutionReport
+    from orderbook import OrderBook
+    bars = random_candles(300)
+    exchange = SimExchange(bars, granularity=3600, balances={'USD': 1000.},
+                           start=int(bars['time'][200]) + 1)
+    client = exchange.connect(unlimited(cbpro.AuthenticatedClient(
+        exchange.key, exchange.secret, exchange.passphrase)))
+    book = OrderBook('BTC-USD')
+    book.load_snapshot({'bids': [['99', '1']], 'asks': [['101', '1']]})
+    executor = Executor(client, 'BTC-USD', book=book, max_impact=0.05)
+    broker = LiveBroker(client, executors={'BTC-USD': executor})
+    assert executor.orders is broker.orders
+    report = broker.buy('BTC-USD', 0.01)
+    assert isinstance(report, ExecutionReport) and report.method == 'market'
+    assert broker.orders.get(report.orders[0]['id']) is not None
+    assert 'BTC-USD buy 0.01 expected at 101.0 for 0.01 on the book' in caplog.text
+
+
+def test_fill_latency_is_recorded_when_the_order_fills(monkeypatch):
+    from metrics import metrics
+    monkeypatch.setattr(metrics, 'enabled', True)
+    monkeypatch.setattr(metrics, 'histograms', {})
+    bars = random_candles(300)
+    exchange = SimExchange(bars, granularity=3600, balances={'USD': 1000.},
+                           start=int(bars['time'][200]) + 1)
+    broker = live_broker(exchange)
+    fills = []
+    broker.on_fill = fills.append
+    order = broker.buy('BTC-USD', 0.01)
+    assert [fill['order_id'] for fill in fills] == [order['id']]
+    assert not broker.placed
+    fill, = [h for h in metrics.snapshot() if h['labels'] == {'stage': 'fill'}]
+    assert fill['count'] == 1 and fill['sum'] < 1.
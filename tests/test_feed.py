@@ -0,0 +1,140 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip('websockets')
+
+from feed import WebsocketFeed, ReplayServer, BarAggregator, parse_time
+
+
+def stamp(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def match(trade_id, price, epoch, product_id='BTC-USD', size='0.5'):
+    return {'type': 'match', 'product_id': product_id, 'trade_id': trade_id,
+            'sequence': trade_id * 3, 'price': str(price), 'size': size, 'time': stamp(epoch)}
+
+
+def replay(messages, expected, channels=('matches',)):
+    """ Serve `messages` from a ReplayServer to a WebsocketFeed.
+    Returns:
+        tuple: (feed, messages received by on_message, gaps reported)
+    """
+    received = []
+    gaps = []
+
+    async def main():
+        async with ReplayServer(messages) as server:
+            feed = WebsocketFeed(['BTC-USD'], channels, url=server.url,
+                                 on_message=received.append,
+                                 on_gap=lambda *gap: gaps.append(gap))
+            task = asyncio.ensure_future(feed.run())
+            for _ in range(500):
+                if len(received) >= expected:
+                    break
+                await asyncio.sleep(0.01)
+            feed.stop()
+            await asyncio.wait_for(task, 5)
+        return feed
+    feed = asyncio.run(main())
+    return feed, [m for m in received if m.get('type') != 'subscriptions'], gaps
+
+
+def test_replay_drops_duplicates_and_reports_gaps():
+    messages = [match(i, 100 + i, 1700000000 + i) for i in range(1, 11)]
+    # Trade 5 arrives twice and trade 8 never does.
+    messages.insert(5, match(5, 105, 1700000005))
+    del messages[8]
+    feed, received, gaps = replay(messages, expected=1 + 9)
+    assert [m['trade_id'] for m in received] == [1, 2, 3, 4, 5, 6, 7, 9, 10]
+    assert gaps == [('BTC-USD', 8, 9)]
+    assert feed.gaps == 1
+
+
+def test_replay_skips_other_products():
+    messages = [match(1, 100, 1700000000), match(1, 5, 1700000000, product_id='ETH-USD'),
+                match(2, 101, 1700000001)]
+    feed, received, gaps = replay(messages, expected=1 + 2)
+    assert [(m['product_id'], m['trade_id']) for m in received] == [('BTC-USD', 1), ('BTC-USD', 2)]
+
+
+def test_ticker_and_match_sequences_are_tracked_per_channel():
+    feed = WebsocketFeed(['BTC-USD'], ['matches', 'ticker'])
+    ticker = {'type': 'ticker', 'product_id': 'BTC-USD', 'sequence': 3, 'price': '100'}
+    assert feed.handle(match(1, 100, 1700000000))
+    # The ticker carries the sequence of the match behind it.
+    assert feed.handle(ticker)
+    assert not feed.handle(dict(ticker))
+    assert feed.handle(match(2, 101, 1700000001))
+    assert feed.gaps == 0
+
+
+def test_full_channel_gap_by_sequence():
+    feed = WebsocketFeed(['BTC-USD'], ['full'])
+    gaps = []
+    feed.on_gap = lambda *gap: gaps.append(gap)
+    for sequence in (10, 11, 14):
+        feed.handle({'type': 'received', 'product_id': 'BTC-USD', 'sequence': sequence})
+    assert gaps == [('BTC-USD', 12, 14)]
+
+
+def test_bar_aggregator():
+    bars = []
+    aggregator = BarAggregator(60, lambda product_id, bar: bars.append((product_id, bar)))
+    start = 1700000040 // 60 * 60
+    for i, (price, offset) in enumerate([(100, 1), (103, 20), (99, 40), (101, 61)]):
+        aggregator.on_message(match(i + 1, price, start + offset))
+    assert bars == [('BTC-USD', [start, 99., 103., 100., 99., 1.5])]
+    aggregator.flush(start + 180)
+    assert bars[-1] == ('BTC-USD', [start + 60, 101., 101., 101., 101., 0.5])
+
+
+def test_parse_time():
+    assert parse_time('2017-07-14T02:40:00.000Z') == 1500000000.
+
+
+def test_signed_subscription():
+    import cbpro
+    auth = cbpro.CBProAuth('key', 'c2VjcmV0', 'passphrase')
+    msg = WebsocketFeed(['BTC-USD'], ['user'], auth=auth).subscription()
+    assert (msg['key'], msg['passphrase']) == ('key', 'passphrase')
+    assert msg['signature'] == cbpro.get_auth_headers(
+        msg['timestamp'], msg['timestamp'] + 'GET/users/self/verify',
+        'key', 'c2VjcmV0', 'passphrase')['CB-ACCESS-SIGN']
+    assert 'signature' not in WebsocketFeed(['BTC-USD']).subscription()
+
+
+def test_stop_from_another_thread():
+    import threading
+    import time
+    import websockets
+    received = []
+    errors = []
+    feed = WebsocketFeed(['BTC-USD'], on_message=received.append)
+
+    async def serve(ws, *args):
+        await ws.recv()
+        await ws.send(json.dumps(match(1, 100, 1700000000)))
+        # Unlike ReplayServer, hold the connection open until the client closes it.
+        await ws.wait_closed()
+
+    async def main():
+        async with websockets.serve(serve, '127.0.0.1', 0) as server:
+            feed.url = 'ws://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1])
+            try:
+                await asyncio.wait_for(feed.run(), 5)
+            except Exception as e:
+                errors.append(e)
+    thread = threading.Thread(target=asyncio.run, args=(main(),))
+    thread.start()
+    for _ in range(500):
+        if received:
+            break
+        time.sleep(0.01)
+    feed.stop()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert not errors and feed.ws is None
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from indicators import sma, sma_table, crossover_table, RollingMeans, Crossover
+
+
+def test_sma_uses_partial_windows_first():
+    values = np.arange(1., 7.)
+    assert sma(values, 3).tolist() == [1., 1.5, 2., 3., 4., 5.]
+    assert sma(values, 10).tolist() == [1., 1.5, 2., 2.5, 3., 3.5]
+
+
+def test_sma_table_matches_means():
+    values = np.random.default_rng(0).normal(1000., 10., 500)
+    table = sma_table(values, [5, 50])
+    for row, window in zip(table, [5, 50]):
+        expected = [values[max(i + 1 - window, 0):i + 1].mean() for i in range(len(values))]
+        assert row == pytest.approx(expected)
+
+
+def test_rolling_means_match_the_table():
+    values = np.random.default_rng(1).normal(1000., 10., 700)
+    means = RollingMeans([3, 50, 200], values[:100], resync=97)
+    rows = []
+    for value in values[100:]:
+        means.update(value)
+        rows.append(means.means)
+    table = sma_table(values, [3, 50, 200])[:, 100:].T
+    assert np.array(rows) == pytest.approx(table)
+    assert means.count == 700
+
+
+def test_rolling_means_extend_longer_than_the_buffer():
+    values = np.arange(1000.)
+    means = RollingMeans([10, 100])
+    means.extend(values[:30])
+    means.extend(values[30:])
+    assert means.means == pytest.approx([values[-10:].mean(), values[-100:].mean()])
+
+
+def test_crossover_follows_crossover_table():
+    values = 1000 + np.cumsum(np.random.default_rng(2).normal(0, 5, 600))
+    table = crossover_table(values, [(10, 40)])[0]
+    crossover = Crossover(10, 40, values[:1])
+    signals = [crossover.long]
+    for value in values[1:]:
+        crossover.update(value)
+        signals.append(crossover.long)
+    assert signals == table.tolist()
@@ -0,0 +1,67 @@
+import json
+import random
+
+import pytest
+
+import orderbook
+from orderbook import OrderBook, SortedKeys, replay
+
+
+def write_lines(path, messages):
+    with open(path, 'w') as f:
+        for msg in messages:
+            f.write(json.dumps(msg) + '\n')
+    return str(path)
+
+
+def test_replay(tmp_path):
+    path = write_lines(tmp_path / 'l2.jsonl', [
+        {'type': 'snapshot', 'product_id': 'BTC-USD',
+         'bids': [['99.00', '1.0'], ['98.50', '2.0'], ['98.00', '3.0']],
+         'asks': [['101.00', '1.0'], ['101.50', '2.0']]},
+        {'type': 'l2update', 'product_id': 'BTC-USD',
+         'changes': [['buy', '99.50', '0.5'], ['sell', '101.00', '0']]},
+        {'type': 'l2update', 'product_id': 'ETH-USD', 'changes': [['buy', '500', '1']]},
+        {'type': 'l2update', 'product_id': 'BTC-USD', 'changes': [['buy', '98.50', '0']]},
+    ])
+    book = replay(path, 'BTC-USD')
+    assert book.best_bid == (99.5, 0.5)
+    assert book.best_ask == (101.5, 2.0)
+    assert book.spread == 2.0
+    assert book.mid == 100.5
+    assert list(book.bids.levels()) == [(99.5, 0.5), (99.0, 1.0), (98.0, 3.0)]
+    assert book.size_at('500', 'buy') == 0.
+    assert book.depth('buy', 99.) == 1.5
+
+
+def test_vwap_and_impact():
+    book = OrderBook('BTC-USD')
+    book.load_snapshot({'bids': [['99', '1']], 'asks': [['101', '1'], ['102', '1']]})
+    assert book.vwap('buy', 1.5) == (pytest.approx(101 + 1 / 3.), 1.5)
+    assert book.vwap('buy', 5) == (101.5, 2.)
+    assert book.vwap('sell', 0.5) == (99., 0.5)
+    assert book.impact('buy', 1.) == pytest.approx(0.01)
+    assert OrderBook().vwap('buy', 1.) == (None, 0.)
+
+
+@pytest.mark.parametrize('load', [3, 256])
+def test_sorted_keys_under_random_updates(monkeypatch, load):
+    monkeypatch.setattr(orderbook, 'LOAD', load)
+    rng = random.Random(load)
+    present = set(rng.sample(range(5000), 1000))
+    keys = SortedKeys(present)
+    for _ in range(5000):
+        key = rng.randrange(5000)
+        if key in present:
+            keys.remove(key)
+            present.discard(key)
+        else:
+            keys.add(key)
+            present.add(key)
+    ordered = sorted(present)
+    assert list(keys) == ordered
+    assert list(reversed(keys)) == ordered[::-1]
+    assert len(keys) == len(ordered)
+    assert keys.last() == ordered[-1]
+    assert keys.maxes == [chunk[-1] for chunk in keys.chunks]
+    assert all(0 < len(chunk) <= 2 * load for chunk in keys.chunks)
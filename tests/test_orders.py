@@ -0,0 +1,61 @@
+import cbpro
+from orders import OrderTracker
+from conftest import unlimited
+
+
+class Fills(object):
+    """ The fills endpoint over trade ids 1..last, newest first. """
+
+    def __init__(self, last):
+        self.last = last
+
+    def fill(self, trade_id):
+        order_id = 'order-{}'.format(trade_id)
+        return {'trade_id': trade_id, 'product_id': 'BTC-USD', 'order_id': order_id,
+                'price': '100', 'size': '0.01', 'side': 'buy'}
+
+    def __call__(self, query):
+        limit = int(query.get('limit', 100))
+        if 'before' in query:
+            ids = range(int(query['before']) + 1, self.last + 1)[:limit]
+            return 200, [self.fill(i) for i in reversed(ids)], {}
+        top = int(query.get('after', self.last + 1)) - 1
+        ids = range(top, max(top - limit, 0), -1)
+        headers = {'cb-after': str(ids[-1])} if ids and ids[-1] > 1 else {}
+        return 200, [self.fill(i) for i in ids], headers
+
+
+def test_seeded_tracker_polls_only_new_fills(server):
+    fills = Fills(1000)
+    server.routes[('GET', '/fills')] = fills
+    client = unlimited(cbpro.AuthenticatedClient('key', 'c2VjcmV0', 'passphrase',
+                                                 api_url=server.url))
+    tracker = OrderTracker(client)
+    tracker.seed('BTC-USD')
+    tracker.seed('BTC-USD')
+    assert server.count('/fills') == 1 and server.hits[-1][2]['limit'] == '1'
+    assert tracker.last_trade_id == {'BTC-USD': 1000}
+
+    handle = tracker.track({'id': 'order-1001', 'product_id': 'BTC-USD', 'size': '0.01'})
+    fills.last = 1001
+    assert tracker.poll_fills('BTC-USD') == 1
+    assert handle.wait(0)['filled_size'] == 0.01
+    assert server.count('/fills') == 2 and server.hits[-1][2]['before'] == '1000'
+
+
+def test_user_channel_messages():
+    tracker = OrderTracker()
+    fills = []
+    tracker.on_fill = fills.append
+    # The channel can report an order before place_order() returns.
+    tracker.on_message({'type': 'received', 'order_id': 'a', 'client_oid': 'c', 'side': 'buy',
+                        'product_id': 'BTC-USD', 'size': '0.02'})
+    tracker.on_message({'type': 'match', 'trade_id': 7, 'taker_order_id': 'a',
+                        'maker_order_id': 'other', 'product_id': 'BTC-USD',
+                        'price': '100', 'size': '0.02', 'side': 'sell'})
+    handle = tracker.track({'id': 'a', 'status': 'pending'})
+    assert tracker.get('c') is handle and not handle.done
+    tracker.on_message({'type': 'done', 'order_id': 'a', 'reason': 'filled'})
+    assert handle.wait(0)['done_reason'] == 'filled'
+    assert [fill['side'] for fill in fills] == ['buy']
+    assert not tracker.open_orders()
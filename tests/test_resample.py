@@ -0,0 +1,29 @@
+import numpy as np
+
+from resample import TimeframeCache, resample
+from store import CandleStore
+from conftest import random_candles
+
+
+def test_cache_extends_with_appended_bars(tmp_path):
+    store = CandleStore(str(tmp_path))
+    minutes = random_candles(600, start=1500000000 // 3600 * 3600, granularity=60)
+    store.append('BTC-USD', 60, minutes[:250])
+    cache = TimeframeCache(store)
+    assert cache.get('BTC-USD', 3600)['time'].tolist() == minutes['time'][:240:60].tolist()
+    store.append('BTC-USD', 60, minutes[250:])
+    hourly = cache.get('BTC-USD', 3600, partial=True)
+    assert np.array_equal(hourly, resample(minutes, 3600))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_rebuilds_after_prepend(tmp_path):
+    store = CandleStore(str(tmp_path))
+    minutes = random_candles(240, start=1500000000 // 3600 * 3600, granularity=60)
+    store.append('BTC-USD', 60, minutes[120:])
+    cache = TimeframeCache(store)
+    assert cache.get('BTC-USD', 3600, partial=True)['time'].tolist() == minutes['time'][120::60].tolist()
+    store.prepend('BTC-USD', 60, [minutes[:120]])
+    hourly = cache.get('BTC-USD', 3600, partial=True)
+    assert hourly['time'].tolist() == minutes['time'][::60].tolist()
+    assert np.array_equal(hourly, resample(minutes, 3600))
@@ -0,0 +1,32 @@
+import cbpro
+from runner import MultiRunner
+from simexchange import SimExchange
+from store import CandleStore
+from conftest import unlimited, random_candles
+
+
+def test_step_skips_products_whose_update_failed(tmp_path, caplog):
+    bars = random_candles(300)
+    exchange = SimExchange(bars, granularity=3600, balances={'USD': 1000.},
+                           start=int(bars['time'][200]) + 1)
+    auth_client = exchange.connect(unlimited(cbpro.AuthenticatedClient(
+        exchange.key, exchange.secret, exchange.passphrase)))
+    runner = MultiRunner(['BTC-USD', 'ETH-USD'], auth_client=auth_client,
+                         store=CandleStore(str(tmp_path)), sizes={'BTC-USD': 0.01})
+    rising = bars[:150].copy()
+    rising['close'] = range(1, 151)
+    for product_id, history in runner.histories.items():
+        for bar in rising.tolist():
+            history.on_bar(product_id, bar)
+        assert history.signal()
+    runner.histories['BTC-USD'].update = lambda: None
+
+    def down():
+        raise IOError('candles unavailable')
+    runner.histories['ETH-USD'].update = down
+
+    orders = runner.step()
+    assert list(orders) == ['BTC-USD']
+    assert exchange.orders[orders['BTC-USD']['id']]['size'] == 0.01
+    assert 'ETH-USD candle update failed: candles unavailable' in caplog.text
+    assert 'ETH-USD buy' not in caplog.text
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from scheduler import Scheduler, Job
+
+
+class Clock(object):
+    """ A wall clock moved by hand. """
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_fires_on_boundaries_after_delay():
+    clock = Clock(1500000000 + 10)
+    scheduler = Scheduler(clock=clock)
+    fired = []
+    scheduler.every(60, fired.append, delay=1.)
+    assert scheduler.run_pending() == 0
+    clock.now = 1500000060
+    assert scheduler.run_pending() == 0
+    clock.now = 1500000061
+    assert scheduler.run_pending() == 1
+    assert fired == [1500000060]
+    assert scheduler.jobs[0][2].due() == 1500000121
+
+
+@pytest.mark.parametrize('catch_up, expected', [
+    (True, [1500000060, 1500000120, 1500000180]),
+    (False, [1500000180]),
+])
+def test_missed_boundaries(catch_up, expected, caplog):
+    clock = Clock(1500000000)
+    scheduler = Scheduler(clock=clock)
+    fired = []
+    scheduler.every(60, fired.append, catch_up=catch_up)
+    clock.now = 1500000200
+    scheduler.run_pending()
+    assert fired == expected
+    assert '2 missed bar boundaries' in caplog.text
+    assert scheduler.jobs[0][2].next == 1500000240
+
+
+def test_failing_job_is_logged_and_rescheduled(caplog):
+    clock = Clock(1500000000)
+    scheduler = Scheduler(clock=clock)
+
+    def fail(boundary):
+        raise RuntimeError('boom')
+    scheduler.every(60, fail)
+    clock.now = 1500000060
+    assert scheduler.run_pending() == 1
+    assert 'scheduled job failed at 1500000060' in caplog.text
+    assert scheduler.jobs[0][2].next == 1500000120
+
+
+def test_run_until_stopped():
+    clock = Clock(1500000059.99)
+    scheduler = Scheduler(clock=clock)
+    fired = []
+
+    def once(boundary):
+        fired.append(boundary)
+        scheduler.stop()
+    scheduler.every(60, once)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    clock.now = 1500000060
+    thread.join(5)
+    assert fired == [1500000060]
+
+
+def test_rejects_unknown_granularity():
+    with pytest.raises(ValueError):
+        Job(7200, print)
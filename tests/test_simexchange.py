@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import cbpro
+import simexchange
+from simexchange import SimExchange
+from conftest import unlimited, random_candles
+
+
+@pytest.fixture
+def exchange():
+    bars = random_candles(300)
+    exchange = SimExchange(bars, granularity=3600, balances={'USD': 1000.},
+                           start=int(bars['time'][200]) + 1)
+    yield exchange
+    exchange.stop()
+
+
+def test_market_order_in_process(exchange):
+    client = exchange.connect(unlimited(cbpro.AuthenticatedClient(
+        exchange.key, exchange.secret, exchange.passphrase)))
+    order = client.place_market_order('BTC-USD', 'buy', size=0.01)
+    assert client.get_order(order['id'])['status'] == 'done'
+    fills = list(client.get_fills(product_id='BTC-USD'))
+    assert len(fills) == 1 and float(fills[0]['size']) == 0.01
+    balances = dict((a['currency'], float(a['balance'])) for a in client.get_accounts())
+    assert balances['BTC'] == pytest.approx(0.01)
+    assert balances['USD'] < 1000.
+
+
+def test_rejects_bad_signature(exchange):
+    client = exchange.connect(unlimited(cbpro.AuthenticatedClient(
+        exchange.key, 'c2VjcmV0', exchange.passphrase)))
+    with pytest.raises(cbpro.CBProAPIError) as e:
+        client.get_accounts()
+    assert e.value.status_code == 401
+
+
+def test_sync_time_follows_simulated_clock(exchange):
+    exchange.start()
+    client = unlimited(cbpro.AuthenticatedClient(exchange.key, exchange.secret,
+                                                 exchange.passphrase, api_url=exchange.url))
+    client.sync_time()
+    # Timestamps now follow the simulated clock, years behind the wall clock.
+    exchange.max_skew = 5.
+    assert client.get_accounts()
+
+
+def test_async_client_over_http(exchange):
+    pytest.importorskip('aiohttp')
+    from cbpro_async import AsyncPublicClient, AsyncAuthenticatedClient
+    exchange.start()
+
+    async def main():
+        async with unlimited(AsyncPublicClient(exchange.url)) as public:
+            private = unlimited(AsyncAuthenticatedClient(
+                exchange.key, exchange.secret, exchange.passphrase,
+                api_url=exchange.url, session=public._get_session()))
+            candles = await public.get_candles('BTC-USD', granularity=3600)
+            order = await private.place_market_order('BTC-USD', 'buy', size=0.01)
+            with pytest.raises(cbpro.CBProAPIError) as e:
+                await private.place_market_order('BTC-USD', 'sell', size=1.)
+            return candles, order, e.value
+    candles, order, error = asyncio.run(main())
+    assert len(candles) and candles.time[-1] < exchange.now
+    assert exchange.orders[order['id']]['status'] == 'done'
+    assert (error.status_code, error.message) == (400, 'Insufficient funds')
+
+
+def test_soak_runs_the_live_engine(capsys):
+    exchange = simexchange.soak(cycles=300)
+    assert exchange.fills
+    assert '300 cycles' in capsys.readouterr().out
+    assert exchange.accounts['USD']['balance'] >= 0.
+    assert exchange.accounts['BTC']['balance'] >= 0.
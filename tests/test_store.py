@@ -0,0 +1,68 @@
+import numpy as np
+
+import cbpro
+from backfill import backfill, fill_gaps
+from simexchange import SimExchange
+from store import CandleStore, to_records
+from conftest import unlimited, random_candles
+
+
+def candle_client(bars):
+    """ A PublicClient served candles by a SimExchange, positioned after `bars`. """
+    exchange = SimExchange(bars, granularity=3600, start=int(bars['time'][-1]) + 3600 + 1)
+    return exchange, exchange.connect(unlimited(cbpro.PublicClient()))
+
+
+def test_append_and_load(tmp_path):
+    store = CandleStore(str(tmp_path))
+    bars = random_candles(10)
+    assert store.last_time('BTC-USD', 3600) is None
+    assert len(store.append('BTC-USD', 3600, bars[5:])) == 5
+    # Rows as the API returns them, newest first; only newer bars are kept.
+    assert len(store.append('BTC-USD', 3600, bars[::-1].tolist())) == 0
+    assert store.count('BTC-USD', 3600) == 5
+    assert np.array_equal(store.load('BTC-USD', 3600, count=2), bars[-2:])
+    assert (store.first_time('BTC-USD', 3600), store.last_time('BTC-USD', 3600)) == (
+        bars['time'][5], bars['time'][-1])
+
+
+def test_update_fetches_only_missing_bars(tmp_path):
+    bars = random_candles(700)
+    exchange, client = candle_client(bars)
+    store = CandleStore(str(tmp_path))
+    now = int(bars['time'][499]) + 3600 + 1
+    assert np.array_equal(store.update(client, 'BTC-USD', 3600, lookback=300, now=now),
+                          bars[200:500])
+    now = int(bars['time'][-1]) + 3600 + 1
+    assert np.array_equal(store.update(client, 'BTC-USD', 3600, now=now), bars[500:])
+    assert len(store.update(client, 'BTC-USD', 3600, now=now)) == 0
+    assert np.array_equal(store.load('BTC-USD', 3600), bars[200:])
+
+
+def test_prepend_keeps_the_file_in_order(tmp_path):
+    store = CandleStore(str(tmp_path))
+    bars = random_candles(100)
+    store.append('BTC-USD', 3600, bars[50:])
+    # Overlapping and out of order segments: only older bars are written.
+    assert store.prepend('BTC-USD', 3600, [bars[:30], bars[20:60]]) == 50
+    assert np.array_equal(store.load('BTC-USD', 3600), bars)
+    assert store.prepend('BTC-USD', 3600, [bars[10:]]) == 0
+    assert not [name for name in tmp_path.iterdir() if name.suffix == '.head']
+
+
+def test_backfill_extends_both_ends(tmp_path):
+    bars = random_candles(1000)
+    exchange, client = candle_client(bars)
+    store = CandleStore(str(tmp_path))
+    times = bars['time']
+    assert backfill('BTC-USD', times[400], times[600], 3600, store, client=client) == 200
+    assert backfill('BTC-USD', times[0], times[-1] + 3600, 3600, store, client=client) == 800
+    assert np.array_equal(store.load('BTC-USD', 3600), bars)
+
+
+def test_fill_gaps():
+    bars = to_records([[0, 1, 2, 1, 1.5, 1], [180, 2, 3, 2, 2.5, 1]])
+    filled = fill_gaps(bars, 60)
+    assert filled['time'].tolist() == [0, 60, 120, 180]
+    assert filled['close'].tolist() == [1.5, 1.5, 1.5, 2.5]
+    assert filled['volume'].tolist() == [1, 0, 0, 1]
@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from trades import TradeArchive, to_trades, time_bars
+
+
+def trade(trade_id):
+    # One trade a second.
+    stamp = datetime.fromtimestamp(1500000000 + trade_id, timezone.utc)
+    return {'trade_id': trade_id, 'time': stamp.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'price': str(100. + trade_id), 'size': '0.5', 'side': 'buy'}
+
+
+class Tape(object):
+    """ The trades endpoint over ids 1..latest, failing after `fail_after` pages. """
+
+    def __init__(self, latest, fail_after=None):
+        self.latest = latest
+        self.fail_after = fail_after
+        self.pages = 0
+
+    def get_product_ticker(self, product_id):
+        return {'trade_id': self.latest}
+
+    def _send_message(self, method, endpoint, params=None):
+        if self.fail_after is not None and self.pages >= self.fail_after:
+            raise IOError('connection reset')
+        self.pages += 1
+        after = min(params['after'], self.latest + 1)
+        return [trade(i) for i in range(after - 1, max(after - 1 - params['limit'], 0), -1)]
+
+
+def test_interrupted_update_leaves_no_hole(tmp_path):
+    archive = TradeArchive(str(tmp_path), chunk=200)
+    assert archive.fetch(Tape(1000), 'BTC-USD', 1, 1000) == 1000
+    tape = Tape(2000, fail_after=5)
+    with pytest.raises(IOError):
+        archive.update(tape, 'BTC-USD', workers=1)
+    ids = archive.load('BTC-USD')['trade_id']
+    assert ids.tolist() == list(range(1, len(ids) + 1))
+    assert len(ids) > 1000
+    tape.fail_after = None
+    archive.update(tape, 'BTC-USD', workers=1)
+    assert archive.load('BTC-USD')['trade_id'].tolist() == list(range(1, 2001))
+    assert archive.bounds('BTC-USD') == (1, 2000)
+
+
+def test_backfill_and_time_bars(tmp_path):
+    archive = TradeArchive(str(tmp_path), chunk=150)
+    tape = Tape(450)
+    assert archive.backfill(tape, 'BTC-USD', down_to=301) == 150
+    assert archive.backfill(tape, 'BTC-USD') == 300
+    trades = archive.load('BTC-USD')
+    assert trades['trade_id'].tolist() == list(range(1, 451))
+    bars = time_bars(trades, 60)
+    assert bars['volume'].sum() == 225.
+    assert bars['open'][0] == 101. and bars['close'][-1] == 550.
+
+
+def test_to_trades_sorts_and_drops_duplicates():
+    trades = to_trades([trade(3), trade(1), trade(3)])
+    assert trades['trade_id'].tolist() == [1, 3]
+    assert trades['side'].tolist() == [1, 1]